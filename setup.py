@@ -32,6 +32,7 @@ extras = {
         "cchardet >= 2.1.7; python_version < '3.11'",  # build issue
         "faust-cchardet >= 2.1.18; python_version >= '3.11'",  # fix for build
         "htmldate[speed] >= 1.4.3",
+        "numpy >= 1.17",
         "py3langid >= 0.2.2",
         "pycurl >= 7.45.2",
     ],
@@ -0,0 +1,167 @@
+"""
+Time selected parts of the extraction pipeline on the cached documents.
+Run as a script: python3 benchmarks.py
+"""
+
+import os
+import time
+
+from copy import deepcopy
+from hashlib import blake2b
+from operator import add
+
+from lxml import html
+
+from trafilatura import baseline, extract, hashing, xpaths
+from trafilatura.core import Extractor
+from trafilatura.htmlprocessing import (NodeStats, convert_tags, delete_by_link_density,
+                                        normalize_tree, tree_cleaning)
+from trafilatura.hashing import Simhash, sample_tokens
+from trafilatura.settings import DEFAULT_CONFIG
+from trafilatura.utils import StreamLoader, load_html
+
+
+TEST_DIR = os.path.abspath(os.path.dirname(__file__))
+CACHE_DIR = os.path.join(TEST_DIR, 'cache')
+
+
+def load_documents():
+    '''Read all cached HTML documents as bytes'''
+    documents = []
+    for filename in sorted(os.listdir(CACHE_DIR)):
+        with open(os.path.join(CACHE_DIR, filename), 'rb') as inputf:
+            documents.append(inputf.read())
+    return documents
+
+
+def timed(func, documents, rounds=3):
+    '''Return the best total time of several rounds over all documents'''
+    best = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for doc in documents:
+            func(doc)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def parse_twice(htmlstring):
+    '''Former input handling: parse, serialize and parse again'''
+    tree = html.fromstring(htmlstring)
+    tree.make_links_absolute('https://example.org/')
+    return load_html(html.tostring(tree, encoding='utf-8').decode('utf-8'))
+
+
+def parse_once(htmlstring):
+    '''Current input handling: a single parse and no serialization'''
+    tree = load_html(htmlstring)
+    tree.make_links_absolute('https://example.org/')
+    return tree
+
+
+def benchmark_parsing(documents):
+    '''Compare the cost of both parsing strategies'''
+    print('parse + serialize + parse:', round(timed(parse_twice, documents), 3))
+    print('single parse:', round(timed(parse_once, documents), 3))
+
+
+def parse_stream(htmlstring, chunk_size=2**16):
+    '''Incremental parsing as done during downloads'''
+    loader = StreamLoader()
+    for i in range(0, len(htmlstring), chunk_size):
+        loader.feed(htmlstring[i:i+chunk_size])
+    return loader.close()
+
+
+def benchmark_streaming(documents):
+    '''Compare parsing of whole documents with incremental parsing'''
+    print('load_html:', round(timed(load_html, documents), 3))
+    print('StreamLoader:', round(timed(parse_stream, documents), 3))
+
+
+def benchmark_extraction(documents):
+    '''Measure the whole extraction in the standard and fast modes'''
+    print('extract (default):', round(timed(lambda d: extract(d, url='https://example.org/'), documents, 1), 3))
+    print('extract (fast):', round(timed(lambda d: extract(d, url='https://example.org/', no_fallback=True), documents, 1), 3))
+
+
+def benchmark_normalization(documents):
+    '''Compare separate cleaning and conversion passes with the single pass'''
+    options = Extractor(DEFAULT_CONFIG, *[False]*10)
+    trees = [load_html(d) for d in documents]
+    print('tree_cleaning + convert_tags:',
+          round(timed(lambda t: convert_tags(tree_cleaning(deepcopy(t), options), options), trees), 3))
+    print('normalize_tree:', round(timed(lambda t: normalize_tree(deepcopy(t), options), trees), 3))
+    print('copy only:', round(timed(deepcopy, trees), 3))
+
+
+def benchmark_xpaths(documents):
+    '''Compare string and compiled XPath expressions for each rule set'''
+    options = Extractor(DEFAULT_CONFIG, *[False]*10)
+    # rules are applied to cleaned and converted trees
+    trees = [convert_tags(tree_cleaning(load_html(d), options), options, 'https://example.org/') for d in documents]
+    for name in ('BODY_XPATH', 'COMMENTS_XPATH', 'REMOVE_COMMENTS_XPATH', 'OVERALL_DISCARD_XPATH',
+                 'PAYWALL_DISCARD_XPATH', 'TEASER_DISCARD_XPATH', 'PRECISION_DISCARD_XPATH',
+                 'DISCARD_IMAGE_ELEMENTS', 'COMMENTS_DISCARD_XPATH'):
+        compiled = getattr(xpaths, name)
+        strings = [expr.path for expr in compiled]
+        print(name, 'string:', round(timed(lambda t: [t.xpath(e) for e in strings], trees), 3),
+              'compiled:', round(timed(lambda t: [e(t) for e in compiled], trees), 3))
+
+
+def nested_document(depth=300):
+    '''Deeply nested divs with a few links at each level'''
+    level = '<div><p>Some text and <a href="/page">a link</a></p><ul><li><a href="/">Home</a></li></ul>'
+    return ('<html><body>' + level * depth + '</div>' * depth + '</body></html>').encode('utf-8')
+
+
+def link_density_passes(tree, with_stats=False):
+    '''Link density tests as applied in prune_unwanted_sections(), on a copy'''
+    tree = deepcopy(tree)
+    stats = NodeStats(tree) if with_stats else None
+    for tagname in ('div', 'list', 'p'):
+        delete_by_link_density(tree, tagname, backtracking=tagname == 'div', stats=stats)
+
+
+def benchmark_link_density(documents):
+    '''Compare the link density tests with and without node statistics'''
+    options = Extractor(DEFAULT_CONFIG, *[False]*10)
+    for name, docs in (('documents', documents), ('nested divs', [nested_document()])):
+        trees = [normalize_tree(load_html(d), options, 'https://example.org/') for d in docs]
+        print(name, 'text content:', round(timed(link_density_passes, trees), 3),
+              'node statistics:', round(timed(lambda t: link_density_passes(t, True), trees), 3))
+
+
+def simhash_loop(text, length=64):
+    '''Former Simhash computation: one vector per token added to a list'''
+    vector = [0] * length
+    for token in sample_tokens(text, length):
+        the_hash = int.from_bytes(blake2b(token.encode(), digest_size=8).digest(), 'big')
+        vector = list(map(add, vector, [1 if the_hash & (1 << i) else -1 for i in range(length)]))
+    return sum(1 << i for i in range(length) if vector[i] >= 0)
+
+
+def benchmark_simhash(documents):
+    '''Compare the former Simhash with the current one, per document and in batch'''
+    texts = [baseline(d)[1] for d in documents]
+    print('former loop:', round(timed(simhash_loop, texts), 3))
+    flag = hashing.NUMPY_FLAG
+    hashing.NUMPY_FLAG = False
+    print('Simhash (pure Python):', round(timed(Simhash, texts), 3))
+    hashing.NUMPY_FLAG = flag
+    if flag:
+        print('Simhash (NumPy):', round(timed(Simhash, texts), 3))
+        print('Simhash.batch (NumPy):', round(timed(lambda t: Simhash.batch(t), [texts]), 3))
+
+
+if __name__ == '__main__':
+    DOCUMENTS = load_documents()
+    print(len(DOCUMENTS), 'documents')
+    benchmark_parsing(DOCUMENTS)
+    benchmark_streaming(DOCUMENTS)
+    benchmark_normalization(DOCUMENTS)
+    benchmark_xpaths(DOCUMENTS)
+    benchmark_link_density(DOCUMENTS)
+    benchmark_simhash(DOCUMENTS)
+    benchmark_extraction(DOCUMENTS)
@@ -8,6 +8,7 @@ import os
 import re
 import subprocess
 import sys
+import tempfile
 from contextlib import redirect_stdout
 from datetime import datetime
 from unittest.mock import patch
@@ -18,6 +19,7 @@ from courlan import UrlStore
 from trafilatura import cli, cli_utils, settings, spider
 from trafilatura.downloads import add_to_compressed_dict, fetch_url
 from trafilatura.filters import LANGID_FLAG
+from trafilatura.sinks import OutputSink
 
 logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
 RESOURCES_DIR = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'resources')
@@ -202,6 +204,85 @@ def test_sysoutput():
     assert filepath == 'test/uOHdo6wKo4IK0pkL.txt'
 
 
+def test_aggregated_output():
+    '''Test the output of several documents per file'''
+    with pytest.raises(ValueError):
+        OutputSink('/tmp', 'txt')
+    with tempfile.TemporaryDirectory() as tmpdir:
+        # rotation by number of documents
+        with OutputSink(tmpdir, 'json', max_records=2) as sink:
+            for i in range(5):
+                sink.write('{"title": "%s"}' % i)
+            sink.write(None)
+        assert sink.records == 5 and len(sink.files) == 3 and sink.error is None
+        with open(sink.files[-1], encoding='utf-8') as inputfile:
+            assert inputfile.read() == '{"title": "4"}\n'
+        # existing files are kept
+        with OutputSink(tmpdir, 'json') as sink:
+            sink.write('{"title": "5"}')
+        assert sink.files[0].endswith('trafilatura-00004.jsonl')
+        # rotation by size, line breaks are escaped in XML
+        with OutputSink(tmpdir, 'xml', max_size=60) as sink:
+            for _ in range(3):
+                sink.write('<doc title="A">\n  <main>\n    <p>Text</p>\n  </main>\n</doc>\n')
+        assert len(sink.files) == 3
+        with open(sink.files[0], encoding='utf-8') as inputfile:
+            lines = inputfile.readlines()
+        assert len(lines) == 1 and '&#10;' in lines[0]
+    # command-line options
+    testargs = ['', '-o', '/tmp/aggregated', '--json', '--aggregate', '--rotate-records', '1000']
+    with patch.object(sys, 'argv', testargs):
+        args = cli.parse_args(testargs)
+    assert args.aggregate is True and args.rotate_records == 1000 and args.sink is None
+    testargs = ['', '--aggregate']
+    with patch.object(sys, 'argv', testargs):
+        args = cli.parse_args(testargs)
+    with pytest.raises(SystemExit):
+        cli.process_args(args)
+    # queued results are written if the processing is interrupted
+    def interrupt(result, args):
+        args.sink.write('{"title": "A"}')
+        raise KeyboardInterrupt
+    with tempfile.TemporaryDirectory() as tmpdir:
+        testargs = ['', '-o', tmpdir, '--json', '--aggregate']
+        with patch.object(sys, 'argv', testargs):
+            args = cli.parse_args(testargs)
+        with patch.object(sys, 'stdin', io.StringIO('<html/>')), patch.object(cli, 'write_result', interrupt):
+            with pytest.raises(KeyboardInterrupt):
+                cli.process_args(args)
+        assert args.sink.records == 1 and len(args.sink.files) == 1
+
+
+def test_near_duplicates():
+    '''Test the document-level near-duplicate filter'''
+    text = ' '.join(f'Sentence number {i} is about topic{i % 7} and thing{i * 3}.' for i in range(50))
+    first = '<doc><main><p>' + text + '</p></main></doc>'
+    # syndicated copy with a different footer
+    second = '<doc><main><p>' + text + '</p><p>Share this article.</p></main></doc>'
+    other = '<doc><main><p>' + 'The words are completely different but let us see. '*10 + '</p></main></doc>'
+    with tempfile.TemporaryDirectory() as tmpdir:
+        filename = os.path.join(tmpdir, 'index.json')
+        testargs = ['', '--xml', '--near-duplicates', filename]
+        with patch.object(sys, 'argv', testargs):
+            args = cli.parse_args(testargs)
+        assert args.near_index is None
+        args.near_index = cli_utils.load_near_duplicate_index(args)
+        assert args.near_index.bands == 4
+        f = io.StringIO()
+        with redirect_stdout(f):
+            for result in (first, first, second, other):
+                cli_utils.write_result(result, args)
+        assert f.getvalue().count('<doc>') == 2 and 'different' in f.getvalue()
+        args.near_index.save(filename)
+        # fingerprints kept between runs
+        args.near_index = cli_utils.load_near_duplicate_index(args)
+        assert len(args.near_index) == 2
+        f = io.StringIO()
+        with redirect_stdout(f):
+            cli_utils.write_result(second, args)
+        assert f.getvalue() == ''
+
+
 def test_download():
     '''test page download and command-line interface'''
     testargs = ['', '-v']
@@ -334,6 +415,23 @@ def test_cli_pipeline():
     assert '[link](testlink.html)' in result and 'test.jpg' in result
 
 
+def test_file_processing():
+    """test the file processing pipeline with output directories"""
+    testargs = ['', '--parallel', '1', '--input-dir', RESOURCES_DIR]
+    with patch.object(sys, 'argv', testargs):
+        args = cli.parse_args(testargs)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        args.output_dir = tmpdir
+        # subdirectories are used once there are enough files
+        with patch.object(cli_utils, 'MAX_FILES_PER_DIRECTORY', 2):
+            cli_utils.file_processing_pipeline(args)
+        assert os.path.isdir(os.path.join(tmpdir, '1')) and os.path.isdir(os.path.join(tmpdir, '2'))
+    with tempfile.TemporaryDirectory() as tmpdir:
+        args.output_dir = tmpdir
+        cli_utils.file_processing_pipeline(args)
+        assert os.listdir(tmpdir) and not any(os.path.isdir(os.path.join(tmpdir, name)) for name in os.listdir(tmpdir))
+
+
 def test_input_filtering():
     '''test internal functions to filter urls'''
     testargs = ['']
@@ -473,6 +571,9 @@ if __name__ == '__main__':
     test_input_filtering()
     test_sysoutput()
     test_cli_pipeline()
+    test_file_processing()
+    test_aggregated_output()
+    test_near_duplicates()
     test_crawling()
     test_download()
     test_probing()
@@ -17,6 +17,7 @@ try:
 except ImportError:
     brotli = None
 
+import codecs
 import gzip
 from time import sleep
 from unittest.mock import Mock, patch
@@ -28,14 +29,17 @@ from trafilatura.cli_utils import (download_queue_processing,
                                    url_processing_pipeline)
 from trafilatura.core import extract
 from trafilatura.downloads import (DEFAULT_HEADERS, USER_AGENT,
-                                   _determine_headers, _handle_response,
+                                   RawResponse, _determine_headers,
+                                   _handle_response, _handle_stream,
                                    _parse_config, _pycurl_is_live_page,
                                    _send_pycurl_request, _send_request,
                                    _urllib3_is_live_page,
                                    add_to_compressed_dict, fetch_url,
                                    is_live_page, load_download_buffer)
 from trafilatura.settings import DEFAULT_CONFIG, use_config
-from trafilatura.utils import decode_response, load_html
+from trafilatura.utils import (ENCODING_MEMORY, StreamLoader, decode_file,
+                               decode_response, encoding_candidates,
+                               load_html, sniff_meta_encoding)
 
 logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
 
@@ -130,6 +134,59 @@ def test_decode():
     if brotli is not None:
         brotli_string = brotli.compress(html_string.encode("utf-8"))
         assert decode_response(brotli_string) == html_string
+    # tiered detection: byte order mark, declarations, host memory
+    assert list(encoding_candidates(codecs.BOM_UTF8 + b'<html/>'))[0] == 'utf-8-sig'
+    assert decode_file(codecs.BOM_UTF8 + 'é'.encode('utf-8')) == 'é'
+    cyrillic = '<html><body><p>Привет мир</p></body></html>'
+    assert list(encoding_candidates(cyrillic.encode('cp1251'), declared='windows-1251'))[:2] == ['utf-8', 'cp1251']
+    assert list(encoding_candidates(b'<head><meta charset="koi8-r"></head>'))[:2] == ['utf-8', 'koi8-r']
+    assert list(encoding_candidates(b'<html/>', declared='latin-1', utf8_first=False))[:2] == ['iso8859-1', 'utf-8']
+    # UTF-8 documents with a wrong single-byte declaration
+    umlauts = '<html><head><meta charset="iso-8859-1"></head><body><p>Grüße aus Köln</p></body></html>'
+    assert decode_file(umlauts.encode('utf-8'), 'iso-8859-1') == umlauts
+    assert load_html(umlauts.encode('utf-8')).xpath('//p')[0].text == 'Grüße aus Köln'
+    assert load_html(umlauts.encode('latin-1')).xpath('//p')[0].text == 'Grüße aus Köln'
+    assert sniff_meta_encoding(b'<meta http-equiv="Content-Type" content="text/html; charset=UTF-16">') == 'utf-8'
+    response = RawResponse(cyrillic.encode('koi8-r'), 200, 'https://example.org/1', 'KOI8-R')
+    assert decode_response(response) == cyrillic
+    assert ENCODING_MEMORY.get('example.org') == 'koi8-r'
+    assert next(encoding_candidates(b'<html/>', host='example.org')) == 'utf-8'
+    assert decode_file(cyrillic.encode('koi8-r'), host='example.org') == cyrillic
+    ENCODING_MEMORY.clear()
+
+
+def test_stream():
+    '''Test parsing of documents while they are being received.'''
+    with open(os.path.join(RESOURCES_DIR, 'utf8.html'), 'rb') as filehandle:
+        htmlbytes = filehandle.read()
+    reference = load_html(htmlbytes)
+    # chunks cutting through tags and multi-byte characters, compressed or not
+    for data in (htmlbytes, gzip.compress(htmlbytes)):
+        loader = StreamLoader()
+        for i in range(0, len(data), 100):
+            loader.feed(data[i:i+100])
+        assert loader.size == len(data)
+        tree = loader.close()
+        assert tree.text_content() == reference.text_content()
+    # the declaration is rewritten since the parser is fed with UTF-8
+    assert tree.find('.//meta').get('content') == 'text/html; charset=utf-8'
+    # declared encoding
+    loader = StreamLoader('iso-8859-1')
+    loader.feed('<html><head><meta charset="utf-8"/></head><body><p>Grüße</p></body></html>'.encode('latin-1'))
+    assert loader.close().findtext('.//p') == 'Grüße'
+    # invalid input
+    assert StreamLoader().close() is None
+    loader = StreamLoader()
+    loader.feed(b'This is a string.')
+    assert loader.close() is None
+    # safety checks
+    loader = StreamLoader()
+    loader.feed(htmlbytes)
+    assert _handle_stream('', RawResponse(loader, 404, ''), DEFAULT_CONFIG) is None
+    assert _handle_stream('', RawResponse(loader, 200, ''), ZERO_CONFIG) is not None
+    loader = StreamLoader()
+    loader.feed(b'ABC')
+    assert _handle_stream('', RawResponse(loader, 200, ''), DEFAULT_CONFIG) is None
 
 
 def test_queue():
@@ -169,4 +226,5 @@ if __name__ == '__main__':
     test_fetch()
     test_config()
     test_decode()
+    test_stream()
     test_queue()
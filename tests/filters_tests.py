@@ -3,6 +3,12 @@
 Unit tests for the trafilatura's text filters and cache.
 """
 
+import os
+import pickle
+import tempfile
+
+from concurrent.futures import ProcessPoolExecutor
+
 # language detection
 try:
     import py3langid
@@ -11,14 +17,21 @@ except ImportError:
     LANGID_FLAG = False
 
 
+import pytest
+
 from lxml import etree, html
 
 import trafilatura.filters
 from trafilatura import extract
-from trafilatura.core import Extractor
+from trafilatura.core import Extractor, extract_many
+from trafilatura.dedup import (ENTRY_SIZE, SLOT_SIZE, BloomFilter,
+                               CountMinSketch, DigestCache, SharedDigestTable,
+                               SQLiteDigestStore, text_digest)
 from trafilatura.filters import (check_html_lang, duplicate_test,
-                                 language_filter)
+                                 language_filter, set_dedup_cache,
+                                 shared_dedup_cache)
 from trafilatura.lru import LRUCache
+from trafilatura.meta import reset_caches
 from trafilatura.metadata import Document
 from trafilatura.settings import DEFAULT_CONFIG
 
@@ -147,6 +160,128 @@ def test_lrucache():
     assert lru_test.get('tralala') == -1
 
 
+def test_dedup_cache():
+    '''test the digest-based duplicate caches'''
+    assert text_digest('abc') == text_digest('abc') != text_digest('abd')
+    assert 0 <= text_digest('\ud800') < 2**64
+    # bounded by memory
+    cache = DigestCache(3*ENTRY_SIZE)
+    assert cache.maxsize == 3
+    for i in range(5):
+        assert cache.increment(i) == 0
+    assert len(cache) == 3 and cache.get(0) == -1 and cache.get(4) == 1
+    assert cache.increment(4) == 1 and cache.increment(4) == 2
+    assert cache.stats == {'misses': 5, 'hits': 2, 'evictions': 2}
+    cache.clear()
+    assert len(cache) == 0 and not cache.stats
+    # approximate counts
+    sketch = CountMinSketch(2**12)
+    assert sketch.get(text_digest('abc')) == -1
+    for i in range(3):
+        assert sketch.increment(text_digest('abc')) == i
+    assert sketch.get(text_digest('abc')) == 3
+    assert sketch.stats == {'misses': 1, 'hits': 2}
+    sketch.clear()
+    assert sketch.get(text_digest('abc')) == -1
+    # used by duplicate_test()
+    my_element = html.fromstring('<p>' + 'AAAA BBBB '*20 + '</p>')
+    for approximate in (False, True):
+        set_dedup_cache(2**12, approximate=approximate)
+        assert [duplicate_test(my_element, DEFAULT_CONFIG) for _ in range(4)] == [False, False, False, True]
+        assert trafilatura.filters.LRU_TEST.stats['hits'] == 3
+        reset_caches()
+        assert duplicate_test(my_element, DEFAULT_CONFIG) is False
+    set_dedup_cache()
+
+
+def test_dedup_backends():
+    '''test the caches shared by processes or kept on disk'''
+    # shared table, the least frequent entry is replaced
+    table = SharedDigestTable(8*SLOT_SIZE)
+    assert table.size == 8
+    assert table.increment(0) == 0 and table.increment(0) == 1 and table.get(0) == 2
+    # the null key is reserved
+    for i in range(2, 10):
+        assert table.increment(i) == 0
+    assert len(table) == 8 and table.get(0) == 2
+    assert table.stats == {'hits': 1, 'misses': 9, 'evictions': 1}
+    table.clear()
+    assert len(table) == 0 and not table.stats
+    # SQLite store, kept between runs
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, 'dedup.db')
+        store = SQLiteDigestStore(path)
+        assert store.get(2**64 - 1) == -1
+        assert store.increment(2**64 - 1) == 0 and store.increment(2**64 - 1) == 1
+        store.close()
+        store = pickle.loads(pickle.dumps(store))
+        assert len(store) == 1 and store.get(2**64 - 1) == 2
+        set_dedup_cache(backend='sqlite', path=path)
+        assert shared_dedup_cache() is trafilatura.filters.LRU_TEST
+        reset_caches()
+        assert trafilatura.filters.LRU_TEST.get(2**64 - 1) == 2
+        trafilatura.filters.LRU_TEST.close()
+        store.clear()
+        assert len(store) == 0
+        store.close()
+    with pytest.raises(ValueError):
+        set_dedup_cache(backend='sqlite')
+    # Bloom filter, kept between runs
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, 'dedup.bloom')
+        bloom = BloomFilter(path, capacity=1000, error_rate=0.01)
+        assert bloom.num_bits == 9586 and bloom.num_hashes == 7
+        assert bloom.get(text_digest('abc')) == -1
+        assert [bloom.increment(text_digest('abc')) for _ in range(3)] == [0, 1, 2]
+        assert len(bloom) == 3 and bloom.stats == {'misses': 1, 'hits': 2}
+        bloom.close()
+        # existing parameters are kept
+        bloom = BloomFilter(path, capacity=10)
+        assert bloom.capacity == 1000 and bloom.get(text_digest('abc')) == 3
+        copy = pickle.loads(pickle.dumps(bloom))
+        assert copy.increment(text_digest('abc')) == 3 and bloom.get(text_digest('abc')) == 4
+        copy.close()
+        # counts are capped
+        bloom.max_count = 4
+        assert bloom.increment(text_digest('abc')) == 4 and len(bloom) == 4
+        bloom.clear()
+        assert bloom.get(text_digest('abc')) == -1 and len(bloom) == 0
+        # concurrent writers do not lose occurrences
+        bloom.max_count = 16
+        with ProcessPoolExecutor(max_workers=4) as executor:
+            previous = list(executor.map(bloom.increment, [text_digest('xyz')]*12))
+        assert sorted(previous) == list(range(12)) and len(bloom) == 12
+        bloom.clear()
+        bloom.close()
+        # used by duplicate_test()
+        my_element = html.fromstring('<p>' + 'AAAA BBBB '*20 + '</p>')
+        set_dedup_cache(backend='bloom', path=path)
+        assert [duplicate_test(my_element, DEFAULT_CONFIG) for _ in range(4)] == [False, False, False, True]
+        reset_caches()
+        assert duplicate_test(my_element, DEFAULT_CONFIG) is True
+        trafilatura.filters.LRU_TEST.close()
+        with pytest.raises(ValueError):
+            BloomFilter(os.path.join(tmpdir, 'other.bloom'), error_rate=2)
+        with open(path, 'wb') as outputfile:
+            outputfile.write(bytes(100))
+        with pytest.raises(ValueError):
+            BloomFilter(path)
+    with pytest.raises(ValueError):
+        set_dedup_cache(backend='redis')
+    # repetitions are counted across worker processes
+    cache = set_dedup_cache(backend='shared')
+    doc = '<html><body>' + ''.join(f'<p>{i} ' + 'abc '*50 + '</p>' for i in range(5)) + '</body></html>'
+    results = list(extract_many([(doc, 'https://example.org/')]*4, workers=2, deduplicate=True))
+    assert len(results) == 4 and all(item.error is None for item in results)
+    assert trafilatura.filters.LRU_TEST is cache and cache.stats['hits'] > 0
+    # the cache in memory is kept for the current process
+    cache = set_dedup_cache()
+    results = list(extract_many([(doc, 'https://example.org/')]*4, workers=2, deduplicate=True))
+    assert len(results) == 4 and trafilatura.filters.LRU_TEST is cache
+
+
 if __name__ == '__main__':
     test_filters()
     test_lrucache()
+    test_dedup_cache()
+    test_dedup_backends()
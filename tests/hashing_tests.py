@@ -1,7 +1,14 @@
 
 
-from trafilatura.hashing import (Simhash, content_fingerprint,
-                                 generate_hash_filename)
+import os
+import tempfile
+
+import pytest
+
+import trafilatura.hashing
+from trafilatura.hashing import (Simhash, SimhashIndex, Tokens,
+                                 content_fingerprint, generate_bow_hash,
+                                 generate_hash_filename, sample_tokens)
 
 
 def test_hashes():
@@ -12,6 +19,25 @@ def test_hashes():
 
 
 
+def test_tokens():
+    content = "abcde ijk l, "*10 + "... Hello, world! 123 a-b"
+    tokens = Tokens(content)
+    assert len(tokens) == 33 and tokens.tokens[-3:] == ["Hello", "world", "123"]
+    # tokens with 1, 2, 3, 4 and 5+ characters
+    assert tokens.lengths == [0, 10, 0, 11, 0, 12]
+    assert tokens.threshold(10) == 4 and tokens.threshold(40) == 2 and tokens.threshold(64) == 0
+    # same results as with strings, the samples are computed once
+    assert tokens.sample() is tokens.sample(64)
+    assert sample_tokens(tokens) == sample_tokens(content) == tokens.sample()
+    assert generate_bow_hash(tokens) == generate_bow_hash(content)
+    assert Simhash(tokens).hash == Simhash(content).hash
+    assert content_fingerprint(tokens) == content_fingerprint(content)
+    assert [h.hash for h in Simhash.batch([tokens, content])] == [Simhash(content).hash]*2
+    # markup is only removed from strings
+    assert generate_hash_filename(Tokens("abcde ijk l, "*10)) == "42LNugG3Sc95646i"
+    assert Tokens("").sample() == []
+
+
 def test_simhash():
     # https://en.wiktionary.org/wiki/put_lipstick_on_a_pig
     factor = 1
@@ -44,7 +70,57 @@ def test_simhash():
     assert Simhash("abcde "*100).similarity(Simhash("abcde")) == 1.0
 
 
+def test_simhash_batch():
+    texts = ["This is like putting lipstick on a pig.", "", "abcde", "Putting lipstick on a pig is what this is about."*5]
+    # same results with and without NumPy, one by one and in batch
+    flag = trafilatura.hashing.NUMPY_FLAG
+    for numpy_flag in {flag, False}:
+        trafilatura.hashing.NUMPY_FLAG = numpy_flag
+        for length in (2, 64, 80):
+            single = [Simhash(text, length=length) for text in texts]
+            batch = Simhash.batch(texts, length=length)
+            assert [h.hash for h in batch] == [h.hash for h in single]
+            assert all(h.length == length for h in batch)
+        assert single[1].hash == 2**80 - 1
+        assert Simhash.batch([]) == []
+    trafilatura.hashing.NUMPY_FLAG = flag
+    assert content_fingerprint("abcde ijk l, "*10) == "528497a1d07b66d6"
+
+
+
+def test_simhash_index():
+    first = Simhash("This is like putting lipstick on a pig."*3)
+    index = SimhashIndex()
+    # 64 bits in 4 bands
+    assert index._limits == [(0, 2**16 - 1), (16, 2**16 - 1), (32, 2**16 - 1), (48, 2**16 - 1)]
+    index.add(first, "a")
+    index.bulk_load([("b", first.hash ^ 0b111), ("c", first.hash ^ (1 << 63 | 1 << 40 | 1 << 20 | 1)), ("d", ~first.hash & (2**64 - 1))])
+    assert len(index) == 4
+    assert sorted(index.query(first)) == ["a", "b"]
+    assert index.query(first.to_hex(), max_distance=2) == ["a"]
+    assert index.query(first.hash ^ (1 << 63)) == ["a", "c"]
+    with pytest.raises(ValueError):
+        index.query(first, max_distance=4)
+    # updated and deleted entries
+    index.add(first.hash ^ 0b1, "b")
+    assert sorted(index.query(first, max_distance=1)) == ["a", "b"]
+    index.remove("b")
+    assert index.query(first) == ["a"] and len(index) == 3
+    # persistence
+    with tempfile.TemporaryDirectory() as tmpdir:
+        filename = os.path.join(tmpdir, "index.json")
+        index.save(filename)
+        copy = SimhashIndex.load(filename)
+    assert copy.entries == index.entries and copy.query(first) == ["a"]
+    # uneven bands
+    assert SimhashIndex(bands=3)._limits == [(0, 2**22 - 1), (22, 2**21 - 1), (43, 2**21 - 1)]
+    with pytest.raises(ValueError):
+        SimhashIndex(bands=0)
+
 
 if __name__ == "__main__":
     test_hashes()
+    test_tokens()
     test_simhash()
+    test_simhash_batch()
+    test_simhash_index()
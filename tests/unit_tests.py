@@ -5,7 +5,11 @@ Unit tests for the trafilatura library.
 
 import logging
 import os
+import pickle
 import sys
+import tempfile
+from concurrent.futures.process import BrokenProcessPool
+from unittest.mock import patch
 
 import pytest
 from lxml import etree, html
@@ -25,15 +29,23 @@ except ImportError:
 import trafilatura.htmlprocessing
 from trafilatura import (bare_extraction, baseline, extract, html2txt,
                          process_record, utils, xml)
-from trafilatura.core import (Extractor, handle_formatting, handle_image,
-                              handle_lists, handle_paragraphs, handle_quotes,
-                              handle_table, handle_textelem, sanitize_tree,
-                              trim)
-from trafilatura.external import try_justext
-from trafilatura.filters import textfilter
+from trafilatura.core import (FALLBACK_GATE_STATS, ContentSignals,
+                              ExtractionProfile, Extractor, handle_formatting,
+                              handle_image, handle_lists, handle_paragraphs,
+                              extract_many, handle_quotes, handle_table,
+                              handle_textelem, handle_textelems, is_confident,
+                              sanitize_tree, trim)
+from trafilatura.external import (custom_justext, jt_frozen_path,
+                                  jt_stoplist_init, try_justext)
+from trafilatura.filters import PRESCREEN_STATS, prescreen, textfilter
 from trafilatura.meta import reset_caches
 from trafilatura.metadata import Document
+from trafilatura.paragraphs import FrozenStoplist, freeze_stoplist
+from trafilatura.profiling import ProfileReport, register_hook, unregister_hook
+from trafilatura.readability_lxml import Document as ReadabilityDocument
 from trafilatura.settings import DEFAULT_CONFIG, TAG_CATALOG, use_config
+from trafilatura.turbo import iter_text_blocks, turbo_text
+from trafilatura.utils import TimeBudget
 
 logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
 
@@ -125,6 +137,21 @@ def test_input():
     assert utils.load_html('<html><body>ÄÖÜ</body></html>') is not None
     assert utils.load_html(b'<html><body>\x2f\x2e\x9f</body></html>') is not None
     assert utils.load_html('<html><body>\x2f\x2e\x9f</body></html>'.encode('latin-1')) is not None
+    # bytes passed to the parser with the detected encoding, or decoded first
+    htmlstring = '<html><head><meta charset="windows-1251"/></head><body><p>Привет мир</p></body></html>'
+    assert utils.encoding_parser('cp1251') is not None and utils.encoding_parser('shift_jis') is None
+    assert utils.load_html(htmlstring.encode('cp1251')).findtext('.//p') == 'Привет мир'
+    htmlstring = '<html><head><meta charset="shift_jis"/></head><body><p>こんにちは</p></body></html>'
+    assert utils.load_html(htmlstring.encode('shift_jis')).findtext('.//p') == 'こんにちは'
+    assert utils.strip_faulty_doctypes(b"<!DOCTYPE html PUBLIC />\n<html/>", "<!doctype html public />") == b"\n<html/>"
+    assert utils.remove_payloads(b'<html><body><script>var a;</script><p>Text</p></body></html>') == b'<html><body><script></script><p>Text</p></body></html>'
+    # inline payloads
+    htmlstring = '<html><head><script>var a = "</div>";</SCRIPT ><style>p {}</style></head><body><svg><g><svg/></g><svg><path/></svg></svg><p>Text</p></body></html>'
+    assert utils.remove_payloads(htmlstring) == '<html><head><script></script><style></style></head><body><svg></svg><p>Text</p></body></html>'
+    htmlstring = '<html><head><script type="application/ld+json">{"@type": "Article"}</script></head><body><!-- <script> --><p>Text</p><script>var a;</body></html>'
+    assert utils.remove_payloads(htmlstring) == htmlstring
+    mytree = utils.load_html('<html><body><style>p {}</style><p>Text</p></body></html>', strip_payloads=True)
+    assert mytree.find('.//style').text is None and mytree.find('.//p').text == 'Text'
     #assert utils.load_html(b'0'*int(10e3)) is None
     # old: with pytest.raises(TypeError) as err:
     assert extract(None, 'url', '0000', target_language=None) is None
@@ -354,6 +381,28 @@ def test_html2txt():
     assert html2txt("123") == ""
 
 
+def test_turbo():
+    '''Test the streaming approximation of the baseline'''
+    assert turbo_text("") == "" and turbo_text("123") == ""
+    with pytest.raises(TypeError):
+        turbo_text(123)
+    # same priorities as the baseline: JSON-LD, article, paragraphs, body
+    my_document = '<html><head><script type="application/ld+json">{"@type": "NewsArticle", "articleBody": "The \\"text\\"."}</script></head><body><p>Other</p></body></html>'
+    assert turbo_text(my_document) == 'The "text".'
+    my_document = '<html><body><aside><article>Aside</article></aside><article>' + 'The article consists of this text. '*5 + '</article><p>Other</p></body></html>'
+    assert turbo_text(my_document).startswith('The article consists') and turbo_text(html.fromstring(my_document)) == turbo_text(my_document)
+    my_document = '<html><body><p>' + 'Paragraph text. '*10 + '<code>code</code></p><footer><p>Footer</p></footer><div>Body &amp; text</div></body></html>'
+    assert [b[1] for b in iter_text_blocks(my_document) if b[0] == 'p'] == ['Paragraph text. '*10 + 'code', 'code']
+    assert 'Footer' not in turbo_text(my_document)
+    my_document = "<html><body><div>   Document body...   </div><script> console.log('Hello world') </script></body></html>"
+    assert turbo_text(my_document) == turbo_text(my_document.encode('utf-8')) == baseline(my_document)[1] == 'Document body...'
+    # early stop: parsing of a long document ends after the first chunks
+    my_document = '<html><body>' + '<p>Paragraph number {}.</p>'*5000 + '</body></html>'
+    blocks = iter_text_blocks(my_document.format(*range(5000)), chunk_size=1000)
+    assert next(blocks) == ('text', 'Paragraph number 0.') and next(blocks) == ('p', 'Paragraph number 0.')
+    assert len(turbo_text(my_document.format(*range(5000)), max_length=200)) < 300
+
+
 def test_external():
     '''Test external components'''
     options = DEFAULT_OPTIONS
@@ -374,6 +423,42 @@ def test_external():
     mytree, _, _ = sanitize_tree(mydoc, options)
     myelems = {element.tag for element in set(mytree.iter())}
     assert 'graphic' in myelems and 'ref' in myelems
+    # readability: text and link lengths stay up to date during the summary
+    doc = ReadabilityDocument(html.fromstring('<html><body><div id="menu"><a href="/">Home</a></div><div>Intro text<p>First paragraph, with <a href="/">a link</a> inside.</p><br/>Tail text<p>Another paragraph of sufficient length.</p><form>Form</form></div><script>var a;</script></body></html>'), retry_length=1000)
+    assert 'Another paragraph' in doc.summary()
+    for elem in doc.doc.iter('*'):
+        assert doc.text_length(elem) == len(trim(elem.text_content()))
+        links = sum(len(trim(link.text_content())) for link in elem.findall('.//a'))
+        assert doc.get_link_density(elem) == links / (len(trim(elem.text_content())) or 1)
+    # justext: frozen stoplists and paragraph classification
+    with tempfile.TemporaryDirectory() as tmpdir:
+        filename = os.path.join(tmpdir, 'stoplist.bin')
+        freeze_stoplist(['The', 'of', 'und', 'über'], filename)
+        stoplist = FrozenStoplist(filename)
+        assert len(stoplist) == 4 and 'the' in stoplist and 'über' in stoplist
+        assert 'The' not in stoplist and 'text' not in stoplist and '' not in stoplist
+    # built in the cache directory on first use, kept in memory if it cannot be written
+    with tempfile.TemporaryDirectory() as tmpdir:
+        with patch.dict(os.environ, {'XDG_CACHE_HOME': tmpdir}):
+            assert isinstance(jt_stoplist_init(), FrozenStoplist) and os.path.isfile(jt_frozen_path())
+            assert isinstance(jt_stoplist_init(), FrozenStoplist)
+            # damaged files are built again
+            with open(jt_frozen_path(), 'rb') as inputfile:
+                truncated = inputfile.read(1024)
+            for content in (b'', b'TSL1', b'XXXX' + bytes(12), truncated):
+                with open(jt_frozen_path(), 'wb') as outputfile:
+                    outputfile.write(content)
+                assert isinstance(jt_stoplist_init(), FrozenStoplist) and 'the' in jt_stoplist_init()
+        with patch.dict(os.environ, {'XDG_CACHE_HOME': '/dev/null'}):
+            assert isinstance(jt_stoplist_init(), frozenset) and 'the' in jt_stoplist_init()
+        with patch.dict(os.environ, {'XDG_CACHE_HOME': tmpdir}):
+            stoplist = jt_stoplist_init()
+    assert 'the' in stoplist and 'und' in stoplist and 'trafilatura' not in stoplist
+    mydoc = html.fromstring('<html><head><title>Title</title></head><body><div><a href="/">Home</a><br/><a href="/about">About</a></div><p>' + 'This is the text of the page which is long enough to be part of the main content, it is written with a few of the usual words. '*3 + '</p><p>Copyright © Company</p></body></html>')
+    paragraphs = custom_justext(mydoc, stoplist)
+    assert [p.text[:12] for p in paragraphs] == ['Home About', 'This is the ', 'Copyright © ']
+    assert [p.is_boilerplate for p in paragraphs] == [True, False, True]
+    assert paragraphs[0].chars_in_links == 9
     # test langid
     if LANGID_FLAG is True:
         doc = html.fromstring('<html><body>' + '<p>Non è inglese.</p>'*20 + '</body></html>')
@@ -423,6 +508,10 @@ def test_links():
     options.config = ZERO_CONFIG
     assert handle_textelem(etree.Element('ref'), [], options) is None
     assert handle_formatting(html.fromstring('<a href="testlink.html">Test link text.</a>'), options) is not None
+    # absolute and escaped link targets
+    mydoc = '<html><body><p>' + '<a href=" /Wie funktioniert ">Test link</a> <a href="/Gräser?a=b">text</a> This part of the text has to be long enough. '*3 + '</p></body></html>'
+    result = extract(mydoc, 'https://example.org/dir/', output_format='xml', include_links=True, no_fallback=True, config=ZERO_CONFIG)
+    assert 'target="https://example.org/Wie%20funktioniert"' in result and 'target="https://example.org/Gr%C3%A4ser?a=b"' in result
     # empty link
     mydoc = html.fromstring('<html><body><p><a></a><b>Some text.</b></p></body></html>')
     assert extract(mydoc) is not None
@@ -698,6 +787,51 @@ def test_htmlprocessing():
     assert node.tail == "tail"
 
 
+def test_node_stats():
+    '''test the text and link statistics index'''
+    mydoc = html.fragment_fromstring('<section><div> Intro <ref>a link</ref>\n<p>Text <hi>in <ref>two</ref></hi>words</p> tail  <p/> </div><div><p>  More <ref> </ref>text </p><!-- comment --> end <ref><ref>nested</ref> link</ref></div>text</section>')
+    stats = trafilatura.htmlprocessing.NodeStats(mydoc)
+
+    def check(tree):
+        for elem in tree.iter('*'):
+            assert stats.text_length(elem) == len(trim(elem.text_content()))
+            assert stats.raw_length(elem) == len(elem.text_content())
+            links = elem.findall('.//ref')
+            assert stats.has_links(elem) is (len(links) > 0)
+            for precision in (False, True):
+                assert stats.link_info(elem, precision) == trafilatura.htmlprocessing.collect_link_info(links, precision)[:3]
+            assert 0 <= stats.link_ratio(elem) <= 1
+
+    check(mydoc)
+    # updates
+    trafilatura.htmlprocessing.prune_unwanted_nodes(mydoc, [etree.XPath('.//hi'), './/div[2]/p'], stats=stats)
+    assert mydoc.find('.//hi') is None and mydoc.find('.//div[2]/p') is None
+    check(mydoc)
+    trafilatura.htmlprocessing.delete_by_link_density(mydoc, 'div', stats=stats)
+    check(mydoc)
+    # subtrees only, the rest of the document is not indexed
+    subtree = mydoc[0]
+    stats = trafilatura.htmlprocessing.NodeStats(subtree)
+    trafilatura.htmlprocessing.prune_unwanted_nodes(subtree, [etree.XPath('.//p')], stats=stats)
+    check(subtree)
+    # same decisions with and without statistics
+    for text, expected in (('<div>A <ref>link to somewhere</ref></div>', True),
+                           ('<div><p>A longer text</p><ref>A link</ref></div>', False),
+                           ('<div><ref>1</ref><ref>2</ref><ref>3</ref>Some text</div>', True)):
+        elem = html.fragment_fromstring(text)
+        stats = trafilatura.htmlprocessing.NodeStats(elem)
+        assert trafilatura.htmlprocessing.link_density_test(elem, trim(elem.text_content())) == \
+               trafilatura.htmlprocessing.link_density_test(elem, None, stats=stats)
+        assert trafilatura.htmlprocessing.link_density_test(elem, None, stats=stats)[0] is expected
+    # decision and link texts
+    elem = html.fragment_fromstring('<div>A <ref>link to somewhere</ref></div>')
+    assert trafilatura.htmlprocessing.link_density_test(elem, 'A link to somewhere') == (True, ['link to somewhere'])
+    # share of the text in links
+    assert trafilatura.htmlprocessing.NodeStats(elem).link_ratio(elem) == 17/19
+    elem = html.fragment_fromstring('<div> <p> </p></div>')
+    assert trafilatura.htmlprocessing.NodeStats(elem).link_ratio(elem) == 0
+
+
 def test_extraction_options():
     '''Test the different parameters available in extract() and bare_extraction()'''
     my_html = '<html><head><meta http-equiv="content-language" content="EN"/></head><body><div="article-body"><p>Text.<!-- comment --></p></div></body></html>'
@@ -712,6 +846,149 @@ def test_extraction_options():
     # assert extract(my_html) is None
 
 
+def test_input_tree():
+    '''Test that trees passed as input are left untouched'''
+    my_html = '<html><body><article><p>' + 'The main text with <a href="/link">a link</a>. '*20 + '</p></article></body></html>'
+    mytree = html.fromstring(my_html)
+    first = bare_extraction(mytree, url='https://example.org/', config=ZERO_CONFIG)
+    assert first is not None and bare_extraction(mytree, url='https://example.org/', config=ZERO_CONFIG)['text'] == first['text']
+    result = extract(mytree, 'https://example.org/', include_links=True, output_format='xml', config=ZERO_CONFIG)
+    assert 'https://example.org/link' in result and extract(mytree, 'https://example.org/', include_links=True, output_format='xml', config=ZERO_CONFIG) == result
+    assert html.tostring(mytree, encoding='unicode') == html.tostring(html.fromstring(my_html), encoding='unicode')
+
+def test_extract_many():
+    '''Test the batch processing with a pool of processes'''
+    my_html = '<html><body><article><p>' + 'The main text. '*20 + '</p></article></body></html>'
+    inputs = [(my_html, f'https://example.org/{i}') for i in range(20)]
+    results = list(extract_many(inputs, workers=2, ordered=True, config=ZERO_CONFIG))
+    assert [item.index for item in results] == list(range(20))
+    assert all(item.error is None and 'The main text.' in item.result for item in results)
+    # a worker process dies: its documents are reported, the rest is processed
+    def crashing_extract(filecontent, url, **kwargs):
+        if url.endswith('/1'):
+            os._exit(1)
+        return 'result'
+    with patch('trafilatura.core.extract', side_effect=crashing_extract):
+        results = list(extract_many(inputs, workers=1, config=ZERO_CONFIG))
+    assert sorted(item.index for item in results) == list(range(20))
+    assert isinstance(next(item for item in results if item.index == 1).error, BrokenProcessPool)
+    assert all(item.result == 'result' for item in results if item.index >= 10)
+
+
+
+def test_time_budget():
+    '''Test the cooperative time limit and the downgrade to the baseline'''
+    assert TimeBudget().exhausted() is False
+    assert TimeBudget(0).exhausted() is False
+    budget = TimeBudget(1e-9)
+    assert budget.exhausted() is True
+    with pytest.raises(RuntimeError):
+        budget.check()
+    my_html = '<html><body><article><p>' + 'The main text. '*100 + '</p></article></body></html>'
+    result = bare_extraction(my_html, timeout=1e-9, config=ZERO_CONFIG)
+    assert result is not None and 'The main text.' in result['text']
+    assert bare_extraction(my_html, timeout=30, config=ZERO_CONFIG)['text'] == bare_extraction(my_html, config=ZERO_CONFIG)['text']
+    # checked within the processing stages
+    options = Extractor(ZERO_CONFIG, *[False]*10, budget=TimeBudget(1e-9))
+    with pytest.raises(RuntimeError):
+        trafilatura.htmlprocessing.normalize_tree(html.fromstring('<html><body>' + '<p>Text</p>'*300 + '</body></html>'), options)
+    with pytest.raises(RuntimeError):
+        list(handle_textelems([etree.Element('p')], set(), options))
+
+
+def test_extraction_profile():
+    '''Test the reusable set of extraction options'''
+    profile = ExtractionProfile(ZERO_CONFIG, tables=False, links=True)
+    assert profile.min_extracted_size == ZERO_CONFIG.getint('DEFAULT', 'MIN_EXTRACTED_SIZE')
+    assert 'ref' in profile.potential_tags and 'table' not in profile.potential_tags
+    with pytest.raises(AttributeError):
+        profile.tables = True
+    copied = pickle.loads(pickle.dumps(profile))
+    assert copied.links is True and copied.potential_tags == profile.potential_tags
+    assert len(copied.discard_xpaths) == len(profile.discard_xpaths)
+    options = Extractor.from_profile(profile)
+    assert options.profile is profile and options.tables is False
+    # resolved once, again if the options change
+    options = Extractor(ZERO_CONFIG, *[False]*10)
+    assert options.profile is options.profile and options.profile.tables is False
+    options.tables = True
+    assert options.profile.tables is True
+    # same results as with the corresponding options
+    my_html = '<html><body><article><p>' + 'The main text with <a href="/link">a link</a>. '*20 + '</p></article></body></html>'
+    assert extract(my_html, 'https://example.org/', output_format='xml', extraction_profile=profile) == \
+           extract(my_html, 'https://example.org/', output_format='xml', include_tables=False, include_links=True, config=ZERO_CONFIG)
+    result = bare_extraction(my_html, extraction_profile=ExtractionProfile(ZERO_CONFIG, comments=False))
+    assert result is not None and result['comments'] is None
+
+
+def test_fallback_gate():
+    '''Test the decision to skip the fallback algorithms'''
+    my_html = '<html><body><article>' + ('<p>A paragraph of text with some content. ' + 'And more words here. '*10 + '</p>')*6 + '</article></body></html>'
+    FALLBACK_GATE_STATS.clear()
+    result = bare_extraction(my_html)
+    assert 'A paragraph of text' in result['text'] and FALLBACK_GATE_STATS['confident'] == 1
+    # not enough text
+    short_html = '<html><body><article><p>' + 'Short text. '*25 + '</p></article></body></html>'
+    assert bare_extraction(short_html) is not None and FALLBACK_GATE_STATS['uncertain'] == 1
+    # deactivated in the settings or in fast mode
+    config = use_config()
+    config['DEFAULT']['FALLBACK_GATE'] = 'off'
+    assert bare_extraction(my_html, config=config)['text'] == result['text']
+    assert bare_extraction(my_html, no_fallback=True)['text'] == result['text']
+    assert sum(FALLBACK_GATE_STATS.values()) == 2
+    # text recovered outside of the matched section
+    wild_html = '<html><body><article><p>First short paragraph.</p><p>Second one.</p></article><div>' + '<p>Sidebar paragraph with quite a lot of words in it, again and again.</p>'*30 + '</div></body></html>'
+    FALLBACK_GATE_STATS.clear()
+    assert bare_extraction(wild_html) is not None and FALLBACK_GATE_STATS['uncertain'] == 1
+    # signals
+    options = Extractor.from_profile(ExtractionProfile())
+    assert is_confident(etree.Element('body'), 5000, options) is False
+    options.signals = ContentSignals(0, 0.5)
+    assert is_confident(html.fromstring(my_html), 5000, options) is False
+    options.signals = ContentSignals(0, 0)
+    assert is_confident(html.fromstring(my_html), 5000, options) is True
+
+
+def test_profiling():
+    '''Test the measurements made during extraction'''
+    report = ProfileReport()
+    register_hook(report)
+    try:
+        my_html = '<html><body><article><p>' + 'The main text. '*100 + '</p></article></body></html>'
+        assert extract(my_html, url='https://example.org/', config=ZERO_CONFIG) is not None
+    finally:
+        unregister_hook(report)
+    assert report.calls['load_html'] == 1 and report.calls['extract_content'] == 1
+    assert report.calls['normalize_tree'] == 1 and 'tree_cleaning' not in report.calls
+    assert report.calls['serialization'] == 1 and report.totals['extract_content'] > 0
+    assert sum(report.branches.values()) == 1
+    # merge and transmission between processes
+    other = pickle.loads(pickle.dumps(report))
+    other.merge(report)
+    assert other.calls['extract_content'] == 2 and sum(other.branches.values()) == 2
+    assert sum(other.histograms['extract_content']) == 2
+    assert 'extract_content' in other.report()
+
+
+def test_prescreen():
+    '''Test the discarding of documents before extraction'''
+    config = use_config()
+    config.set('DEFAULT', 'PRESCREEN', 'on')
+    my_html = '<html lang="de"><head><link rel="canonical" href="https://example.org/canonical"/></head><body><article><p>' + 'The main text in English. '*20 + '</p></article></body></html>'
+    mytree = html.fromstring(my_html)
+    assert prescreen(mytree, 'https://example.org/', config=config) is None
+    assert prescreen(mytree, 'https://example.org/') is None
+    assert prescreen(mytree, 'https://example.org/', url_blacklist={'https://example.org/canonical'}, config=config) == 'url_blacklist'
+    assert prescreen(mytree, 'https://example.org/', target_language='en', config=config) == 'html_lang'
+    assert prescreen(html.fromstring('<html><body><p>Short.</p><script>var a = "long enough, but invisible";</script></body></html>'), None, config=config) == 'visible_text'
+    if LANGID_FLAG is True:
+        assert prescreen(html.fromstring(my_html.replace(' lang="de"', '')), None, target_language='de', config=config) == 'language'
+    count = PRESCREEN_STATS['url_blacklist']
+    assert bare_extraction(my_html, url='https://example.org/', url_blacklist={'https://example.org/canonical'}, config=config) is None
+    assert PRESCREEN_STATS['url_blacklist'] == count + 1
+    assert bare_extraction(my_html, url='https://example.org/', config=config) is not None
+
+
 def test_precision_recall():
     '''test precision- and recall-oriented settings'''
     # the test cases could be better
@@ -1109,9 +1386,18 @@ if __name__ == '__main__':
     test_images()
     test_links()
     test_htmlprocessing()
+    test_node_stats()
     test_extraction_options()
+    test_input_tree()
+    test_extract_many()
+    test_time_budget()
+    test_extraction_profile()
+    test_fallback_gate()
+    test_profiling()
+    test_prescreen()
     test_precision_recall()
     test_baseline()
+    test_turbo()
     test_txttocsv()
     test_external()
     test_tei()
@@ -15,7 +15,7 @@ __version__ = '1.6.1'
 import logging
 
 from .core import bare_extraction, baseline, extract, html2txt, process_record
-from .downloads import fetch_url
+from .downloads import fetch_tree, fetch_url
 from .metadata import extract_metadata
 from .utils import load_html
 
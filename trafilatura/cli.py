@@ -14,9 +14,14 @@ from platform import python_version
 from . import __version__
 from .cli_utils import (cli_crawler, cli_discovery, examine,
                         file_processing_pipeline, load_blacklist,
-                        load_input_dict, probe_homepage,
-                        url_processing_pipeline, write_result)
-from .settings import DOWNLOAD_THREADS
+                        load_input_dict, load_near_duplicate_index,
+                        probe_homepage, url_processing_pipeline,
+                        write_result)
+from .dedup import BLOOM_CAPACITY, BLOOM_ERROR_RATE
+from .filters import set_dedup_cache
+from .profiling import ProfileReport, register_hook
+from .settings import DOWNLOAD_THREADS, use_config
+from .sinks import OutputSink
 
 # fix output encoding on some systems
 try:
@@ -86,6 +91,15 @@ def parse_args(args):
     group2.add_argument('--hash-as-name',
                         help=argparse.SUPPRESS,
                         action="store_true")   # will be deprecated
+    group2.add_argument('--aggregate',
+                        help="write results to a series of files with one document per line (csv, json, xml and xmltei formats)",
+                        action="store_true")
+    group2.add_argument('--rotate-size',
+                        help="with --aggregate: start a new file after the given size (in MB)",
+                        type=int, default=100)
+    group2.add_argument('--rotate-records',
+                        help="with --aggregate: start a new file after the given number of documents",
+                        type=int)
 
     group3_ex.add_argument("--feed",
                         help="look for feeds and/or pass a feed URL as input",
@@ -148,6 +162,15 @@ def parse_args(args):
     group4.add_argument("--deduplicate",
                         help="filter out duplicate documents and sections",
                         action="store_true")
+    group4.add_argument("--dedup-store",
+                        help="count duplicate sections in a SQLite file kept between runs",
+                        type=str)
+    group4.add_argument("--dedup-filter",
+                        help="register duplicate sections in a Bloom filter file kept between runs",
+                        type=str)
+    group4.add_argument("--near-duplicates",
+                        help="drop documents similar to those already output, optionally keeping their fingerprints in a file between runs",
+                        nargs='?', const=True, default=False)
     group4.add_argument("--config-file",
                         help="override standard extraction parameters with a custom config file",
                         type=str)
@@ -179,6 +202,9 @@ def parse_args(args):
                         help="validate XML TEI output",
                         action="store_true")
 
+    parser.add_argument('--profile-report',
+                        help="print the time spent in each processing stage to STDERR",
+                        action="store_true")
     parser.add_argument('-v', '--verbose', action='count', default=0,
                         help="increase logging verbosity (-v or -vv)",
                         )
@@ -190,6 +216,9 @@ def parse_args(args):
     )
 
 
+    # output sink and near-duplicate index opened during processing, see process_args()
+    parser.set_defaults(sink=None, near_index=None)
+
     # wrap in mapping to prevent invalid input
     return map_args(parser.parse_args())
 
@@ -274,44 +303,87 @@ def process_args(args):
         logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
     if args.blacklist:
         args.blacklist = load_blacklist(args.blacklist)
+    # duplicate sections remembered across runs
+    dedup_cache = None
+    if args.dedup_store:
+        args.deduplicate = True
+        dedup_cache = set_dedup_cache(backend='sqlite', path=args.dedup_store)
+    elif args.dedup_filter:
+        args.deduplicate = True
+        config = use_config(filename=args.config_file)
+        dedup_cache = set_dedup_cache(backend='bloom', path=args.dedup_filter,
+                                      capacity=config.getint('DEFAULT', 'DEDUP_FILTER_CAPACITY', fallback=BLOOM_CAPACITY),
+                                      error_rate=config.getfloat('DEFAULT', 'DEDUP_FILTER_ERROR_RATE', fallback=BLOOM_ERROR_RATE))
+    # instrumentation
+    report = None
+    try:
+        if args.profile_report:
+            report = ProfileReport()
+            register_hook(report)
+        # aggregated output written by a separate thread
+        if args.aggregate:
+            if args.output_dir is None or args.output_format == 'txt':
+                sys.exit('ERROR: --aggregate requires an output directory and one of the csv, json, xml and xmltei formats')
+            args.sink = OutputSink(args.output_dir, args.output_format,
+                                   max_size=args.rotate_size * 2**20 if args.rotate_size else None,
+                                   max_records=args.rotate_records)
+        # document fingerprints
+        if args.near_duplicates:
+            args.near_index = load_near_duplicate_index(args)
+
+        # processing according to mutually exclusive options
+        # read url list from input file
+        if args.input_file and all([not args.crawl, not args.explore, not args.feed, not args.probe, not args.sitemap]):
+            url_store = load_input_dict(args)
+            error_caught = url_processing_pipeline(args, url_store)
+
+        # fetch urls from a feed or a sitemap
+        elif args.explore or args.feed or args.sitemap:
+            cli_discovery(args)
+
+        # activate crawler/spider
+        elif args.crawl:
+            cli_crawler(args)
+
+        # probe and print only
+        elif args.probe:
+            probe_homepage(args)
+
+        # read files from an input directory
+        elif args.input_dir:
+            file_processing_pipeline(args, report)
+
+        # process input URL
+        elif args.URL:
+            url_store = load_input_dict(args)
+            error_caught = url_processing_pipeline(args, url_store)  # process single url
+
+        # read input on STDIN directly
+        else:
+            # file type and unicode check
+            try:
+                htmlstring = sys.stdin.read()
+            except UnicodeDecodeError:
+                sys.exit('ERROR: system, file type or buffer encoding')
+            # process
+            result = examine(htmlstring, args, url=args.URL)
+            write_result(result, args)
+
+        if args.near_index is not None and isinstance(args.near_duplicates, str):
+            args.near_index.save(args.near_duplicates)
+    # the pending results are written and the files released in any case
+    finally:
+        if args.sink is not None:
+            args.sink.close()
+        if dedup_cache is not None:
+            dedup_cache.close()
+
+    if args.sink is not None and args.sink.error is not None:
+        sys.stderr.write(f'ERROR: aggregated output: {args.sink.error}\n')
+        error_caught = True
 
-    # processing according to mutually exclusive options
-    # read url list from input file
-    if args.input_file and all([not args.crawl, not args.explore, not args.feed, not args.probe, not args.sitemap]):
-        url_store = load_input_dict(args)
-        error_caught = url_processing_pipeline(args, url_store)
-
-    # fetch urls from a feed or a sitemap
-    elif args.explore or args.feed or args.sitemap:
-        cli_discovery(args)
-
-    # activate crawler/spider
-    elif args.crawl:
-        cli_crawler(args)
-
-    # probe and print only
-    elif args.probe:
-        probe_homepage(args)
-
-    # read files from an input directory
-    elif args.input_dir:
-        file_processing_pipeline(args)
-
-    # process input URL
-    elif args.URL:
-        url_store = load_input_dict(args)
-        error_caught = url_processing_pipeline(args, url_store)  # process single url
-
-    # read input on STDIN directly
-    else:
-        # file type and unicode check
-        try:
-            htmlstring = sys.stdin.read()
-        except UnicodeDecodeError:
-            sys.exit('ERROR: system, file type or buffer encoding')
-        # process
-        result = examine(htmlstring, args, url=args.URL)
-        write_result(result, args)
+    if report is not None:
+        sys.stderr.write(report.report() + '\n')
 
     # change exit code if there are errors
     if error_caught is True:
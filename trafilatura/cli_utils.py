@@ -13,26 +13,28 @@ import re
 import string
 import sys
 import traceback
-from concurrent.futures import (ProcessPoolExecutor, ThreadPoolExecutor,
-                                as_completed)
-from functools import partial
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from itertools import chain, islice
 from os import makedirs, path, walk
 
 from courlan import UrlStore, extract_domain, get_base_url  # validate_url
+from lxml.html import HtmlElement
 
 from trafilatura import spider
 
-from .core import extract, html2txt
+from .core import ExtractionProfile, extract, extract_many
 from .downloads import (add_to_compressed_dict, buffered_downloads,
                         load_download_buffer)
 from .feeds import find_feed_urls
 from .filters import LANGID_FLAG, language_classifier
-from .hashing import generate_hash_filename
+from .hashing import (CLEAN_XML, Simhash, SimhashIndex, Tokens,
+                      generate_hash_filename)
 from .meta import reset_caches
 from .settings import (FILE_PROCESSING_CORES, FILENAME_LEN,
                        MAX_FILES_PER_DIRECTORY, use_config)
 from .sitemaps import sitemap_search
-from .utils import URL_BLACKLIST_REGEX, make_chunks, uniquify_list
+from .turbo import turbo_text
+from .utils import URL_BLACKLIST_REGEX, uniquify_list
 
 LOGGER = logging.getLogger(__name__)
 
@@ -138,7 +140,8 @@ def get_writable_path(destdir, extension):
 
 
 def determine_output_path(args, orig_filename, content, counter=None, new_filename=None):
-    '''Pick a directory based on selected options and a file name based on output type'''
+    '''Pick a directory based on selected options and a file name based on output type,
+       the content can be passed as string or as Tokens'''
     # determine extension, TXT by default
     extension = EXTENSION_MAPPING.get(args.output_format, '.txt')
 
@@ -170,14 +173,42 @@ def archive_html(htmlstring, args, counter=None):
     return filename
 
 
+def load_near_duplicate_index(args):
+    '''Read the fingerprints of previous runs or start a new index'''
+    if isinstance(args.near_duplicates, str) and path.isfile(args.near_duplicates):
+        return SimhashIndex.load(args.near_duplicates)
+    config = use_config(filename=args.config_file)
+    # a Hamming distance of n is found with n + 1 bands
+    return SimhashIndex(bands=config.getint('DEFAULT', 'NEAR_DUPLICATE_DISTANCE', fallback=3) + 1)
+
+
+def is_near_duplicate(tokens, index):
+    '''Test if a similar document has already been seen, register it otherwise'''
+    fingerprint = Simhash(tokens)
+    if index.query(fingerprint):
+        return True
+    index.add(fingerprint)
+    return False
+
+
 def write_result(result, args, orig_filename=None, counter=None, new_filename=None):
     '''Deal with result (write to STDOUT or to file)'''
     if result is None:
         return
+    # the tokens are also used to name the output file, markup is not relevant
+    content = result
+    if args.near_index is not None:
+        content = Tokens(CLEAN_XML.sub('', result))
+        if is_near_duplicate(content, args.near_index):
+            LOGGER.info('near duplicate discarded: %s', orig_filename)
+            return
     if args.output_dir is None:
         sys.stdout.write(result + '\n')
+    # aggregated files: no I/O in the current thread
+    elif args.sink is not None:
+        args.sink.write(result)
     else:
-        destination_path, destination_dir = determine_output_path(args, orig_filename, result, counter, new_filename)
+        destination_path, destination_dir = determine_output_path(args, orig_filename, content, counter, new_filename)
         # check the directory status
         if check_outputdir_status(destination_dir) is True:
             with open(destination_path, mode='w', encoding='utf-8') as outputfile:
@@ -191,20 +222,12 @@ def generate_filelist(inputdir):
             yield path.join(root, fname)
 
 
-def file_processing(filename, args, counter=None, config=None):
-    '''Aggregated functions to process a file in a list'''
-    with open(filename, 'rb') as inputf:
-        htmlstring = inputf.read()
-    result = examine(htmlstring, args, url=args.URL, config=config)
-    write_result(result, args, filename, counter, new_filename=None)
-
-
-def process_result(htmlstring, args, url, counter, config):
+def process_result(htmlstring, args, url, counter, config, options=None):
     '''Extract text and metadata from a download webpage and eventually write out the result'''
     # backup option
     fileslug = archive_html(htmlstring, args, counter) if args.backup_dir else None
     # process
-    result = examine(htmlstring, args, url=url, config=config)
+    result = examine(htmlstring, args, url=url, config=config, options=options)
     write_result(result, args, orig_filename=fileslug, counter=counter, new_filename=fileslug)
     # increment written file counter
     if counter is not None and result is not None:
@@ -215,14 +238,18 @@ def process_result(htmlstring, args, url, counter, config):
 def download_queue_processing(url_store, args, counter, config):
     '''Implement a download queue consumer, single- or multi-threaded'''
     sleep_time = config.getfloat('DEFAULT', 'SLEEP_TIME')
+    # parse while downloading unless the raw documents are kept
+    parse = config.getboolean('DEFAULT', 'STREAM_PARSING', fallback=False) and not args.backup_dir
+    # the extraction profile is resolved once for all documents
+    options = extraction_options(args, config)
     errors = []
     while url_store.done is False:
         bufferlist, url_store = load_download_buffer(url_store, sleep_time)
         # process downloads
-        for url, result in buffered_downloads(bufferlist, args.parallel):
+        for url, result in buffered_downloads(bufferlist, args.parallel, parse=parse):
             # handle result
             if result is not None:
-                counter = process_result(result, args, url, counter, config)
+                counter = process_result(result, args, url, counter, config, options)
             else:
                 LOGGER.warning('No result for URL: %s', url)
                 errors.append(url)
@@ -322,9 +349,10 @@ def probe_homepage(args):
     config = use_config(filename=args.config_file)
     min_length = config.getint('DEFAULT', 'MIN_EXTRACTED_SIZE')
 
-    for url, result in buffered_downloads(input_urls, args.parallel):
+    # raw responses: the text is extracted while parsing, without a tree
+    for url, result in buffered_downloads(input_urls, args.parallel, decode=False):
         if result is not None:
-            result = html2txt(result)
+            result = turbo_text(result)
             if result and len(result) > min_length and any(c.isalpha() for c in result):
                 if not LANGID_FLAG or not args.target_language or language_classifier(result, "") == args.target_language:
                     print(url, flush=True)
@@ -359,48 +387,78 @@ def url_processing_pipeline(args, url_store):
     return bool(errors)
 
 
-def file_processing_pipeline(args):
-    '''Define batches for parallel file processing and perform the extraction'''
-    filecounter = None
-    processing_cores = args.parallel or FILE_PROCESSING_CORES
+def read_files(filenames, config):
+    '''Read the files and filter out unsuitable documents before processing'''
+    for filename in filenames:
+        with open(filename, 'rb') as inputf:
+            htmlstring = inputf.read()
+        if len(htmlstring) > config.getint('DEFAULT', 'MAX_FILE_SIZE'):
+            sys.stderr.write(f'ERROR: file too large: {filename}\n')
+        elif len(htmlstring) < config.getint('DEFAULT', 'MIN_FILE_SIZE'):
+            sys.stderr.write(f'ERROR: file too small: {filename}\n')
+        else:
+            yield filename, htmlstring
+
+
+def file_processing_pipeline(args, profile=None):
+    '''Define batches for parallel file processing and perform the extraction,
+       optionally gathering measurements in a ProfileReport'''
     config = use_config(filename=args.config_file)
-    timeout = config.getint('DEFAULT', 'EXTRACTION_TIMEOUT') or None
-
-    # max_tasks_per_child available in Python >= 3.11
-    with ProcessPoolExecutor(max_workers=processing_cores) as executor:
-        # chunk input: https://github.com/python/cpython/issues/74028
-        for filebatch in make_chunks(generate_filelist(args.input_dir), MAX_FILES_PER_DIRECTORY):
-            if filecounter is None and len(filebatch) >= MAX_FILES_PER_DIRECTORY:
-                filecounter = 0
-            worker = partial(file_processing, args=args, counter=filecounter, config=config)
-            executor.map(worker, filebatch, chunksize=10, timeout=timeout)
-            # update counter
-            if filecounter is not None:
-                filecounter += len(filebatch)
-
-
-def examine(htmlstring, args, url=None, config=None):
-    """Generic safeguards and triggers"""
+    filelist = generate_filelist(args.input_dir)
+    # only use subdirectories if there are many files, the listing stays lazy
+    first_files = list(islice(filelist, MAX_FILES_PER_DIRECTORY))
+    use_counter = len(first_files) >= MAX_FILES_PER_DIRECTORY
+    filelist = chain(first_files, filelist)
+    # files are read lazily, their names are kept to write the results
+    filenames = []
+    def documents():
+        for filename, htmlstring in read_files(filelist, config):
+            filenames.append(filename)
+            yield htmlstring, args.URL
+    # the results are written in the main process as they arrive
+    for item in extract_many(documents(), workers=args.parallel or FILE_PROCESSING_CORES,
+                             chunksize=10, profile=profile, config=config,
+                             **extraction_options(args, config)):
+        if item.error is not None:
+            sys.stderr.write(f'ERROR: {filenames[item.index]}: {str(item.error)}\n')
+            continue
+        counter = (item.index // MAX_FILES_PER_DIRECTORY) * MAX_FILES_PER_DIRECTORY if use_counter else None
+        write_result(item.result, args, filenames[item.index], counter, new_filename=None)
+
+
+def extraction_options(args, config):
+    '''Convert command-line arguments and settings to extraction parameters'''
+    profile = ExtractionProfile(config, fast=args.fast, precision=args.precision,
+                                recall=args.recall, comments=args.no_comments,
+                                formatting=args.formatting, links=args.links,
+                                images=args.images, tables=args.no_tables,
+                                deduplicate=args.deduplicate,
+                                target_language=args.target_language)
+    return dict(extraction_profile=profile,
+                timeout=config.getint('DEFAULT', 'EXTRACTION_TIMEOUT') or None,
+                only_with_metadata=args.only_with_metadata,
+                output_format=args.output_format, tei_validation=args.validate_tei)
+
+
+def examine(htmlstring, args, url=None, config=None, options=None):
+    """Generic safeguards and triggers, the extraction options
+       can be computed beforehand with extraction_options()"""
     result = None
     if config is None:
         config = use_config(filename=args.config_file)
-    # safety check
+    # safety check, the size of trees parsed during download has already been checked
     if htmlstring is None:
         sys.stderr.write('ERROR: empty document\n')
-    elif len(htmlstring) > config.getint('DEFAULT', 'MAX_FILE_SIZE'):
+    elif not isinstance(htmlstring, HtmlElement) and len(htmlstring) > config.getint('DEFAULT', 'MAX_FILE_SIZE'):
         sys.stderr.write('ERROR: file too large\n')
-    elif len(htmlstring) < config.getint('DEFAULT', 'MIN_FILE_SIZE'):
+    elif not isinstance(htmlstring, HtmlElement) and len(htmlstring) < config.getint('DEFAULT', 'MIN_FILE_SIZE'):
         sys.stderr.write('ERROR: file too small\n')
     # proceed
     else:
         try:
-            result = extract(htmlstring, url=url, no_fallback=args.fast,
-                             include_comments=args.no_comments, include_tables=args.no_tables,
-                             include_formatting=args.formatting, include_links=args.links,
-                             include_images=args.images, only_with_metadata=args.only_with_metadata,
-                             output_format=args.output_format, tei_validation=args.validate_tei,
-                             target_language=args.target_language, deduplicate=args.deduplicate,
-                             favor_precision=args.precision, favor_recall=args.recall, config=config)
+            if options is None:
+                options = extraction_options(args, config)
+            result = extract(htmlstring, url=url, config=config, **options)
         # ugly but efficient
         except Exception as err:
             sys.stderr.write(f'ERROR: {str(err)}' + '\n' + traceback.format_exc() + '\n')
@@ -9,27 +9,36 @@ Module bundling all functions needed to extract the text in a webpage.
 
 # standard
 import logging
+import os
 import re  # import regex as re
 import warnings
+from collections import Counter, deque, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
 from copy import deepcopy
 
-from lxml import html
 from lxml.etree import Element, SubElement, strip_elements, strip_tags
 from lxml.html import tostring
 from urllib.parse import urljoin
 
 # own
+from . import filters
 from .external import (SANITIZED_XPATH, justext_rescue, sanitize_tree,
                        try_readability)
 from .filters import (LANGID_FLAG, check_html_lang, duplicate_test,
-                      language_filter, text_chars_test)
+                      language_filter, prescreen, shared_dedup_cache,
+                      text_chars_test, use_dedup_cache)
 from .hashing import content_fingerprint
-from .htmlprocessing import (convert_tags, delete_by_link_density,
-                             handle_textnode, link_density_test_tables,
+from .htmlprocessing import (NodeStats, delete_by_link_density, handle_textnode,
+                             link_density_test_tables, normalize_tree,
                              process_node, prune_unwanted_nodes, tree_cleaning)
 from .metadata import Document, extract_metadata
+from .profiling import (ProfileReport, StageTimer, record_branch,
+                        register_hook, unregister_hook)
 from .settings import DEFAULT_CONFIG, TAG_CATALOG, use_config
-from .utils import is_image_file, load_html, normalize_unicode, trim, txttocsv
+from .utils import (ExtractionTimeout, TimeBudget, TreeSnapshot,
+                    is_image_file, load_html, make_chunks, normalize_unicode,
+                    trim, txttocsv)
 from .xml import (build_json_output, build_tei_output, build_xml_output,
                   control_xml_output, remove_empty_elements, strip_double_tags,
                   xmltotxt)
@@ -51,18 +60,31 @@ NOT_AT_THE_END = {'head', 'ref'}
 
 JSON_SEARCH = re.compile(r'"articlebody": *"(.+?)(?<!\\)"', re.I)
 
+BatchResult = namedtuple('BatchResult', ['index', 'url', 'result', 'error'])
+
+# evidence gathered by extract_content(): position of the matching BODY_XPATH
+# expression (None if the text was recovered elsewhere) and link density
+ContentSignals = namedtuple('ContentSignals', ['expression', 'link_density'])
+
+# extraction settings of the current worker process, see extract_many()
+WORKER_OPTIONS = {}
+
+# decisions of the confidence gate in compare_extraction()
+FALLBACK_GATE_STATS = Counter()
+
 
 class Extractor:
     "Defines a class to store all extraction options."
     __slots__ = [
         'config', 'fast', 'precision', 'recall', 'comments',
         'formatting', 'links', 'images', 'tables', 'dedup', 'lang',
+        'budget', 'signals', '_profile',
     ]
 
     # consider dataclasses for Python 3.7+
     def __init__(self, config, fast, precision, recall, comments,
                  formatting, links, images, tables, deduplicate,
-                 target_language):
+                 target_language, budget=None, profile=None):
         self.config = config
         self.fast = fast
         self.precision = precision
@@ -74,6 +96,101 @@ class Extractor:
         self.tables = tables
         self.dedup = deduplicate
         self.lang = target_language
+        self.budget = budget or TimeBudget()
+        self.signals = None
+        self._profile = profile
+
+    def __setattr__(self, name, value):
+        # a resolved profile does not match modified options anymore
+        if name not in ('budget', 'signals', '_profile'):
+            object.__setattr__(self, '_profile', None)
+        object.__setattr__(self, name, value)
+
+    @classmethod
+    def from_profile(cls, profile, budget=None):
+        "Set the options of a single extraction according to a pre-resolved profile."
+        return cls(profile.config, profile.fast, profile.precision, profile.recall,
+                   profile.comments, profile.formatting, profile.links, profile.images,
+                   profile.tables, profile.dedup, profile.lang, budget, profile)
+
+    @property
+    def profile(self):
+        "Resolved settings, derived once from the current options if no profile was given."
+        if self._profile is None:
+            self._profile = ExtractionProfile(self.config, self.fast, self.precision, self.recall,
+                                              self.comments, self.formatting, self.links, self.images,
+                                              self.tables, self.dedup, self.lang)
+        return self._profile
+
+
+class ExtractionProfile:
+    """Immutable extraction options: the settings are read, the tags and
+       XPath expressions selected once and reused for each document."""
+    __slots__ = [
+        'config', 'fast', 'precision', 'recall', 'comments',
+        'formatting', 'links', 'images', 'tables', 'dedup', 'lang',
+        'min_extracted_size', 'min_extracted_comm_size', 'min_output_size',
+        'min_output_comm_size', 'strip_payloads', 'prescreen', 'potential_tags', 'discard_xpaths',
+        'fallback_gate', 'gate_max_expression', 'gate_min_text_size',
+        'gate_min_paragraphs', 'gate_max_link_density',
+    ]
+
+    def __init__(self, config=DEFAULT_CONFIG, fast=False, precision=False, recall=False,
+                 comments=True, formatting=False, links=False, images=False,
+                 tables=True, deduplicate=False, target_language=None):
+        values = dict(
+            config=config, fast=fast, precision=precision, recall=recall,
+            comments=comments, formatting=formatting, links=links, images=images,
+            tables=tables, dedup=deduplicate, lang=target_language,
+            min_extracted_size=config.getint('DEFAULT', 'MIN_EXTRACTED_SIZE'),
+            min_extracted_comm_size=config.getint('DEFAULT', 'MIN_EXTRACTED_COMM_SIZE'),
+            min_output_size=config.getint('DEFAULT', 'MIN_OUTPUT_SIZE'),
+            min_output_comm_size=config.getint('DEFAULT', 'MIN_OUTPUT_COMM_SIZE'),
+            strip_payloads=config.getboolean('DEFAULT', 'STRIP_PAYLOADS', fallback=False),
+            prescreen=config.getboolean('DEFAULT', 'PRESCREEN', fallback=False),
+            fallback_gate=config.getboolean('DEFAULT', 'FALLBACK_GATE', fallback=True),
+            gate_max_expression=config.getint('DEFAULT', 'GATE_MAX_EXPRESSION', fallback=2),
+            gate_min_text_size=config.getint('DEFAULT', 'GATE_MIN_TEXT_SIZE', fallback=1000),
+            gate_min_paragraphs=config.getint('DEFAULT', 'GATE_MIN_PARAGRAPHS', fallback=3),
+            gate_max_link_density=config.getfloat('DEFAULT', 'GATE_MAX_LINK_DENSITY', fallback=0.2),
+        )
+        # tags considered in the main text
+        potential_tags = set(TAG_CATALOG)
+        if tables is True:
+            potential_tags.update(['table', 'td', 'th', 'tr'])
+        if images is True:
+            potential_tags.add('graphic')
+        if links is True:
+            potential_tags.add('ref')
+        values['potential_tags'] = frozenset(potential_tags)
+        # rules applied after the general discarding ones, see prune_unwanted_sections()
+        discard_xpaths = [PAYWALL_DISCARD_XPATH]
+        if images is False:
+            discard_xpaths.append(DISCARD_IMAGE_ELEMENTS)
+        # balance precision/recall
+        if recall is False:
+            discard_xpaths.append(TEASER_DISCARD_XPATH)
+            if precision is True:
+                discard_xpaths.append(PRECISION_DISCARD_XPATH)
+        values['discard_xpaths'] = tuple(discard_xpaths)
+        for name, value in values.items():
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f'cannot set {name}: extraction profiles are immutable')
+
+    def __delattr__(self, name):
+        raise AttributeError(f'cannot delete {name}: extraction profiles are immutable')
+
+    def __reduce__(self):
+        # compiled expressions cannot be pickled, the profile is resolved again instead
+        return (self.__class__, (self.config, self.fast, self.precision, self.recall,
+                                 self.comments, self.formatting, self.links, self.images,
+                                 self.tables, self.dedup, self.lang))
+
+    def __repr__(self):
+        flags = ', '.join(f'{name}={getattr(self, name)!r}' for name in self.__slots__[1:11])
+        return f'{self.__class__.__name__}({flags})'
 
 
 def handle_titles(element, options):
@@ -488,6 +605,17 @@ def handle_textelem(element, potential_tags, options):
     return new_element
 
 
+def handle_textelems(elems, potential_tags, options):
+    '''Process a series of elements and yield the results,
+       the processing is aborted if the time budget is exhausted'''
+    budget = options.budget
+    for elem in elems:
+        budget.check()
+        processed_elem = handle_textelem(elem, potential_tags, options)
+        if processed_elem is not None:
+            yield processed_elem
+
+
 def recover_wild_text(tree, result_body, options, potential_tags=TAG_CATALOG):
     '''Look for all previously unconsidered wild elements, including outside of the determined
        frame and throughout the document to recover potentially missing text parts'''
@@ -497,42 +625,39 @@ def recover_wild_text(tree, result_body, options, potential_tags=TAG_CATALOG):
         potential_tags.update(['div', 'lb'])
         search_expr += '|.//div|.//lb|.//list'
     # prune
-    search_tree = prune_unwanted_sections(tree, potential_tags, options)
+    search_tree = prune_unwanted_sections(tree, options)
     # decide if links are preserved
     if 'ref' not in potential_tags:
         strip_tags(search_tree, 'a', 'ref', 'span')
     else:
         strip_tags(search_tree, 'span')
     subelems = search_tree.xpath(search_expr)
-    result_body.extend(filter(lambda x: x is not None, (handle_textelem(e, potential_tags, options)
-                                                        for e in subelems)))
+    result_body.extend(handle_textelems(subelems, potential_tags, options))
     return result_body
 
 
-def prune_unwanted_sections(tree, potential_tags, options):
-    'Rule-based deletion of targeted document sections'
+def prune_unwanted_sections(tree, options, stats=None):
+    '''Rule-based deletion of targeted document sections,
+       node statistics are computed if they are not provided'''
+    if stats is None:
+        stats = NodeStats(tree)
     # prune the rest
-    tree = prune_unwanted_nodes(tree, OVERALL_DISCARD_XPATH, with_backup=True)
-    tree = prune_unwanted_nodes(tree, PAYWALL_DISCARD_XPATH)
-    # decide if images are preserved
-    if 'graphic' not in potential_tags:
-        tree = prune_unwanted_nodes(tree, DISCARD_IMAGE_ELEMENTS)
-    # balance precision/recall
-    if options.recall is False:
-        tree = prune_unwanted_nodes(tree, TEASER_DISCARD_XPATH)
-        if options.precision is True:
-            tree = prune_unwanted_nodes(tree, PRECISION_DISCARD_XPATH)
+    tree = prune_unwanted_nodes(tree, OVERALL_DISCARD_XPATH, with_backup=True, stats=stats)
+    # paywalls, images if they are not preserved, teasers and more depending on precision/recall
+    for rules in options.profile.discard_xpaths:
+        tree = prune_unwanted_nodes(tree, rules, stats=stats)
     # remove elements by link density
-    tree = delete_by_link_density(tree, 'div', backtracking=True, favor_precision=options.precision)
-    tree = delete_by_link_density(tree, 'list', backtracking=False, favor_precision=options.precision)
-    tree = delete_by_link_density(tree, 'p', backtracking=False, favor_precision=options.precision)
+    tree = delete_by_link_density(tree, 'div', backtracking=True, favor_precision=options.precision, stats=stats)
+    tree = delete_by_link_density(tree, 'list', backtracking=False, favor_precision=options.precision, stats=stats)
+    tree = delete_by_link_density(tree, 'p', backtracking=False, favor_precision=options.precision, stats=stats)
     # also filter fw/head, table and quote elements?
     if options.precision is True:
         # delete trailing titles
         while len(tree) > 0 and (tree[-1].tag == 'head'):
+            stats.changed(tree)
             tree[-1].getparent().remove(tree[-1])
-        tree = delete_by_link_density(tree, 'head', backtracking=False)  # favor_precision=options.precision
-        tree = delete_by_link_density(tree, 'quote', backtracking=False)  # favor_precision=options.precision
+        tree = delete_by_link_density(tree, 'head', backtracking=False, stats=stats)  # favor_precision=options.precision
+        tree = delete_by_link_density(tree, 'quote', backtracking=False, stats=stats)  # favor_precision=options.precision
     return tree
 
 
@@ -540,31 +665,34 @@ def extract_content(tree, options):
     '''Find the main content of a page using a set of XPath expressions,
        then extract relevant elements, strip them of unwanted subparts and
        convert them'''
-    # backup
-    backup_tree = deepcopy(tree)
+    # backup made when the tree is about to be modified
+    backup_tree = None
     # init
+    profile = options.profile
     result_body = Element('body')
-    potential_tags = set(TAG_CATALOG)
-    if options.tables is True:
-        potential_tags.update(['table', 'td', 'th', 'tr'])
-    if options.images is True:
-        potential_tags.add('graphic')
-    if options.links is True:
-        potential_tags.add('ref')
+    potential_tags = set(profile.potential_tags)
+    link_density = 0
     # iterate
-    for expr in BODY_XPATH:
+    for position, expr in enumerate(BODY_XPATH):
+        options.budget.check()
         # select tree if the expression has been found
         try:
-            subtree = tree.xpath(expr)[0]
+            subtree = expr(tree)[0]
         except IndexError:
             continue
+        # copy on write: the tree has not been changed up to this point
+        if backup_tree is None:
+            backup_tree = deepcopy(tree)
         # prune the subtree
-        subtree = prune_unwanted_sections(subtree, potential_tags, options)
+        # text and link statistics shared by the link density tests
+        stats = NodeStats(subtree)
+        subtree = prune_unwanted_sections(subtree, options, stats)
         # second pass?
         # subtree = delete_by_link_density(subtree, 'list', backtracking=False, favor_precision=options.precision)
         if 'table' in potential_tags or options.precision is True:
             for elem in subtree.iter('table'):
-                if link_density_test_tables(elem) is True:
+                if link_density_test_tables(elem, stats) is True:
+                    stats.changed(elem.getparent())
                     elem.getparent().remove(elem)
         # skip if empty tree
         if len(subtree) == 0:
@@ -577,8 +705,10 @@ def extract_content(tree, options):
             factor = 1
         else:
             factor = 3
-        if not ptest or len(''.join(ptest)) < options.config.getint('DEFAULT', 'MIN_EXTRACTED_SIZE') * factor:
+        if not ptest or len(''.join(ptest)) < profile.min_extracted_size * factor:
             potential_tags.add('div')
+        # share of link text, before links are possibly stripped
+        link_density = stats.link_ratio(subtree)
         # polish list of potential tags
         if 'ref' not in potential_tags:
             strip_tags(subtree, 'ref')
@@ -599,19 +729,24 @@ def extract_content(tree, options):
         #     if _r is not None:
         #         _temp_result_body.append(_r)
 
-        result_body.extend(filter(lambda x: x is not None, (handle_textelem(e, potential_tags, options) for e in subelems)))  # TODO 这里把图片等丢掉了
+        result_body.extend(handle_textelems(subelems, potential_tags, options))  # TODO 这里把图片等丢掉了
         # remove trailing titles
         while len(result_body) > 0 and (result_body[-1].tag in NOT_AT_THE_END):
             result_body[-1].getparent().remove(result_body[-1])
         # exit the loop if the result has children
         if len(result_body) > 1:
             LOGGER.debug(expr)
+            options.signals = ContentSignals(position, link_density)
             break
     temp_text = ' '.join(result_body.itertext()).strip()
     # try parsing wild <p> elements if nothing found or text too short
     # todo: test precision and recall settings here
-    if len(result_body) == 0 or len(temp_text) < options.config.getint('DEFAULT', 'MIN_EXTRACTED_SIZE'):
-        result_body = recover_wild_text(backup_tree, result_body, options, potential_tags)
+    if len(result_body) == 0 or len(temp_text) < profile.min_extracted_size:
+        options.budget.check()
+        # the signals gathered above do not describe the recovered text
+        options.signals = None
+        result_body = recover_wild_text(backup_tree if backup_tree is not None else tree,
+                                        result_body, options, potential_tags)
         temp_text = ' '.join(result_body.itertext()).strip()
     # filter output
     strip_elements(result_body, 'done')
@@ -641,8 +776,9 @@ def extract_comments(tree, options):
     potential_tags = set(TAG_CATALOG)  # 'span'
     # potential_tags.add('div') trouble with <div class="comment-author meta">
     for expr in COMMENTS_XPATH:
+        options.budget.check()
         # select tree if the expression has been found
-        subtree = tree.xpath(expr)
+        subtree = expr(tree)
         if not subtree:
             continue
         subtree = subtree[0]
@@ -669,20 +805,44 @@ def extract_comments(tree, options):
     return comments_body, temp_comments, len(temp_comments), tree
 
 
-def compare_extraction(tree, backup_tree, url, body, text, len_text, options):
+def is_confident(body, len_text, options):
+    '''Tell if the main extraction is reliable enough to do without
+       the fallback algorithms, based on the signals gathered so far'''
+    profile, signals = options.profile, options.signals
+    # the text has been found early in the list of expressions, not recovered
+    if signals is None or signals.expression > profile.gate_max_expression:
+        return False
+    if len_text < profile.gate_min_text_size or signals.link_density > profile.gate_max_link_density:
+        return False
+    if len(body.findall('.//p')) < profile.gate_min_paragraphs:
+        return False
+    # leftovers which would trigger the justext examination
+    return not body.xpath(SANITIZED_XPATH)
+
+
+def compare_extraction(tree_backup, url, body, text, len_text, options):
     '''Decide whether to choose own or external extraction
-       based on a series of heuristics'''
-    min_target_length = options.config.getint('DEFAULT', 'MIN_EXTRACTED_SIZE')
+       based on a series of heuristics, return the result
+       along with the name of the chosen algorithm'''
+    min_target_length = options.profile.min_extracted_size
     # bypass for recall
     if options.recall is True and len_text > min_target_length * 10:
-        return body, text, len_text
+        return body, text, len_text, 'custom'
+    # bypass if the extraction is reliable
+    if options.profile.fallback_gate is True:
+        if is_confident(body, len_text, options):
+            FALLBACK_GATE_STATS['confident'] += 1
+            LOGGER.debug('confident extraction, skipping fallbacks: %s', url)
+            return body, text, len_text, 'custom'
+        FALLBACK_GATE_STATS['uncertain'] += 1
     algo_flag, jt_result = False, False
     # prior cleaning
-    backup_tree = prune_unwanted_nodes(backup_tree, PAYWALL_DISCARD_XPATH)
+    backup_tree = prune_unwanted_nodes(tree_backup.get(), PAYWALL_DISCARD_XPATH)
     if options.precision is True:
         backup_tree = prune_unwanted_nodes(backup_tree, OVERALL_DISCARD_XPATH)
     # try with readability
-    temppost_algo = try_readability(backup_tree)
+    with StageTimer('readability'):
+        temppost_algo = try_readability(backup_tree)
     # unicode fix necessary on certain systems (#331)
     algo_text = trim(tostring(temppost_algo, method='text', encoding='utf-8').decode('utf-8'))
     len_algo = len(algo_text)
@@ -711,23 +871,31 @@ def compare_extraction(tree, backup_tree, url, body, text, len_text, options):
     # apply decision
     if algo_flag:
         body, text, len_text = temppost_algo, algo_text, len_algo
+        algorithm = 'readability'
         LOGGER.debug('using generic algorithm: %s', url)
     else:
+        algorithm = 'custom'
         LOGGER.debug('using custom extraction: %s', url)
     # override faulty extraction: try with justext
-    if body.xpath(SANITIZED_XPATH) or len_text < min_target_length:  # body.find(...)
+    if options.budget.exhausted():
+        LOGGER.debug('no time left for justext: %s', url)
+    elif body.xpath(SANITIZED_XPATH) or len_text < min_target_length:  # body.find(...)
         # or options.recall is True ?
         LOGGER.debug('unclean document triggering justext examination: %s', url)
         # tree = prune_unwanted_sections(tree, {}, options)
-        body2, text2, len_text2, jt_result = justext_rescue(tree, url, options.lang, body, 0, '')
+        # the cleaned tree is derived from the original one only when needed
+        with StageTimer('justext'):
+            cleaned_tree = tree_cleaning(tree_backup.get(), options)
+            body2, text2, len_text2, jt_result = justext_rescue(cleaned_tree, url, options.lang, body, 0, '')
         # prevent too short documents from replacing the main text
         if jt_result is True and not len_text > 4 * len_text2:  # threshold could be adjusted
             LOGGER.debug('using justext, length: %s', len_text2)
             body, text, len_text = body2, text2, len_text2
+            algorithm = 'justext'
     # post-processing: remove unwanted sections
     if algo_flag is True and jt_result is False:
         body, text, len_text = sanitize_tree(body, options)
-    return body, text, len_text
+    return body, text, len_text, algorithm
 
 
 def baseline(filecontent):
@@ -857,11 +1025,12 @@ def bare_extraction(filecontent, url=None, no_fallback=False,  # fast=False,
                     date_extraction_params=None,
                     only_with_metadata=False, with_metadata=False,
                     max_tree_size=None, url_blacklist=None, author_blacklist=None,
-                    as_dict=True, config=DEFAULT_CONFIG):
+                    as_dict=True, timeout=None, config=DEFAULT_CONFIG,
+                    extraction_profile=None):
     """Internal function for text extraction returning bare Python variables.
 
     Args:
-        filecontent: HTML code as string.
+        filecontent: HTML code as string, bytes or an already parsed LXML tree.
         url: URL of the webpage.
         no_fallback: Use faster heuristics and skip backup extraction.
         favor_precision: prefer less text but correct extraction.
@@ -884,7 +1053,11 @@ def bare_extraction(filecontent, url=None, no_fallback=False,  # fast=False,
         url_blacklist: Provide a blacklist of URLs as set() to filter out documents.
         author_blacklist: Provide a blacklist of Author Names as set() to filter out authors.
         as_dict: Legacy option, return a dictionary instead of a class with attributes.
+        timeout: Maximum processing time in seconds, the extraction is downgraded
+            to the baseline once it is exceeded (no limit by default).
         config: Directly provide a configparser configuration.
+        extraction_profile: Reuse an ExtractionProfile, its settings replace
+            the configuration and the corresponding options above.
 
     Returns:
         A Python dict() containing all the extracted information or None.
@@ -895,6 +1068,18 @@ def bare_extraction(filecontent, url=None, no_fallback=False,  # fast=False,
     # init
     if url_blacklist is None:  # 使用url黑名单
         url_blacklist = set()
+    budget = TimeBudget(timeout)
+    if extraction_profile is None:
+        extraction_profile = ExtractionProfile(config, no_fallback, favor_precision, favor_recall,
+                                               include_comments, include_formatting, include_links,
+                                               include_images, include_tables, deduplicate,
+                                               target_language)
+    else:
+        # the profile takes precedence over the options used below
+        config, no_fallback = extraction_profile.config, extraction_profile.fast
+        favor_precision, include_comments = extraction_profile.precision, extraction_profile.comments
+        include_formatting, deduplicate = extraction_profile.formatting, extraction_profile.dedup
+        target_language = extraction_profile.lang
 
     # deprecation warnings
     if with_metadata is True:
@@ -912,11 +1097,25 @@ def bare_extraction(filecontent, url=None, no_fallback=False,  # fast=False,
 
     # load data
     try:
-        tree = load_html(filecontent)
+        # the input is kept as is and only copied or parsed again if necessary:
+        # the working tree is modified in place, trees passed by the caller are not
+        if not isinstance(filecontent, TreeSnapshot):
+            filecontent = TreeSnapshot(filecontent, extraction_profile.strip_payloads)
+        tree_backup = filecontent
+        with StageTimer('load_html'):
+            tree = tree_backup.get()
         if tree is None:
             LOGGER.error('empty HTML tree for URL %s', url)
             raise ValueError
 
+        # optional: discard obvious cases before the heavy processing
+        if extraction_profile.prescreen is True:
+            with StageTimer('prescreen'):
+                reason = prescreen(tree, url, target_language, url_blacklist, config)
+            if reason is not None:
+                LOGGER.info('pre-screening discarded URL %s: %s', url, reason)
+                raise ValueError
+
         # quick and dirty HTML lang check
         if target_language is not None and (no_fallback is True or LANGID_FLAG is False):
             if check_html_lang(tree, target_language) is False:
@@ -925,7 +1124,8 @@ def bare_extraction(filecontent, url=None, no_fallback=False,  # fast=False,
 
         # extract metadata if necessary
         if output_format != 'txt':
-            document = extract_metadata(tree, url, date_extraction_params, no_fallback, author_blacklist)
+            with StageTimer('extract_metadata'):
+                document = extract_metadata(tree, url, date_extraction_params, no_fallback, author_blacklist)
             # cut short if extracted URL in blacklist
             if document.url in url_blacklist:
                 LOGGER.warning('blacklisted URL: %s', url)
@@ -941,42 +1141,52 @@ def bare_extraction(filecontent, url=None, no_fallback=False,  # fast=False,
             document = Document()
 
         # regroup extraction options
-        options = Extractor(config, no_fallback, favor_precision, favor_recall,
-                            include_comments, include_formatting, include_links,
-                            include_images, include_tables, deduplicate,
-                            target_language)
-
-        # backup (or not) for further processing
-        tree_backup_1 = deepcopy(tree) if no_fallback is False else None
-        tree_backup_2 = deepcopy(tree)
-
-        # clean + use LXML cleaner
-
-        cleaned_tree = tree_cleaning(tree, options)
-        cleaned_tree_backup = deepcopy(cleaned_tree)
-
-        # convert tags, the rest does not work without conversion
-        cleaned_tree = convert_tags(cleaned_tree, options, url or document.url)
+        options = Extractor.from_profile(extraction_profile, budget)
 
-        # comments first, then remove
-        if include_comments is True:
-            commentsbody, temp_comments, len_comments, cleaned_tree = extract_comments(cleaned_tree, options)
-        else:
-            commentsbody, temp_comments, len_comments = None, '', 0
-        if favor_precision is True:
-            cleaned_tree = prune_unwanted_nodes(cleaned_tree, REMOVE_COMMENTS_XPATH)
-
-        # extract content
-        postbody, temp_text, len_text = extract_content(cleaned_tree, options)
+        commentsbody = Element('body') if include_comments is True else None
+        temp_comments, len_comments = '', 0
+        try:
+            budget.check()
+            # clean and convert tags in a single pass, the rest does not work without conversion:
+            # both are timed together as one stage
+            with StageTimer('normalize_tree'):
+                cleaned_tree = normalize_tree(tree, options, url or document.url)
+            budget.check()
+
+            # comments first, then remove
+            if include_comments is True:
+                with StageTimer('extract_comments'):
+                    commentsbody, temp_comments, len_comments, cleaned_tree = extract_comments(cleaned_tree, options)
+            if favor_precision is True:
+                cleaned_tree = prune_unwanted_nodes(cleaned_tree, REMOVE_COMMENTS_XPATH)
+
+            # extract content
+            with StageTimer('extract_content'):
+                postbody, temp_text, len_text = extract_content(cleaned_tree, options)
+            algorithm = 'custom'
+        # a single pathological document should not stall the processing
+        except ExtractionTimeout:
+            LOGGER.warning('processing time exceeded, using baseline extraction for URL %s', url)
+            with StageTimer('baseline'):
+                postbody, temp_text, len_text = baseline(tree_backup.get())
+            algorithm = 'baseline'
 
         # compare if necessary
-        if no_fallback is False:
-            postbody, temp_text, len_text = compare_extraction(cleaned_tree_backup, tree_backup_1, url, postbody, temp_text, len_text, options)
+        if no_fallback is False and not budget.exhausted():
+            try:
+                with StageTimer('compare_extraction'):
+                    postbody, temp_text, len_text, algorithm = compare_extraction(tree_backup, url, postbody, temp_text, len_text, options)
+            # the external algorithms themselves cannot be interrupted
+            except ExtractionTimeout:
+                LOGGER.warning('processing time exceeded, skipping fallbacks for URL %s', url)
         # add baseline as additional fallback
         # rescue: try to use original/dirty tree # and favor_precision is False=?
-        if len_text < config.getint('DEFAULT', 'MIN_EXTRACTED_SIZE'):
-            postbody, temp_text, len_text = baseline(tree_backup_2)
+        if len_text < extraction_profile.min_extracted_size:
+            with StageTimer('baseline'):
+                postbody, temp_text, len_text = baseline(tree_backup.get())
+            algorithm = 'baseline'
             LOGGER.debug('non-clean extracted length: %s (extraction)', len_text)
+        record_branch(algorithm)
 
         # tree size sanity check
         if max_tree_size is not None:
@@ -989,10 +1199,10 @@ def bare_extraction(filecontent, url=None, no_fallback=False,  # fast=False,
                 LOGGER.debug('output tree too long: %s, discarding file', len(postbody))
                 raise ValueError
         # size checks
-        if len_comments < config.getint('DEFAULT', 'MIN_EXTRACTED_COMM_SIZE'):
+        if len_comments < extraction_profile.min_extracted_comm_size:
             LOGGER.debug('not enough comments %s', url)
-        if len_text < config.getint('DEFAULT', 'MIN_OUTPUT_SIZE') and len_comments < config.getint('DEFAULT',
-                                                                                                   'MIN_OUTPUT_COMM_SIZE'):
+        if len_text < extraction_profile.min_output_size and \
+                len_comments < extraction_profile.min_output_comm_size:
             LOGGER.debug('text and comments not long enough: %s %s', len_text, len_comments)
             raise ValueError
 
@@ -1014,9 +1224,10 @@ def bare_extraction(filecontent, url=None, no_fallback=False,  # fast=False,
 
     # special case: python variables
     if output_format == 'python':
-        document.text = xmltotxt(postbody, include_formatting)
-        if include_comments is True:
-            document.comments = xmltotxt(commentsbody, include_formatting)
+        with StageTimer('serialization'):
+            document.text = xmltotxt(postbody, include_formatting)
+            if include_comments is True:
+                document.comments = xmltotxt(commentsbody, include_formatting)
     else:
         document.raw_text, document.body, document.commentsbody = temp_text, postbody, commentsbody
     if as_dict is True:
@@ -1024,11 +1235,6 @@ def bare_extraction(filecontent, url=None, no_fallback=False,  # fast=False,
     return document
 
 
-def timeout_handler(signum, frame):
-    '''Raise a timeout exception to handle rare malicious files'''
-    raise RuntimeError('unusual file processing time, aborting')
-
-
 def extract(filecontent, url, record_id=None, no_fallback=False,
             favor_precision=False, favor_recall=False,
             include_comments=True, output_format='txt',
@@ -1038,13 +1244,13 @@ def extract(filecontent, url, record_id=None, no_fallback=False,
             date_extraction_params=None,
             only_with_metadata=False, with_metadata=False,
             max_tree_size=None, url_blacklist=None, author_blacklist=None,
-            settingsfile=None, config=DEFAULT_CONFIG,
-            **kwargs):
+            timeout=None, settingsfile=None, config=DEFAULT_CONFIG,
+            extraction_profile=None, **kwargs):
     """Main function exposed by the package:
        Wrapper for text extraction and conversion to chosen output format.
 
     Args:
-        filecontent: HTML code as string.
+        filecontent: HTML code as string, bytes or an already parsed LXML tree.
         url: URL of the webpage.
         record_id: Add an ID to the metadata.
         no_fallback: Skip the backup extraction with readability-lxml and justext.
@@ -1067,8 +1273,12 @@ def extract(filecontent, url, record_id=None, no_fallback=False,
         max_tree_size: Discard documents with too many elements.
         url_blacklist: Provide a blacklist of URLs as set() to filter out documents.
         author_blacklist: Provide a blacklist of Author Names as set() to filter out authors.
+        timeout: Maximum processing time in seconds, the extraction is downgraded
+            to the baseline once it is exceeded (no limit by default).
         settingsfile: Use a configuration file to override the standard settings.
         config: Directly provide a configparser configuration.
+        extraction_profile: Reuse an ExtractionProfile, its settings replace
+            the configuration and the corresponding options above.
 
     Returns:
         A string in the desired format or None.
@@ -1088,11 +1298,15 @@ def extract(filecontent, url, record_id=None, no_fallback=False,
         # todo: add with_metadata later
 
     # configuration init
-    config = use_config(settingsfile, config)
-    # 先让url变成绝对的
-    tree = html.fromstring(filecontent)
-    tree.make_links_absolute(url)
-    filecontent = tostring(tree, encoding='utf-8').decode('utf-8')
+    if extraction_profile is None:
+        config = use_config(settingsfile, config)
+        strip_payloads = config.getboolean('DEFAULT', 'STRIP_PAYLOADS', fallback=False)
+    else:
+        include_formatting = extraction_profile.formatting
+        strip_payloads = extraction_profile.strip_payloads
+
+    # parse or copy once in bare_extraction(), with absolute links
+    filecontent = TreeSnapshot(filecontent, strip_payloads, base_url=url)
 
     # extraction
     try:
@@ -1108,10 +1322,12 @@ def extract(filecontent, url, record_id=None, no_fallback=False,
             only_with_metadata=only_with_metadata, with_metadata=with_metadata,
             max_tree_size=max_tree_size, url_blacklist=url_blacklist,
             author_blacklist=author_blacklist,
-            as_dict=False, config=config,
+            as_dict=False, timeout=timeout, config=config,
+            extraction_profile=extraction_profile,
         )
-    except RuntimeError:
-        LOGGER.error('Processing timeout for %s', url)
+    # timeouts are handled in bare_extraction(), deeply nested trees are not
+    except RecursionError:
+        LOGGER.error('recursion limit reached for %s', url)
         document = None
 
     # post-processing
@@ -1124,7 +1340,120 @@ def extract(filecontent, url, record_id=None, no_fallback=False,
         document.fingerprint = content_fingerprint(str(document.title) + " " + document.raw_text)
 
     # return
-    return determine_returnstring(document, output_format, include_formatting, tei_validation)
+    with StageTimer('serialization'):
+        return determine_returnstring(document, output_format, include_formatting, tei_validation)
+
+
+def init_worker(options, dedup_cache=None):
+    '''Store the extraction settings once per worker process,
+       along with the duplicate cache shared by all workers'''
+    WORKER_OPTIONS.clear()
+    WORKER_OPTIONS.update(options)
+    if dedup_cache is not None:
+        use_dedup_cache(dedup_cache)
+
+
+def extract_chunk(chunk, profiling=False):
+    '''Extract a series of (index, (HTML, URL)) items in a worker process,
+       keeping track of the errors for each document and optionally
+       returning the measurements made along the way'''
+    results, report = [], None
+    if profiling is True:
+        report = ProfileReport()
+        register_hook(report)
+    try:
+        for index, (filecontent, url) in chunk:
+            try:
+                result, error = extract(filecontent, url, **WORKER_OPTIONS), None
+            except Exception as err:
+                result, error = None, err
+            results.append(BatchResult(index, url, result, error))
+    finally:
+        if report is not None:
+            unregister_hook(report)
+    return results, report
+
+
+def extract_many(inputs, workers=None, ordered=False, chunksize=1,
+                 profile=None, settingsfile=None, config=DEFAULT_CONFIG, **kwargs):
+    """Run the extraction on a series of documents with a pool of processes.
+
+    Args:
+        inputs: Iterable of (HTML code, URL) tuples.
+        workers: Number of worker processes, defaults to the number of processors.
+        ordered: Return the results in input order instead of as soon as they are ready.
+        chunksize: Number of documents sent to a worker process at once.
+        profile: Optional ProfileReport collecting the timings of the worker processes.
+        settingsfile: Use a configuration file to override the standard settings.
+        config: Directly provide a configparser configuration.
+        **kwargs: Further extraction options passed to extract().
+
+    Returns:
+        A generator of BatchResult tuples (index, url, result, error),
+        with index being the position of the document in the input
+        and error the exception raised while processing it, if any.
+        If a worker process dies, the documents it had pending are
+        reported with a BrokenProcessPool error and a new pool takes over.
+        With deduplication the workers share the cache of duplicate segments,
+        see trafilatura.filters.shared_dedup_cache(), the cache of the current
+        process is restored afterwards.
+
+    """
+    kwargs['config'] = use_config(settingsfile, config)
+    # repetitions are counted across workers
+    profile_options = kwargs.get('extraction_profile')
+    deduplicate = profile_options.dedup if profile_options is not None else kwargs.get('deduplicate', False)
+    # the cache of the current process is restored afterwards
+    previous_cache = filters.LRU_TEST
+    dedup_cache = shared_dedup_cache() if deduplicate else None
+    workers = workers or os.cpu_count() or 1
+    pool_options = {'max_workers': workers, 'initializer': init_worker, 'initargs': (kwargs, dedup_cache)}
+    executor, generation = ProcessPoolExecutor(**pool_options), 0
+    # bounded number of pending tasks to keep memory use in check
+    max_pending = workers * 4
+    chunks = make_chunks(enumerate(inputs), chunksize)
+    pending = deque() if ordered else {}
+    try:
+        while True:
+            while len(pending) < max_pending:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    break
+                try:
+                    future = executor.submit(extract_chunk, chunk, profile is not None)
+                # a worker process died: the rest of the input goes to a new pool
+                except BrokenProcessPool:
+                    executor.shutdown(wait=False)
+                    executor, generation = ProcessPoolExecutor(**pool_options), generation + 1
+                    future = executor.submit(extract_chunk, chunk, profile is not None)
+                if ordered:
+                    pending.append((future, chunk, generation))
+                else:
+                    pending[future] = (future, chunk, generation)
+            if not pending:
+                break
+            if ordered:
+                done = [pending.popleft()]
+            else:
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                done = [pending.pop(future) for future in finished]
+            for future, chunk, pool_id in done:
+                try:
+                    results, report = future.result()
+                    if report is not None:
+                        profile.merge(report)
+                    yield from results
+                # the worker itself failed: report it for each document
+                except Exception as err:
+                    LOGGER.error('worker failure: %s', err)
+                    # all pending chunks of a broken pool fail, the next ones use a new pool
+                    if isinstance(err, BrokenProcessPool) and pool_id == generation:
+                        executor.shutdown(wait=False)
+                        executor, generation = ProcessPoolExecutor(**pool_options), generation + 1
+                    yield from (BatchResult(index, url, None, err) for index, (_, url) in chunk)
+    finally:
+        executor.shutdown()
+        use_dedup_cache(previous_cache)
 
 
 # for legacy and backwards compatibility
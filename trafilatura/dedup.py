@@ -0,0 +1,418 @@
+"""
+Caches used to count repeated text segments: segments are identified
+by fixed-size digests instead of their text. The backends work in the
+current process, across a pool of processes or on disk between runs.
+"""
+
+## This file is available from https://github.com/adbar/trafilatura
+## under GNU GPL v3 license
+
+import ctypes
+import logging
+import math
+import mmap
+import multiprocessing
+import os
+import sqlite3
+import struct
+
+from array import array
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from hashlib import blake2b
+from threading import RLock
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+# approximate memory used by an entry of the digest cache (64-bit key, counter, dictionary slot)
+ENTRY_SIZE = 160
+# rows of the count-min sketch, each with an independent hash function
+SKETCH_DEPTH = 4
+MAX_COUNT = 2**32 - 1
+# size of a slot of the shared table (64-bit key, 32-bit counter) and number of slots tested per key
+SLOT_SIZE = 12
+SHARED_PROBES = 8
+STATS_FIELDS = ('hits', 'misses', 'evictions')
+# Bloom filter: default sizing, file header (magic string, bits, hash functions,
+# error rate, capacity, insertions) padded to 64 bytes, occurrences counted per segment
+BLOOM_CAPACITY = 10**6
+BLOOM_ERROR_RATE = 0.001
+BLOOM_MAGIC = b'TRFBLOOM'
+BLOOM_HEADER = struct.Struct('<8sQQdQQ')
+BLOOM_OFFSET = 64
+BLOOM_MAX_COUNT = 16
+
+
+def text_digest(text):
+    "Return a 64-bit integer identifying a text segment."
+    return int.from_bytes(blake2b(text.encode('utf-8', 'surrogatepass'), digest_size=8).digest(), 'little')
+
+
+class DigestCache:
+    """Least Recently Used (LRU) counters of text segments keyed by their digests,
+       the number of entries is derived from a memory budget in bytes."""
+    __slots__ = ['lock', 'max_bytes', 'maxsize', 'cache', 'stats']
+
+    def __init__(self, max_bytes):
+        self.lock = RLock()
+        self.max_bytes = max_bytes
+        self.maxsize = max(1, max_bytes // ENTRY_SIZE)
+        self.cache = OrderedDict()
+        # hits, misses and evictions
+        self.stats = Counter()
+
+    def __len__(self):
+        return len(self.cache)
+
+    def get(self, key):
+        '''Return the count for a key and mark it as recently used, -1 if it is unknown'''
+        with self.lock:
+            value = self.cache.get(key)
+            if value is None:
+                return -1
+            self.cache.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        '''Store a count for a key and evict the least recently used entry if necessary'''
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+            elif len(self.cache) >= self.maxsize:
+                self.cache.popitem(last=False)
+                self.stats['evictions'] += 1
+            self.cache[key] = value
+
+    def increment(self, key):
+        '''Count a new occurrence and return the number of previous ones'''
+        with self.lock:
+            previous = self.get(key)
+            if previous == -1:
+                self.stats['misses'] += 1
+                previous = 0
+            else:
+                self.stats['hits'] += 1
+            self.put(key, previous + 1)
+            return previous
+
+    def clear(self):
+        '''Delete all cache content'''
+        with self.lock:
+            self.cache.clear()
+            self.stats.clear()
+
+
+class CountMinSketch:
+    """Approximate counters of text segments in a fixed amount of memory:
+       counts can be overestimated in case of collisions but are never forgotten,
+       the structure has to be cleared to start anew."""
+    __slots__ = ['lock', 'max_bytes', 'width', 'depth', 'table', 'stats']
+
+    def __init__(self, max_bytes, depth=SKETCH_DEPTH):
+        self.lock = RLock()
+        self.max_bytes = max_bytes
+        self.depth = depth
+        self.width = max(1, max_bytes // (depth * array('I').itemsize))
+        self.table = array('I', bytes(self.width * depth * array('I').itemsize))
+        # hits and misses, nothing is evicted
+        self.stats = Counter()
+
+    def _positions(self, key):
+        "Derive one position per row from the 64-bit digest (double hashing)."
+        first, second = key & 0xFFFFFFFF, (key >> 32) | 1
+        return [row * self.width + (first + row * second) % self.width for row in range(self.depth)]
+
+    def get(self, key):
+        '''Return the estimated count for a key, -1 if it has not been seen'''
+        with self.lock:
+            count = min(self.table[pos] for pos in self._positions(key))
+        return count or -1
+
+    def increment(self, key):
+        '''Count a new occurrence and return the estimated number of previous ones'''
+        positions = self._positions(key)
+        with self.lock:
+            previous = min(self.table[pos] for pos in positions)
+            # conservative update: only the smallest counters are raised
+            if previous < MAX_COUNT:
+                for pos in positions:
+                    if self.table[pos] == previous:
+                        self.table[pos] = previous + 1
+            self.stats['hits' if previous else 'misses'] += 1
+        return previous
+
+    def clear(self):
+        '''Reset all counters'''
+        with self.lock:
+            self.table = array('I', bytes(len(self.table) * self.table.itemsize))
+            self.stats.clear()
+
+
+class SharedDigestTable:
+    """Counters of text segments in shared memory, readable and writable by the
+       processes started after its creation, e.g. in a pool of workers.
+       Open addressing in a fixed number of slots derived from a memory budget:
+       if all slots tested for a key are taken, the least frequent entry is replaced."""
+    __slots__ = ['lock', 'max_bytes', 'size', 'keys', 'counts', '_stats']
+
+    def __init__(self, max_bytes):
+        self.lock = multiprocessing.Lock()
+        self.max_bytes = max_bytes
+        self.size = max(SHARED_PROBES, max_bytes // SLOT_SIZE)
+        # empty slots have a null key
+        self.keys = multiprocessing.RawArray(ctypes.c_uint64, self.size)
+        self.counts = multiprocessing.RawArray(ctypes.c_uint32, self.size)
+        self._stats = multiprocessing.RawArray(ctypes.c_uint64, len(STATS_FIELDS))
+
+    def __len__(self):
+        return self.size - self.keys[:].count(0)
+
+    @property
+    def stats(self):
+        "Hits, misses and evictions of all processes."
+        return Counter({field: value for field, value in zip(STATS_FIELDS, self._stats) if value})
+
+    def _find(self, key):
+        "Return the slot holding the key or else a free one or the one to replace, and a flag."
+        keys, start = self.keys, key % self.size
+        positions = [(start + i) % self.size for i in range(SHARED_PROBES)]
+        for pos in positions:
+            if keys[pos] == key:
+                return pos, True
+            if keys[pos] == 0:
+                return pos, False
+        return min(positions, key=self.counts.__getitem__), False
+
+    def get(self, key):
+        '''Return the count for a key, -1 if it is unknown'''
+        # the null key marks empty slots
+        key = key or 1
+        with self.lock:
+            pos, found = self._find(key)
+            return self.counts[pos] if found else -1
+
+    def increment(self, key):
+        '''Count a new occurrence and return the number of previous ones'''
+        key = key or 1
+        with self.lock:
+            pos, found = self._find(key)
+            if found:
+                previous = self.counts[pos]
+                self.counts[pos] = min(previous + 1, MAX_COUNT)
+                self._stats[0] += 1
+                return previous
+            if self.keys[pos]:
+                self._stats[2] += 1
+            self.keys[pos], self.counts[pos] = key, 1
+            self._stats[1] += 1
+            return 0
+
+    def clear(self):
+        '''Delete all table content'''
+        with self.lock:
+            for table in (self.keys, self.counts, self._stats):
+                ctypes.memset(table, 0, ctypes.sizeof(table))
+
+
+class SQLiteDigestStore:
+    """Counters of text segments in a SQLite database, kept between runs and
+       usable by several processes at once. The store is not bounded in size."""
+    __slots__ = ['path', 'stats', '_connection', '_pid']
+
+    def __init__(self, path):
+        self.path = path
+        # hits and misses of the current process, nothing is evicted
+        self.stats = Counter()
+        self._connection, self._pid = None, None
+
+    def __getstate__(self):
+        # connections cannot be passed to other processes
+        return self.path
+
+    def __setstate__(self, path):
+        self.__init__(path)
+
+    def __len__(self):
+        return self._connect().execute('SELECT COUNT(*) FROM segments').fetchone()[0]
+
+    def _connect(self):
+        "Open one connection per process, the database is created if necessary."
+        if self._connection is None or self._pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=60, isolation_level=None, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=OFF')
+            connection.execute('CREATE TABLE IF NOT EXISTS segments (digest INTEGER PRIMARY KEY, count INTEGER NOT NULL)')
+            self._connection, self._pid = connection, os.getpid()
+        return self._connection
+
+    @staticmethod
+    def _signed(key):
+        "Convert the digest, SQLite integers are signed."
+        return key - 2**64 if key >= 2**63 else key
+
+    def get(self, key):
+        '''Return the count for a key, -1 if it is unknown'''
+        row = self._connect().execute('SELECT count FROM segments WHERE digest = ?', (self._signed(key),)).fetchone()
+        return -1 if row is None else row[0]
+
+    def increment(self, key):
+        '''Count a new occurrence and return the number of previous ones'''
+        connection, key = self._connect(), self._signed(key)
+        # other processes wait until the update is done
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            row = connection.execute('SELECT count FROM segments WHERE digest = ?', (key,)).fetchone()
+            previous = 0 if row is None else row[0]
+            connection.execute('INSERT OR REPLACE INTO segments VALUES (?, ?)', (key, previous + 1))
+        finally:
+            connection.execute('COMMIT')
+        self.stats['hits' if previous else 'misses'] += 1
+        return previous
+
+    def clear(self):
+        '''Delete all store content'''
+        self._connect().execute('DELETE FROM segments')
+        self.stats.clear()
+
+    def close(self):
+        '''Close the connection of the current process'''
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+
+class BloomFilter:
+    """Memory-mapped Bloom filter in a file kept between runs. Repetitions are
+       counted by registering the segment once per occurrence (up to max_count),
+       counts can be overestimated with the given probability but nothing is evicted.
+       Updates are serialized by a lock on the file, not available on Windows."""
+    __slots__ = ['path', 'max_count', 'num_bits', 'num_hashes', 'error_rate', 'capacity', 'stats', 'lock', '_file', '_map']
+
+    def __init__(self, path, capacity=BLOOM_CAPACITY, error_rate=BLOOM_ERROR_RATE, max_count=BLOOM_MAX_COUNT):
+        self.path = path
+        self.max_count = max_count
+        # hits and misses of the current process
+        self.stats = Counter()
+        if not os.path.isfile(path) or os.path.getsize(path) <= BLOOM_OFFSET:
+            if not 0 < error_rate < 1 or capacity < 1:
+                raise ValueError('invalid Bloom filter parameters')
+            # optimal size and number of hash functions for the capacity and error rate
+            num_bits = math.ceil(-capacity * math.log(error_rate) / math.log(2)**2)
+            num_hashes = max(1, round(num_bits / capacity * math.log(2)))
+            with open(path, 'wb') as outputfile:
+                outputfile.write(BLOOM_HEADER.pack(BLOOM_MAGIC, num_bits, num_hashes, error_rate, capacity, 0))
+                outputfile.truncate(BLOOM_OFFSET + (num_bits + 7) // 8)
+        # existing files keep their parameters
+        self._open()
+
+    def __getstate__(self):
+        # the file is mapped again by other processes
+        return self.path, self.max_count
+
+    def __setstate__(self, state):
+        self.path, self.max_count = state
+        self.stats = Counter()
+        self._open()
+
+    def __len__(self):
+        "Number of insertions, i.e. of occurrences registered."
+        return BLOOM_HEADER.unpack_from(self._map)[5]
+
+    def _open(self):
+        "Map the file and read the parameters in its header."
+        self.lock = RLock()
+        self._file = open(self.path, 'r+b')
+        self._map = mmap.mmap(self._file.fileno(), 0)
+        magic, self.num_bits, self.num_hashes, self.error_rate, self.capacity, _ = BLOOM_HEADER.unpack_from(self._map)
+        if magic != BLOOM_MAGIC:
+            self.close()
+            raise ValueError(f'not a Bloom filter file: {self.path}')
+
+    def _positions(self, key, level):
+        "Derive the bits of a segment occurrence from a further hash (double hashing)."
+        digest = blake2b(key.to_bytes(8, 'little') + bytes((level,)), digest_size=16).digest()
+        num_bits = self.num_bits
+        # small numbers are faster to add
+        pos = int.from_bytes(digest[:8], 'little') % num_bits
+        step = int.from_bytes(digest[8:], 'little') % num_bits or 1
+        positions = []
+        for _ in range(self.num_hashes):
+            positions.append(pos)
+            pos += step
+            if pos >= num_bits:
+                pos -= num_bits
+        return positions
+
+    @contextmanager
+    def _locked(self):
+        "Keep other threads and processes from writing at the same time."
+        with self.lock:
+            if fcntl is None:
+                yield
+                return
+            fcntl.lockf(self._file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.lockf(self._file, fcntl.LOCK_UN)
+
+    def _contains(self, key, level):
+        "Test if all bits of an occurrence are set."
+        data = self._map
+        for pos in self._positions(key, level):
+            if not data[BLOOM_OFFSET + (pos >> 3)] & (1 << (pos & 7)):
+                return False
+        return True
+
+    def _add(self, key, level):
+        "Set the bits of an occurrence and update the number of insertions."
+        data = self._map
+        for pos in self._positions(key, level):
+            data[BLOOM_OFFSET + (pos >> 3)] |= 1 << (pos & 7)
+        count = len(self) + 1
+        struct.pack_into('<Q', data, BLOOM_HEADER.size - 8, count)
+        if count == self.capacity + 1:
+            LOGGER.warning('Bloom filter capacity exceeded, more false positives: %s', self.path)
+
+    def get(self, key):
+        '''Return the estimated count for a key, -1 if it has not been seen'''
+        count = 0
+        while count < self.max_count and self._contains(key, count):
+            count += 1
+        return count or -1
+
+    def increment(self, key):
+        '''Register a new occurrence and return the estimated number of previous ones'''
+        with self._locked():
+            previous = max(self.get(key), 0)
+            if previous < self.max_count:
+                self._add(key, previous)
+        self.stats['hits' if previous else 'misses'] += 1
+        return previous
+
+    def clear(self):
+        '''Reset all bits and the number of insertions'''
+        start = BLOOM_HEADER.size - 8
+        with self._locked():
+            self._map[start:] = bytes(len(self._map) - start)
+        self.stats.clear()
+
+    def close(self):
+        '''Write the changes to disk and release the file'''
+        if not self._map.closed:
+            self._map.flush()
+            self._map.close()
+        self._file.close()
+
+
+# caches which can be passed to worker processes
+SHARED_BACKENDS = (SharedDigestTable, SQLiteDigestStore, BloomFilter)
+# caches which only last as long as the current run
+IN_MEMORY_BACKENDS = (DigestCache, CountMinSketch, SharedDigestTable)
@@ -9,6 +9,7 @@ import random
 from collections import namedtuple
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from time import sleep
+from urllib.parse import urlsplit
 
 import certifi
 
@@ -30,8 +31,8 @@ from courlan.network import redirection_test
 
 from . import __version__
 from .settings import DEFAULT_CONFIG
-from .utils import (URL_BLACKLIST_REGEX, decode_response, make_chunks,
-                    uniquify_list)
+from .utils import (HEADER_CHARSET, URL_BLACKLIST_REGEX, StreamLoader,
+                    decode_response, make_chunks, uniquify_list)
 
 NUM_CONNECTIONS = 50
 MAX_REDIRECTS = 2
@@ -47,7 +48,18 @@ DEFAULT_HEADERS['User-Agent'] = USER_AGENT
 
 LOGGER = logging.getLogger(__name__)
 
-RawResponse = namedtuple('RawResponse', ['data', 'status', 'url'])
+RawResponse = namedtuple('RawResponse', ['data', 'status', 'url', 'charset'])
+# charset declared in the Content-Type header, optional
+RawResponse.__new__.__defaults__ = (None,)
+
+# incremental parsing: size of the chunks read from urllib3
+STREAM_CHUNK_SIZE = 2**16
+
+
+def _header_charset(content_type):
+    'Internal function to extract the charset from a Content-Type header.'
+    match = HEADER_CHARSET.search(content_type or '')
+    return match[1] if match else None
 
 
 # caching throws an error
@@ -77,9 +89,8 @@ def _determine_headers(config, headers=None):
     return headers or DEFAULT_HEADERS
 
 
-def _send_request(url, no_ssl, config):
-    "Internal function to robustly send a request (SSL or not) and return its result."
-    # customize headers
+def _get_pool(no_ssl, config):
+    "Internal function to create and reuse connection pools (SSL or not)."
     global HTTP_POOL, NO_CERT_POOL, RETRY_STRATEGY
     if not RETRY_STRATEGY:
         RETRY_STRATEGY = urllib3.util.Retry(
@@ -92,21 +103,20 @@ def _send_request(url, no_ssl, config):
             ],
             # unofficial: https://en.wikipedia.org/wiki/List_of_HTTP_status_codes#Unofficial_codes
         )
+    if no_ssl is False:
+        if not HTTP_POOL:
+            HTTP_POOL = urllib3.PoolManager(retries=RETRY_STRATEGY, timeout=config.getint('DEFAULT', 'DOWNLOAD_TIMEOUT'), ca_certs=certifi.where(), num_pools=NUM_CONNECTIONS)  # cert_reqs='CERT_REQUIRED'
+        return HTTP_POOL
+    if not NO_CERT_POOL:
+        NO_CERT_POOL = urllib3.PoolManager(retries=RETRY_STRATEGY, timeout=config.getint('DEFAULT', 'DOWNLOAD_TIMEOUT'), cert_reqs='CERT_NONE', num_pools=NUM_CONNECTIONS)
+    return NO_CERT_POOL
+
+
+def _send_request(url, no_ssl, config):
+    "Internal function to robustly send a request (SSL or not) and return its result."
     try:
-        # TODO: read by streaming chunks (stream=True, iter_content=xx)
-        # so we can stop downloading as soon as MAX_FILE_SIZE is reached
-        if no_ssl is False:
-            # define pool
-            if not HTTP_POOL:
-                HTTP_POOL = urllib3.PoolManager(retries=RETRY_STRATEGY, timeout=config.getint('DEFAULT', 'DOWNLOAD_TIMEOUT'), ca_certs=certifi.where(), num_pools=NUM_CONNECTIONS)  # cert_reqs='CERT_REQUIRED'
-            # execute request
-            response = HTTP_POOL.request('GET', url, headers=_determine_headers(config))
-        else:
-            # define pool
-            if not NO_CERT_POOL:
-                NO_CERT_POOL = urllib3.PoolManager(retries=RETRY_STRATEGY, timeout=config.getint('DEFAULT', 'DOWNLOAD_TIMEOUT'), cert_reqs='CERT_NONE', num_pools=NUM_CONNECTIONS)
-            # execute request
-            response = NO_CERT_POOL.request('GET', url, headers=_determine_headers(config))
+        # customize headers and execute request
+        response = _get_pool(no_ssl, config).request('GET', url, headers=_determine_headers(config))
     except urllib3.exceptions.SSLError:
         LOGGER.warning('retrying after SSLError: %s', url)
         return _send_request(url, True, config)
@@ -114,11 +124,45 @@ def _send_request(url, no_ssl, config):
         LOGGER.error('download error: %s %s', url, err)  # sys.exc_info()[0]
     else:
         # necessary for standardization
-        return RawResponse(response.data, response.status, response.geturl())
+        return RawResponse(response.data, response.status, response.geturl(),
+                           _header_charset(response.headers.get('Content-Type')))
     # catchall
     return None
 
 
+def _stream_request(url, loader, no_ssl, config):
+    "Internal function to send a request and feed the body to a loader while it is being received."
+    try:
+        response = _get_pool(no_ssl, config).request('GET', url, headers=_determine_headers(config),
+                                                     preload_content=False)
+    except urllib3.exceptions.SSLError:
+        LOGGER.warning('retrying after SSLError: %s', url)
+        return _stream_request(url, loader, True, config)
+    except Exception as err:
+        LOGGER.error('download error: %s %s', url, err)
+        return None
+    max_size, complete = config.getint('DEFAULT', 'MAX_FILE_SIZE'), False
+    try:
+        if response.status == 200:
+            loader.declared_encoding = _header_charset(response.headers.get('Content-Type'))
+            for chunk in response.stream(STREAM_CHUNK_SIZE):
+                loader.feed(chunk)
+                # stop downloading as soon as the limit is reached
+                if loader.size > max_size:
+                    break
+            else:
+                complete = True
+    except Exception as err:
+        LOGGER.error('download error: %s %s', url, err)
+        return None
+    finally:
+        # the connection cannot be reused if data is left unread
+        if not complete:
+            response.close()
+        response.release_conn()
+    return RawResponse(loader, response.status, response.geturl())
+
+
 def _handle_response(url, response, decode, config):
     'Internal function to run safety checks on response result.'
     if response.status != 200:
@@ -130,7 +174,22 @@ def _handle_response(url, response, decode, config):
         LOGGER.error('too large: length %s for URL %s', len(response.data), url)
         # raise error instead?
     else:
-        return decode_response(response.data) if decode is True else response
+        return decode_response(response) if decode is True else response
+    # catchall
+    return None
+
+
+def _handle_stream(url, response, config):
+    'Internal function to run safety checks on a streamed response and finish parsing.'
+    loader = response.data
+    if response.status != 200:
+        LOGGER.error('not a 200 response: %s for URL %s', response.status, url)
+    elif loader.size < config.getint('DEFAULT', 'MIN_FILE_SIZE'):
+        LOGGER.error('too small/incorrect for URL %s', url)
+    elif loader.size > config.getint('DEFAULT', 'MAX_FILE_SIZE'):
+        LOGGER.error('too large: length %s for URL %s', loader.size, url)
+    else:
+        return loader.close()
     # catchall
     return None
 
@@ -145,7 +204,8 @@ def fetch_url(url, decode=True, no_ssl=False, config=DEFAULT_CONFIG):
         config: Pass configuration values for output control.
 
     Returns:
-        RawResponse object: data (headers + body), status (HTML code as string) and url
+        RawResponse object: data (headers + body), status (HTML code as string), url
+        and charset declared in the headers,
         or None in case the result is invalid or there was a problem with the network.
 
     """
@@ -162,6 +222,32 @@ def fetch_url(url, decode=True, no_ssl=False, config=DEFAULT_CONFIG):
     return None
 
 
+def fetch_tree(url, no_ssl=False, config=DEFAULT_CONFIG):
+    """Fetches page and parses it while it is being downloaded,
+       so that no complete copy of the document is held in memory.
+
+    Args:
+        url: URL of the page to fetch.
+        no_ssl: Don't try to establish a secure connection (to prevent SSLError).
+        config: Pass configuration values for output control.
+
+    Returns:
+        LXML tree which can be passed on to the extraction functions
+        or None in case the result is invalid or there was a problem with the network.
+
+    """
+    LOGGER.debug('sending request: %s', url)
+    loader = StreamLoader(host=urlsplit(url).hostname)
+    if pycurl is None:
+        response = _stream_request(url, loader, no_ssl, config)
+    else:
+        response = _stream_pycurl_request(url, loader, no_ssl, config)
+    if response is not None:
+        return _handle_stream(url, response, config)
+    LOGGER.debug('request failed: %s', url)
+    return None
+
+
 def _pycurl_is_live_page(url):
     "Send a basic HTTP HEAD request with pycurl."
     # Initialize pycurl object
@@ -238,20 +324,22 @@ def load_download_buffer(url_store, sleep_time=5):
     return bufferlist, url_store
 
 
-def buffered_downloads(bufferlist, download_threads, decode=True):
-    '''Download queue consumer, single- or multi-threaded.'''
+def buffered_downloads(bufferlist, download_threads, decode=True, parse=False):
+    '''Download queue consumer, single- or multi-threaded,
+       optionally returning trees parsed during the download.'''
     with ThreadPoolExecutor(max_workers=download_threads) as executor:
         for chunk in make_chunks(bufferlist, 10000):
-            future_to_url = {executor.submit(fetch_url, url, decode): url for url in chunk}
+            if parse is True:
+                future_to_url = {executor.submit(fetch_tree, url): url for url in chunk}
+            else:
+                future_to_url = {executor.submit(fetch_url, url, decode): url for url in chunk}
             for future in as_completed(future_to_url):
                 # url and download result
                 yield future_to_url[future], future.result()
 
 
-def _send_pycurl_request(url, no_ssl, config):
-    '''Experimental function using libcurl and pycurl to speed up downloads'''
-    # https://github.com/pycurl/pycurl/blob/master/examples/retriever-multi.py
-
+def _init_pycurl(url, no_ssl, config):
+    '''Prepare a libcurl request with the settings used for all downloads'''
     # init
     # headerbytes = BytesIO()
     headers = _determine_headers(config)
@@ -283,6 +371,13 @@ def _send_pycurl_request(url, no_ssl, config):
     # TCP_FASTOPEN
     # curl.setopt(pycurl.FAILONERROR, 1)
     # curl.setopt(pycurl.ACCEPT_ENCODING, '')
+    return curl
+
+
+def _send_pycurl_request(url, no_ssl, config):
+    '''Experimental function using libcurl and pycurl to speed up downloads'''
+    # https://github.com/pycurl/pycurl/blob/master/examples/retriever-multi.py
+    curl = _init_pycurl(url, no_ssl, config)
 
     # send request
     try:
@@ -314,9 +409,49 @@ def _send_pycurl_request(url, no_ssl, config):
     respcode = curl.getinfo(curl.RESPONSE_CODE)
     # url
     effective_url = curl.getinfo(curl.EFFECTIVE_URL)
+    # declared charset
+    charset = _header_charset(curl.getinfo(curl.CONTENT_TYPE))
     # additional info
     # ip_info = curl.getinfo(curl.PRIMARY_IP)
 
     # tidy up
     curl.close()
-    return RawResponse(bufferbytes, respcode, effective_url)
+    return RawResponse(bufferbytes, respcode, effective_url, charset)
+
+
+def _stream_pycurl_request(url, loader, no_ssl, config):
+    '''Download with pycurl and feed the body to a loader while it is being received'''
+    curl = _init_pycurl(url, no_ssl, config)
+    max_size = config.getint('DEFAULT', 'MAX_FILE_SIZE')
+
+    def read_header(line):
+        "Store the declared charset, the headers of redirections come first."
+        line = line.decode('iso-8859-1')
+        if line.startswith('HTTP/'):
+            loader.declared_encoding = None
+        elif line.lower().startswith('content-type:'):
+            loader.declared_encoding = _header_charset(line)
+
+    def write_chunk(chunk):
+        "Parse the chunk, a different return value aborts the transfer."
+        loader.feed(chunk)
+        return None if loader.size <= max_size else 0
+
+    curl.setopt(pycurl.HEADERFUNCTION, read_header)
+    curl.setopt(pycurl.WRITEFUNCTION, write_chunk)
+    try:
+        curl.perform()
+    except pycurl.error as err:
+        # the transfer was interrupted because of its size
+        if loader.size <= max_size:
+            LOGGER.error('pycurl error: %s %s', url, err)
+            curl.close()
+            # retry in case of SSL-related error, see _send_pycurl_request()
+            if no_ssl is False and loader.size == 0 and err.args[0] in (35, 54, 58, 59, 60, 64, 66, 77, 82, 83, 91):
+                LOGGER.debug('retrying after SSL error: %s %s', url, err)
+                return _stream_pycurl_request(url, loader, True, config)
+            return None
+    respcode = curl.getinfo(curl.RESPONSE_CODE)
+    effective_url = curl.getinfo(curl.EFFECTIVE_URL)
+    curl.close()
+    return RawResponse(loader, respcode, effective_url)
@@ -9,17 +9,22 @@ Functions grounding on third-party software.
 
 import logging
 import lzma
+import os
+import tempfile
+from functools import lru_cache
 from pathlib import Path
 from pickle import load as load_pickle
+from struct import error as StructError
 
 # third-party
-from justext.core import (ParagraphMaker, classify_paragraphs, preprocessor,
-                          revise_paragraph_classification)
 from justext.utils import get_stoplist  # , get_stoplists
 from lxml.etree import Element, strip_tags
 
 # own
+from . import __version__
 from .htmlprocessing import convert_tags, prune_unwanted_nodes, tree_cleaning
+from .paragraphs import (FrozenStoplist, ParagraphMaker, classify_paragraphs,
+                         freeze_stoplist, revise_paragraph_classification)
 from .readability_lxml import Document as ReadabilityDocument  # fork
 from .settings import JUSTEXT_LANGUAGES
 from .utils import fromstring_bytes, trim
@@ -46,11 +51,61 @@ def try_readability(htmlinput):
         return Element('div')
 
 
+def jt_frozen_path():
+    'Locate the frozen union of all JusText stoplists in the user cache directory'
+    cache_dir = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_dir, 'trafilatura', f'jt-stopwords-{__version__}.bin')
+
+
+def load_jt_words():
+    'Read the compressed union of all JusText stoplists shipped with the package'
+    with lzma.open(JT_PICKLE, 'rb') as picklefile:
+        return load_pickle(picklefile)
+
+
+def build_frozen_stoplist(filename):
+    '''Derive the frozen stoplist from the compressed one shipped with the package,
+       return the words if the file cannot be written'''
+    words = load_jt_words()
+    tmpname = None
+    try:
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        # other processes only see complete files
+        handle, tmpname = tempfile.mkstemp(dir=os.path.dirname(filename), suffix='.tmp')
+        os.close(handle)
+        freeze_stoplist(words, tmpname)
+        os.replace(tmpname, filename)
+    except OSError as err:
+        LOGGER.warning('cannot write frozen stoplist %s: %s', filename, err)
+        if tmpname is not None and os.path.exists(tmpname):
+            os.remove(tmpname)
+        return words
+    return None
+
+
+def open_frozen_stoplist(filename):
+    'Map a frozen stoplist into memory, return None if the file is missing or damaged'
+    try:
+        return FrozenStoplist(filename)
+    except (OSError, ValueError, StructError) as err:
+        LOGGER.warning('cannot read frozen stoplist %s: %s', filename, err)
+        return None
+
+
 def jt_stoplist_init():
-    'Retrieve and return the content of all JusText stoplists'
+    '''Map the frozen content of all JusText stoplists into memory and return it,
+       the table is (re-)built in the cache directory if necessary'''
     global JT_STOPLIST
-    with lzma.open(JT_PICKLE, 'rb') as picklefile:
-        JT_STOPLIST = load_pickle(picklefile)
+    filename = jt_frozen_path()
+    stoplist = open_frozen_stoplist(filename) if os.path.isfile(filename) else None
+    if stoplist is None:
+        words = build_frozen_stoplist(filename)
+        # fallback: regular set in memory
+        if words is None:
+            stoplist = open_frozen_stoplist(filename)
+        if stoplist is None:
+            stoplist = frozenset(w.lower() for w in (words or load_jt_words()))
+    JT_STOPLIST = stoplist
     # stoplist = set()
     # for language in get_stoplists():
     #     stoplist.update(get_stoplist(language))
@@ -58,10 +113,15 @@ def jt_stoplist_init():
     return JT_STOPLIST
 
 
+@lru_cache(maxsize=128)
+def jt_language_stoplist(language):
+    'Load the JusText stoplist of a language once'
+    return get_stoplist(language)
+
+
 def custom_justext(tree, stoplist):
-    'Customized version of JusText processing'
-    dom = preprocessor(tree)  # tree_cleaning(tree, True)
-    paragraphs = ParagraphMaker.make_paragraphs(dom)
+    'Customized version of JusText processing, on a tree already cleaned'
+    paragraphs = ParagraphMaker().process(tree)
     classify_paragraphs(paragraphs, stoplist, 50, 200, 0.1, 0.2, 0.2, True)
     revise_paragraph_classification(paragraphs, 200)
     return paragraphs
@@ -73,9 +133,9 @@ def try_justext(tree, url, target_language):
     result_body = Element('body')
     # determine language
     if target_language is not None and target_language in JUSTEXT_LANGUAGES:
-        justext_stoplist = get_stoplist(JUSTEXT_LANGUAGES[target_language])
+        justext_stoplist = jt_language_stoplist(JUSTEXT_LANGUAGES[target_language])
     else:
-        justext_stoplist = JT_STOPLIST or jt_stoplist_init()
+        justext_stoplist = JT_STOPLIST if JT_STOPLIST is not None else jt_stoplist_init()
     # extract
     try:
         paragraphs = custom_justext(tree, justext_stoplist)
@@ -111,8 +171,6 @@ def sanitize_tree(tree, options):
     '''Convert and sanitize the output from the generic algorithm (post-processing)'''
     # 1. clean
     cleaned_tree = tree_cleaning(tree, options)
-    for elem in tree.findall(SANITIZED_XPATH):
-        elem.getparent().remove(elem)
     if options.links is False:
         strip_tags(cleaned_tree, 'a')
     strip_tags(cleaned_tree, 'span')
@@ -5,6 +5,7 @@ detection.
 
 import logging
 import re
+from collections import Counter
 
 # language detection
 try:
@@ -13,13 +14,21 @@ try:
 except ImportError:
     LANGID_FLAG = False
 
-from .lru import LRUCache
-from .settings import LRU_SIZE
+from .dedup import (BLOOM_CAPACITY, BLOOM_ERROR_RATE, SHARED_BACKENDS,
+                    BloomFilter, CountMinSketch, DigestCache,
+                    SharedDigestTable, SQLiteDigestStore, text_digest)
+from .settings import DEDUP_MEMORY, DEFAULT_CONFIG
 from .utils import trim
 
 LOGGER = logging.getLogger(__name__)
 
-LRU_TEST = LRUCache(maxsize=LRU_SIZE)
+# counters of text segments keyed by their digests, bounded in bytes
+LRU_TEST = DigestCache(DEDUP_MEMORY)
+
+# reasons for which documents have been discarded by the pre-screening
+PRESCREEN_STATS = Counter()
+
+VISIBLE_TEXT_XPATH = '//body//text()[not(ancestor::script or ancestor::style or ancestor::noscript or ancestor::template)]'
 
 RE_HTML_LANG = re.compile(r'([a-z]{2})')
 
@@ -31,29 +40,60 @@ RE_FILTER = re.compile(r'\W*(Drucken|E-?Mail|Facebook|Flipboard|Google|Instagram
 # COMMENTS_BLACKLIST = ('( Abmelden / Ändern )') # Fill in your details below|Trage deine Daten unten|Kommentar verfassen|Bitte logge dich|Hinterlasse einen Kommentar| to %s| mit %s)
 
 
-def put_in_cache(teststring):
-    '''Implement LRU cache'''
-    cacheval = LRU_TEST.get(teststring)
-    # if the value is already defined
-    if cacheval != -1:
-        # print(cacheval, teststring[:10] + '...')
-        LRU_TEST.put(teststring, cacheval + 1)
+def set_dedup_cache(max_bytes=DEDUP_MEMORY, approximate=False, backend='memory', path=None,
+                    capacity=BLOOM_CAPACITY, error_rate=BLOOM_ERROR_RATE):
+    """Replace the cache used by duplicate_test() with an empty one.
+
+    Args:
+        max_bytes: Amount of memory the cache can use, in bytes.
+        approximate: Use a count-min sketch in memory, which never forgets
+            segments but can overestimate their repetitions.
+        backend: 'memory' for a cache in the current process,
+            'shared' for a table shared with the processes started afterwards,
+            'sqlite' for a store on disk which persists between runs,
+            'bloom' for a memory-mapped Bloom filter which persists between runs.
+        path: File used by the SQLite store or the Bloom filter, existing counts are kept.
+        capacity: Number of segment occurrences a new Bloom filter is sized for.
+        error_rate: Expected false positive rate of a new Bloom filter.
+
+    Returns:
+        The new cache.
+
+    """
+    if backend == 'shared':
+        cache = SharedDigestTable(max_bytes)
+    elif backend in ('sqlite', 'bloom'):
+        if path is None:
+            raise ValueError(f'the {backend} backend needs a path')
+        cache = SQLiteDigestStore(path) if backend == 'sqlite' else BloomFilter(path, capacity, error_rate)
+    elif backend == 'memory':
+        cache = CountMinSketch(max_bytes) if approximate else DigestCache(max_bytes)
     else:
-        # print(0, teststring[:10] + '...')
-        LRU_TEST.put(teststring, 1)
+        raise ValueError(f'unknown deduplication backend: {backend}')
+    return use_dedup_cache(cache)
+
+
+def use_dedup_cache(cache):
+    "Install an existing cache, e.g. one passed to a worker process."
+    global LRU_TEST
+    LRU_TEST = cache
+    return LRU_TEST
+
+
+def shared_dedup_cache():
+    """Return a cache usable by several processes, the current
+       cache is replaced by a shared table of the same size if necessary."""
+    if not isinstance(LRU_TEST, SHARED_BACKENDS):
+        set_dedup_cache(getattr(LRU_TEST, 'max_bytes', DEDUP_MEMORY), backend='shared')
+    return LRU_TEST
 
 
 def duplicate_test(element, config):
     '''Check for duplicate text with LRU cache'''
     teststring = trim(' '.join(element.itertext()))
-    # teststring = element.text
     if len(teststring) > config.getint('DEFAULT', 'MIN_DUPLCHECK_SIZE'):
-        # retrieve value from cache
-        cacheval = LRU_TEST.get(teststring)
-        if cacheval > config.getint('DEFAULT', 'MAX_REPETITIONS'):  # non-existent key will return -1
-            LRU_TEST.put(teststring, cacheval + 1)
-            return True
-    put_in_cache(teststring)
+        # count the occurrence, previous ones are returned
+        return LRU_TEST.increment(text_digest(teststring)) > config.getint('DEFAULT', 'MAX_REPETITIONS')
     return False
 
 
@@ -83,6 +123,34 @@ def check_html_lang(tree, target_language, strict=False):
     return True
 
 
+def prescreen(tree, url, target_language=None, url_blacklist=None, config=DEFAULT_CONFIG):
+    '''Run cheap tests on a parsed document to discard it before extraction,
+       return a reason code or None if the document should be processed'''
+    reason = None
+    # canonical URL, with absolute links at this stage
+    if url_blacklist:
+        canonical = tree.find('.//head//link[@rel="canonical"][@href]')
+        if url in url_blacklist or (canonical is not None and canonical.get('href') in url_blacklist):
+            reason = 'url_blacklist'
+    # declared language, strict check
+    if reason is None and target_language is not None and check_html_lang(tree, target_language, strict=True) is False:
+        reason = 'html_lang'
+    # upper bound of the text that can be extracted
+    if reason is None:
+        text = trim(' '.join(tree.xpath(VISIBLE_TEXT_XPATH)))
+        if len(text) < config.getint('DEFAULT', 'PRESCREEN_MIN_TEXT_SIZE', fallback=25):
+            reason = 'visible_text'
+        # fast language guess on a sample
+        elif target_language is not None and LANGID_FLAG is True:
+            sample = text[:config.getint('DEFAULT', 'PRESCREEN_SAMPLE_SIZE', fallback=2000)]
+            if py3langid.classify(sample)[0] != target_language:
+                reason = 'language'
+    if reason is not None:
+        PRESCREEN_STATS[reason] += 1
+        LOGGER.debug('pre-screening: %s for URL %s', reason, url)
+    return reason
+
+
 def language_classifier(temp_text, temp_comments):
     '''Run external component (if installed) for language identification'''
     if LANGID_FLAG is True:
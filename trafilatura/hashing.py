@@ -1,43 +1,106 @@
 "Parts dedicated to content hashing and text similarity."
 
+import json
 import re
 import string
 from base64 import urlsafe_b64encode
 from functools import lru_cache
 from hashlib import blake2b
 from operator import add
-from typing import Any, List, Optional
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Tuple, Union
+
+try:
+    import numpy as np
+    NUMPY_FLAG = True
+except ImportError:
+    NUMPY_FLAG = False
 
 CLEAN_XML = re.compile(r"<[^<]+?>")
 
+# tokens longer than 1 to 5 characters are sampled
+MAX_THRESHOLD = 4
+
+# positions of the bits in a 64-bit token hash
+BIT_SHIFTS = np.arange(64, dtype=np.uint64) if NUMPY_FLAG else None
+
+
+class Tokens:
+    """Tokens of a text collected in a single pass, so that the same text
+    can be sampled and hashed several times without splitting it again.
+    A histogram of the token lengths is used to find the sampling threshold."""
+    __slots__ = ["tokens", "_lengths", "_samples"]
+
+    def __init__(self, inputstring: str = "") -> None:
+        "Keep alphanumeric tokens without surrounding punctuation."
+        tokens = []
+        for token in inputstring.split():
+            token = token.strip(string.punctuation)
+            if token.isalnum():
+                tokens.append(token)
+        self.tokens = tokens
+        self._lengths: Optional[List[int]] = None
+        # sampled tokens for each length threshold
+        self._samples: Dict[int, List[str]] = {}
+
+    def __len__(self) -> int:
+        return len(self.tokens)
+
+    @property
+    def lengths(self) -> List[int]:
+        "Number of tokens with 0, 1, 2, 3, 4 and 5 or more characters, counted once."
+        if self._lengths is None:
+            sizes = list(map(len, self.tokens))
+            lengths = [sizes.count(i) for i in range(MAX_THRESHOLD + 1)]
+            lengths.append(len(self.tokens) - sum(lengths))
+            self._lengths = lengths
+        return self._lengths
+
+    def threshold(self, length: int = 64) -> int:
+        "Find the largest length threshold keeping at least length/2 tokens, 0 if there is none."
+        # most texts are long enough for the largest threshold
+        if len(self._filter(MAX_THRESHOLD)) >= length / 2:
+            return MAX_THRESHOLD
+        longer = self.lengths[MAX_THRESHOLD + 1]
+        for i in range(MAX_THRESHOLD - 1, 0, -1):
+            longer += self.lengths[i + 1]
+            if longer >= length / 2:
+                return i
+        return 0
+
+    def _filter(self, threshold: int) -> List[str]:
+        "Return the tokens longer than the threshold, computed once per threshold."
+        if threshold not in self._samples:
+            self._samples[threshold] = [t for t in self.tokens if len(t) > threshold]
+        return self._samples[threshold]
+
+    def sample(self, length: int = 64) -> List[str]:
+        "Return the tokens longer than a threshold which leaves enough data."
+        return self._filter(self.threshold(length))
+
+
+def _tokens(inputstring: Union[str, Tokens]) -> Tokens:
+    "Tokenize the input unless it has already been done."
+    return inputstring if isinstance(inputstring, Tokens) else Tokens(inputstring)
 
-def sample_tokens(inputstring: str, length: int = 64) -> List[str]:
+
+def sample_tokens(inputstring: Union[str, Tokens], length: int = 64) -> List[str]:
     """Split input into list of tokens and adjust length threshold to make sure
     there is enough data."""
-    tokens = []
-    for token in inputstring.split():
-        token = token.strip(string.punctuation)
-        if token.isalnum():
-            tokens.append(token)
-    sample = []
-    for i in range(4, -1, -1):
-        sample = [t for t in tokens if len(t) > i]
-        if len(sample) >= length / 2:
-            return sample
-    return sample
-
-
-def generate_bow_hash(inputstring: str, length: int = 24) -> bytes:
+    return list(_tokens(inputstring).sample(length))
+
+
+def generate_bow_hash(inputstring: Union[str, Tokens], length: int = 24) -> bytes:
     "Create a bag of words and generate a hash for a given string."
-    teststring = " ".join(sample_tokens(inputstring)).strip()
+    teststring = " ".join(_tokens(inputstring).sample()).strip()
     # perform hashing with limited size
     return blake2b(teststring.encode(), digest_size=length).digest()
 
 
-def generate_hash_filename(content: str) -> str:
+def generate_hash_filename(content: Union[str, Tokens]) -> str:
     "Create a filename-safe string by hashing the given content."
     # delete potential XML tags first
-    content = CLEAN_XML.sub("", content)
+    if isinstance(content, str):
+        content = CLEAN_XML.sub("", content)
     return urlsafe_b64encode(generate_bow_hash(content, 12)).decode()
 
 
@@ -47,7 +110,7 @@ class Simhash:
 
     def __init__(
         self,
-        inputstring: str = "",
+        inputstring: Union[str, Tokens] = "",
         length: int = 64,
         existing_hash: Optional[str] = None,
     ) -> None:
@@ -55,42 +118,28 @@ class Simhash:
         self.length = length
         self.hash = self.validate(existing_hash) or self.create_hash(inputstring)
 
+    @classmethod
+    def batch(cls, texts: Iterable[Union[str, Tokens]], length: int = 64) -> List["Simhash"]:
+        "Calculate the hashes of several texts or tokenized texts at once."
+        hashes = simhash_values([_tokens(text).sample(length) for text in texts], length)
+        results = []
+        for value in hashes:
+            simhash = cls.__new__(cls)
+            simhash.length, simhash.hash = length, value
+            results.append(simhash)
+        return results
+
     def _hash(self, inputstring: str) -> int:
         "Return a numerical hash of the string."
-        return int.from_bytes(
-            blake2b(inputstring.encode(), digest_size=8).digest(), "big"
-        )
-        # old: variable-length version of Python's builtin hash by @sean-public
-        # see also Siphash13 in https://peps.python.org/pep-0456/
-        # if inputstring == "":
-        #    return 0
-        # mask = 2**self.length - 1
-        # x = ord(inputstring[0]) << 7
-        # for c in inputstring:
-        #    x = ((x * 1000003) ^ ord(c)) & mask
-        # x ^= len(inputstring)
-        # if x == -1:
-        #    return -2
-        # return x
-
-    @lru_cache(maxsize=2**14)
-    def _vector_to_add(self, token: str) -> List[int]:
-        "Create vector to add to the existing string vector"
-        the_hash = self._hash(token)
-        return [1 if the_hash & (1 << i) else -1 for i in range(self.length)]
-
-    def create_hash(self, inputstring: str) -> int:
+        return token_hash(inputstring)
+
+    def create_hash(self, inputstring: Union[str, Tokens]) -> int:
         """Calculates a Charikar simhash. References used:
         https://github.com/vilda/shash/
         https://github.com/sean-public/python-hashes/blob/master/hashes/simhash.py
         Optimized for Python by @adbar.
         """
-        vector = [0] * self.length
-
-        for token in sample_tokens(inputstring, self.length):
-            vector = list(map(add, vector, self._vector_to_add(token)))
-
-        return sum(1 << i for i in range(self.length) if vector[i] >= 0)
+        return simhash_values([_tokens(inputstring).sample(self.length)], self.length)[0]
 
     def to_hex(self) -> str:
         "Convert the numerical hash to a hexadecimal string."
@@ -116,12 +165,7 @@ class Simhash:
 
     def hamming_distance(self, other_hash: Any) -> int:
         "Return distance between two hashes of equal length using the XOR operator."
-        xor_result = self.hash ^ other_hash.hash
-        try:
-            # Python >= 3.10
-            return xor_result.bit_count()
-        except AttributeError:
-            return bin(xor_result).count("1")
+        return bit_count(self.hash ^ other_hash.hash)
 
     def similarity(self, other_hash: Any) -> float:
         """Calculate how similar this hash is from another simhash.
@@ -130,6 +174,179 @@ class Simhash:
         return (self.length - self.hamming_distance(other_hash)) / self.length
 
 
-def content_fingerprint(content: str) -> str:
+class SimhashIndex:
+    """Find near duplicates among Simhash fingerprints without comparing them all.
+    The hashes are split in bands: two hashes differing by fewer bits than there
+    are bands have at least one identical band, so that only the hashes sharing
+    a band with the query are compared."""
+    __slots__ = ["bands", "length", "entries", "_limits", "_tables"]
+
+    def __init__(self, bands: int = 4, length: int = 64) -> None:
+        "Prepare the bands and one lookup table per band."
+        if not 0 < bands <= length:
+            raise ValueError("the number of bands must be between 1 and the hash length")
+        self.bands = bands
+        self.length = length
+        # hash value for each key
+        self.entries: Dict[Hashable, int] = {}
+        # (shift, mask) of each band, the first ones are one bit larger if necessary
+        size, extra = divmod(length, bands)
+        self._limits = []
+        start = 0
+        for i in range(bands):
+            width = size + (i < extra)
+            self._limits.append((start, (1 << width) - 1))
+            start += width
+        # keys of the entries for each band value
+        self._tables: List[Dict[int, List[Hashable]]] = [{} for _ in range(bands)]
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def _split(self, value: int) -> List[int]:
+        "Return the values of all bands of a hash."
+        return [(value >> shift) & mask for shift, mask in self._limits]
+
+    @staticmethod
+    def _value(fingerprint: Union["Simhash", int, str]) -> int:
+        "Accept Simhash objects as well as numerical and hexadecimal hashes."
+        if isinstance(fingerprint, Simhash):
+            return fingerprint.hash
+        if isinstance(fingerprint, str):
+            return int(fingerprint, 16)
+        return fingerprint
+
+    def add(self, fingerprint: Union["Simhash", int, str], key: Optional[Hashable] = None) -> None:
+        "Register a hash under a given key, by default the hash value itself."
+        value = self._value(fingerprint)
+        key = value if key is None else key
+        if key in self.entries:
+            self.remove(key)
+        self.entries[key] = value
+        for table, band in zip(self._tables, self._split(value)):
+            table.setdefault(band, []).append(key)
+
+    def remove(self, key: Hashable) -> None:
+        "Delete the hash registered under a given key."
+        value = self.entries.pop(key)
+        for table, band in zip(self._tables, self._split(value)):
+            bucket = table[band]
+            bucket.remove(key)
+            if not bucket:
+                del table[band]
+
+    def bulk_load(self, items: Iterable[Tuple[Hashable, Union["Simhash", int, str]]]) -> None:
+        "Register a series of (key, hash) tuples."
+        for key, fingerprint in items:
+            self.add(fingerprint, key)
+
+    def query(self, fingerprint: Union["Simhash", int, str], max_distance: Optional[int] = None) -> List[Hashable]:
+        """Return the keys of the hashes within a given Hamming distance,
+        at most the number of bands minus one (default)."""
+        if max_distance is None:
+            max_distance = self.bands - 1
+        elif not 0 <= max_distance < self.bands:
+            raise ValueError("the distance must be lower than the number of bands")
+        value = self._value(fingerprint)
+        results, seen = [], set()
+        for table, band in zip(self._tables, self._split(value)):
+            for key in table.get(band, []):
+                if key not in seen:
+                    seen.add(key)
+                    if bit_count(self.entries[key] ^ value) <= max_distance:
+                        results.append(key)
+        return results
+
+    def save(self, filename: str) -> None:
+        "Write the index to a JSON file, keys have to be strings or numbers."
+        with open(filename, "w", encoding="utf-8") as outputfile:
+            json.dump(
+                {"bands": self.bands, "length": self.length, "entries": list(self.entries.items())},
+                outputfile,
+            )
+
+    @classmethod
+    def load(cls, filename: str) -> "SimhashIndex":
+        "Read an index written by save()."
+        with open(filename, "r", encoding="utf-8") as inputfile:
+            data = json.load(inputfile)
+        index = cls(data["bands"], data["length"])
+        index.bulk_load(data["entries"])
+        return index
+
+
+def bit_count(value: int) -> int:
+    "Count the bits set in a number."
+    try:
+        # Python >= 3.10
+        return value.bit_count()
+    except AttributeError:
+        return bin(value).count("1")
+
+
+@lru_cache(maxsize=2**14)
+def token_hash(token: str) -> int:
+    "Return a numerical hash of a token, cached across documents."
+    return int.from_bytes(blake2b(token.encode(), digest_size=8).digest(), "big")
+    # old: variable-length version of Python's builtin hash by @sean-public
+    # see also Siphash13 in https://peps.python.org/pep-0456/
+    # if inputstring == "":
+    #    return 0
+    # mask = 2**self.length - 1
+    # x = ord(inputstring[0]) << 7
+    # for c in inputstring:
+    #    x = ((x * 1000003) ^ ord(c)) & mask
+    # x ^= len(inputstring)
+    # if x == -1:
+    #    return -2
+    # return x
+
+
+@lru_cache(maxsize=2**14)
+def _vector_to_add(token: str, length: int) -> Tuple[int, ...]:
+    "Create vector to add to the existing string vector"
+    the_hash = token_hash(token)
+    return tuple(1 if the_hash & (1 << i) else -1 for i in range(length))
+
+
+def _python_simhash(tokens: List[str], length: int) -> int:
+    "Sum the token vectors one by one and keep the positive positions."
+    vector = [0] * length
+    for token in tokens:
+        vector = list(map(add, vector, _vector_to_add(token, length)))
+    return sum(1 << i for i in range(length) if vector[i] >= 0)
+
+
+def _numpy_simhashes(token_lists: List[List[str]], length: int) -> List[int]:
+    "Put the bits of all token hashes in a matrix and sum them for each document at once."
+    counts = np.array([len(tokens) for tokens in token_lists], dtype=np.int64)
+    values = np.fromiter(
+        (token_hash(token) for tokens in token_lists for token in tokens),
+        dtype=np.uint64,
+        count=int(counts.sum()),
+    )
+    # one row per token and one column per bit
+    bits = ((values[:, None] >> BIT_SHIFTS[:length]) & np.uint64(1)).astype(np.uint8)
+    # number of set bits per document, summed between the document limits
+    ones = np.zeros((len(counts), length), dtype=np.int64)
+    filled = counts > 0
+    if filled.any():
+        starts = (np.cumsum(counts) - counts)[filled]
+        ones[filled] = np.add.reduceat(bits, starts, axis=0, dtype=np.int64)
+    # same as adding 1 for each set bit and -1 otherwise and keeping the positive sums
+    mask = 2 * ones >= counts[:, None]
+    packed = np.packbits(mask, axis=1, bitorder="little")
+    return [int.from_bytes(row.tobytes(), "little") for row in packed]
+
+
+def simhash_values(token_lists: List[List[str]], length: int = 64) -> List[int]:
+    "Calculate the simhashes of tokenized documents, vectorized with NumPy if available."
+    # the token hashes have 64 bits, longer simhashes are only computed in pure Python
+    if NUMPY_FLAG and 0 < length <= 64 and token_lists:
+        return _numpy_simhashes(token_lists, length)
+    return [_python_simhash(tokens, length) for tokens in token_lists]
+
+
+def content_fingerprint(content: Union[str, Tokens]) -> str:
     "Calculate a simhash hex value for meaningful bits of the content."
     return Simhash(content).to_hex()
@@ -11,8 +11,7 @@ from collections import defaultdict
 from copy import deepcopy
 
 from courlan.urlutils import fix_relative_urls, get_base_url
-from lxml.etree import strip_tags
-from lxml.html.clean import Cleaner
+from lxml.etree import Comment, ProcessingInstruction, strip_tags
 
 from .filters import duplicate_test, textfilter
 from .settings import CUT_EMPTY_ELEMS, MANUALLY_CLEANED, MANUALLY_STRIPPED
@@ -20,28 +19,6 @@ from .utils import trim, uniquify_list
 
 LOGGER = logging.getLogger(__name__)
 
-# HTML_CLEANER config
-# https://lxml.de/api/lxml.html.clean.Cleaner-class.html
-# https://lxml.de/apidoc/lxml.html.clean.html
-HTML_CLEANER = Cleaner(
-    annoying_tags = False,  # True
-    comments = True,
-    embedded = False,  # True
-    forms = False,  # True
-    frames = False,  # True
-    javascript = False,
-    links = False,
-    meta = False,
-    page_structure = False,
-    processing_instructions = True,
-    remove_unknown_tags = False,
-    safe_attrs_only = False,
-    scripts = False,
-    style = False,
-    # remove_tags = MANUALLY_STRIPPED,
-    # kill_tags = MANUALLY_CLEANED,
-)
-
 
 REND_TAG_MAPPING = {
     'em': '#i',
@@ -58,32 +35,185 @@ REND_TAG_MAPPING = {
 }
 
 
+HEADING_TAGS = {'h1', 'h2', 'h3', 'h4', 'h5', 'h6'}
+LIST_TAGS = {'dl', 'ol', 'ul'}
+ITEM_TAGS = {'dd', 'dt', 'li'}
+QUOTE_TAGS = {'blockquote', 'pre', 'q'}
+DEL_TAGS = {'del', 's', 'strike'}
+XHTML_PREFIX = '{http://www.w3.org/1999/xhtml}'
+# tags handled by convert_element(), the others are left untouched
+CONVERTED_TAGS = {'a', 'ref', 'br', 'hr', 'details', 'summary', 'img'} | set(REND_TAG_MAPPING) \
+                 | HEADING_TAGS | LIST_TAGS | ITEM_TAGS | QUOTE_TAGS | DEL_TAGS
+
+# summary of an empty string, see text_segment()
+EMPTY_SEGMENT = (0, 0, 0, False, False)
+# number of elements visited between two checks of the time budget
+BUDGET_INTERVAL = 256
+
+
 def tree_cleaning(tree, options):
     '''Prune the tree by discarding unwanted elements'''
-    # determine cleaning strategy, use lists to keep it deterministic
-    cleaning_list, stripping_list = \
-        MANUALLY_CLEANED.copy(), MANUALLY_STRIPPED.copy()
-    if options.tables is False:
-        cleaning_list.extend(['table', 'td', 'th', 'tr'])
-    else:
-        # prevent this issue: https://github.com/adbar/trafilatura/issues/301
-        for elem in tree.xpath('.//figure[descendant::table]'):
-            elem.tag = 'div'
-    if options.images is True:
-        # Many websites have <img> inside <figure> or <picture> or <source> tag
-        cleaning_list = [e for e in cleaning_list if e
-                         not in ('figure', 'picture', 'source')]
-        stripping_list.remove('img')
+    return normalize_tree(tree, options, cleaning=True, conversion=False)
+
+
+def normalize_tree(tree, options, url=None, cleaning=True, conversion=True):
+    '''Clean the tree and convert the remaining tags in a single traversal:
+       unwanted elements are deleted, empty ones pruned, others stripped
+       and relevant HTML tags converted to an XML standard (in place)'''
+    # determine cleaning strategy
+    kill_tags, strip_list = set(), []
+    if cleaning is True:
+        kill_tags.update(MANUALLY_CLEANED)
+        strip_list.extend(MANUALLY_STRIPPED)
+        if options.tables is False:
+            kill_tags.update(['table', 'td', 'th', 'tr'])
+        if options.images is True:
+            # Many websites have <img> inside <figure> or <picture> or <source> tag
+            kill_tags.difference_update(['figure', 'picture', 'source'])
+            strip_list.remove('img')
+    # determine conversion strategy
+    link_scope, base_url = set(), None
+    if conversion is True:
+        if options.links is False:
+            # links are kept below these elements for further detection
+            link_scope = {'div', 'table', 'ul'} if options.tables is True else {'div', 'ul'}
+            strip_list.append('a')
+        else:
+            # get base URL for converting relative URLs
+            base_url = url and get_base_url(url)
+        if options.formatting is False:
+            strip_list.extend(REND_TAG_MAPPING)
+    # the root element cannot be deleted or stripped
+    if cleaning is True and tree.tag in MANUALLY_STRIPPED:
+        tree.tag = 'div'
+        tree.attrib.clear()
+    root_counter = [1] if conversion is True and tree.tag in LIST_TAGS else None
+    root_details = conversion is True and tree.tag == 'details'
+    if conversion is True:
+        convert_element(tree, options, base_url, None, False)
+    # prevent this issue: https://github.com/adbar/trafilatura/issues/301
+    keep_figures = cleaning is True and options.tables is True
+
+    def is_deleted(child):
+        "Tell if a child will be deleted before the pruning of empty elements."
+        if child.tag not in kill_tags:
+            return False
+        return not (keep_figures and child.tag == 'figure' and child.find('.//table') is not None)
+
+    # traverse: element, is below a link scope, counter of the outermost list, is below details
+    deletions, visited = [], 0
+    stack = [(child, False, root_counter, root_details) for child in reversed(tree)]
+    while stack:
+        elem, in_scope, counter, in_details = stack.pop()
+        visited += 1
+        if visited % BUDGET_INTERVAL == 0:
+            options.budget.check()
+        tag = elem.tag
+        if cleaning is True:
+            # comments and processing instructions
+            if tag is Comment or tag is ProcessingInstruction:
+                deletions.append(elem)
+                continue
+            if not isinstance(tag, str):
+                continue
+            if tag.startswith(XHTML_PREFIX):
+                elem.tag = tag = tag[len(XHTML_PREFIX):]
+            if keep_figures and tag == 'figure' and elem.find('.//table') is not None:
+                elem.tag = tag = 'div'
+            if tag in kill_tags:
+                deletions.append(elem)
+                continue
+            # empty elements, even after the deletion of their children
+            if tag in CUT_EMPTY_ELEMS and not elem.text and not any(
+                child.tail or not is_deleted(child) for child in elem
+            ):
+                deletions.append(elem)
+                continue
+            # IE treats <image> like <img>
+            if tag == 'image':
+                elem.tag = tag = 'img'
+        elif not isinstance(tag, str):
+            continue
+        if conversion is True:
+            if tag == 'a' and in_scope is True:
+                elem.tag = 'ref'
+            elif tag in LIST_TAGS and counter is None:
+                # items are numbered by the outermost list
+                counter = [1]
+            if tag in CONVERTED_TAGS:
+                convert_element(elem, options, base_url, counter, in_details)
+            in_scope = in_scope or tag in link_scope
+            in_details = in_details or tag == 'details'
+        stack.extend((child, in_scope, counter, in_details) for child in reversed(elem))
     # delete targeted elements
-    for expression in cleaning_list:
-        for element in tree.getiterator(expression):
-            try:
-                element.drop_tree() # faster when applicable
-            except AttributeError:
-                element.getparent().remove(element)
-    HTML_CLEANER.kill_tags, HTML_CLEANER.remove_tags = cleaning_list, stripping_list
-    # save space and processing time
-    return HTML_CLEANER.clean_html(prune_html(tree))
+    for element in deletions:
+        try:
+            element.drop_tree()  # faster when applicable
+        except AttributeError:
+            element.getparent().remove(element)
+    if strip_list:
+        strip_tags(tree, *strip_list)
+    return tree
+
+
+def convert_element(elem, options, base_url, counter, in_details):
+    '''Convert a single HTML element to the XML format used internally'''
+    tag = elem.tag
+    # links
+    if tag in ('a', 'ref'):
+        if options.links is True:
+            elem.tag = 'ref'
+            # replace href attribute and delete the rest
+            target = elem.get('href') # defaults to None
+            elem.attrib.clear()
+            if target is not None:
+                # convert relative URLs
+                if base_url is not None:
+                    target = fix_relative_urls(base_url, target)
+                elem.set('target', target)
+    # include_formatting
+    elif tag in REND_TAG_MAPPING:
+        if options.formatting is True:
+            elem.tag = 'hi'
+            elem.set('rend', REND_TAG_MAPPING[tag])
+    # ul/ol → list / li → item
+    elif tag in LIST_TAGS:
+        elem.set('rend', tag)
+        elem.tag = 'list'
+    elif tag in ITEM_TAGS:
+        if counter is not None:
+            # keep track of dd/dt items
+            if tag in ('dd', 'dt'):
+                elem.set('rend', f"{tag}-{counter[0]}")
+                # increment counter after <dd> in description list
+                if tag == 'dd':
+                    counter[0] += 1
+            # convert elem tag
+            elem.tag = 'item'
+    # head tags + delete attributes
+    elif tag in HEADING_TAGS:
+        elem.attrib.clear()
+        elem.set('rend', tag)
+        elem.tag = 'head'
+    # br → lb
+    elif tag in ('br', 'hr'):
+        elem.tag = 'lb'
+    # wbr
+    # blockquote, pre, q → quote
+    elif tag in QUOTE_TAGS:
+        elem.tag = 'quote'
+    # del | s | strike → <del rend="overstrike">
+    elif tag in DEL_TAGS:
+        elem.tag = 'del'
+        elem.set('rend', 'overstrike')
+    # details + summary
+    elif tag == 'details':
+        elem.tag = 'div'
+    elif tag == 'summary' and in_details is True:
+        elem.tag = 'head'
+    # images
+    elif tag == 'img' and options.images is True:
+        elem.tag = 'graphic'
 
 
 def prune_html(tree):
@@ -97,36 +227,197 @@ def prune_html(tree):
     return tree
 
 
-def prune_unwanted_nodes(tree, nodelist, with_backup=False):
-    '''Prune the HTML tree by removing unwanted sections.'''
+def prune_unwanted_nodes(tree, nodelist, with_backup=False, stats=None):
+    '''Prune the HTML tree by removing unwanted sections
+       targeted by a list of XPath expressions, compiled (see
+       xpaths.compile_rules) or as strings, optionally keeping
+       node statistics up to date.'''
     if with_backup is True:
-        old_len = len(tree.text_content())  # ' '.join(tree.itertext())
-        backup = deepcopy(tree)
+        old_len = stats.raw_length(tree) if stats is not None else len(tree.text_content())
+        # record the deletions instead of copying the whole tree beforehand
+        journal = []
     for expr in nodelist:
-        for subtree in tree.xpath(expr):
+        for subtree in (tree.xpath(expr) if isinstance(expr, str) else expr(tree)):
+            parent, previous, old_tail = subtree.getparent(), None, None
             # preserve tail text from deletion
             if subtree.tail is not None:
                 previous = subtree.getprevious()
                 if previous is None:
-                    previous = subtree.getparent()
+                    previous = parent
                 if previous is not None:
+                    old_tail = previous.tail
                     # There is a previous node, append text to its tail
                     if previous.tail is not None:
                         previous.tail = ' '.join([previous.tail, subtree.tail])
                     else:
                         previous.tail = subtree.tail
+                    if stats is not None:
+                        stats.changed(previous)
+            if with_backup is True:
+                journal.append((parent, parent.index(subtree), subtree, previous, old_tail))
             # remove the node
-            subtree.getparent().remove(subtree)
+            if stats is not None:
+                stats.changed(parent)
+            parent.remove(subtree)
     if with_backup is False:
         return tree
     # else:
-    new_len = len(tree.text_content())
+    new_len = stats.raw_length(tree) if stats is not None else len(tree.text_content())
     # todo: adjust for recall and precision settings
     if new_len > old_len/7:
         return tree
+    # too much text removed: return a copy of the tree in its original state
+    backup = restore_pruned_copy(tree, journal)
+    if stats is not None:
+        stats.reset(backup)
     return backup
 
 
+def restore_pruned_copy(tree, journal):
+    '''Undo the recorded deletions, copy the resulting tree and redo them,
+       so that the tree stays pruned and the copy reflects the original state.'''
+    new_tails = []
+    for parent, position, subtree, previous, old_tail in reversed(journal):
+        if previous is not None:
+            new_tails.append(previous.tail)
+            previous.tail = old_tail
+        parent.insert(position, subtree)
+    backup = deepcopy(tree)
+    for parent, _, subtree, previous, _ in journal:
+        if previous is not None:
+            previous.tail = new_tails.pop()
+        parent.remove(subtree)
+    return backup
+
+
+def text_segment(string):
+    '''Summarize a string: length, non-space characters, words and whether
+       it starts or ends with a word, so that summaries can be concatenated'''
+    if not string:
+        return EMPTY_SEGMENT
+    words = string.split()
+    return (len(string), len(''.join(words)), len(words),
+            not string[0].isspace(), not string[-1].isspace())
+
+
+def join_segments(first, second):
+    '''Summary of the concatenation of two strings'''
+    if first[0] == 0:
+        return second
+    if second[0] == 0:
+        return first
+    # the words on both sides of the junction merge
+    return (first[0] + second[0], first[1] + second[1],
+            first[2] + second[2] - (first[4] and second[3]), first[3], second[4])
+
+
+def trimmed_length(segment):
+    '''Length of the summarized string once trimmed, see utils.trim()'''
+    return segment[1] + segment[2] - 1 if segment[2] else 0
+
+
+class NodeStats:
+    '''Text and link statistics for all the elements of a tree, computed
+       bottom-up in a single pass and updated when the tree is modified,
+       so that the text of nested elements is not read over and over'''
+    __slots__ = ['records', 'dirty', 'link_tag']
+
+    def __init__(self, tree=None, link_tag='ref'):
+        # element: (text segment, links, link text length, links with text,
+        #           links shorter than 10 characters, links shorter than 50)
+        self.records = {}
+        # modified elements and their depth in the tree
+        self.dirty = {}
+        self.link_tag = link_tag
+        # without a tree the statistics are computed when they are needed
+        if tree is not None:
+            self.reset(tree)
+
+    def reset(self, tree):
+        "Compute the statistics of a new tree."
+        self.records.clear()
+        self.dirty.clear()
+        self._compute(tree)
+
+    def _summarize(self, elem):
+        "Combine the statistics of the children and the text of an element."
+        segment = text_segment(elem.text) if isinstance(elem.tag, str) else EMPTY_SEGMENT
+        refs, linklen, elemnum, short10, short50 = 0, 0, 0, 0, 0
+        for child in elem:
+            record = self.records.get(child)
+            if record is None:
+                # element inserted after the statistics were computed
+                record = self._compute(child)
+            childseg, childrefs, childlinklen, childnum, child10, child50 = record
+            segment = join_segments(join_segments(segment, childseg), text_segment(child.tail))
+            refs, linklen, elemnum = refs + childrefs, linklen + childlinklen, elemnum + childnum
+            short10, short50 = short10 + child10, short50 + child50
+            if child.tag == self.link_tag:
+                refs += 1
+                length = trimmed_length(childseg)
+                if length > 0:
+                    linklen += length
+                    elemnum += 1
+                    short10 += length < 10
+                    short50 += length < 50
+        return segment, refs, linklen, elemnum, short10, short50
+
+    def changed(self, element):
+        "Mark an element whose text, tail or children are modified, along with its ancestors."
+        chain, node = [], element
+        # elements outside of the index are computed when they are needed
+        while node in self.records and node not in self.dirty:
+            chain.append(node)
+            node = node.getparent()
+        depth = self.dirty.get(node, -1)
+        for node in reversed(chain):
+            depth += 1
+            self.dirty[node] = depth
+
+    def get(self, element):
+        "Return the up-to-date record of an element."
+        if self.dirty:
+            # deepest elements first
+            for node in sorted(self.dirty, key=self.dirty.get, reverse=True):
+                self.records[node] = self._summarize(node)
+            self.dirty.clear()
+        record = self.records.get(element)
+        if record is None:
+            record = self._compute(element)
+        return record
+
+    def _compute(self, element):
+        "Compute the statistics of an element and its descendants if they are missing."
+        records = self.records
+        # children come before their parents in reverse document order
+        for node in reversed(list(element.iter())):
+            if node not in records:
+                records[node] = self._summarize(node)
+        return records[element]
+
+    def raw_length(self, element):
+        "Length of the text content of an element."
+        return self.get(element)[0][0]
+
+    def text_length(self, element):
+        "Length of the trimmed text content of an element."
+        return trimmed_length(self.get(element)[0])
+
+    def has_links(self, element):
+        "Tell if there are links below the element."
+        return self.get(element)[1] > 0
+
+    def link_ratio(self, element):
+        "Share of the trimmed text content of an element located in links."
+        textlen = self.text_length(element)
+        return min(self.get(element)[2] / textlen, 1) if textlen else 0
+
+    def link_info(self, element, favor_precision=False):
+        "Length of the link text, number of links with text and number of short ones."
+        _, _, linklen, elemnum, short10, short50 = self.get(element)
+        return linklen, elemnum, short50 if favor_precision else short10
+
+
 def collect_link_info(links_xpath, favor_precision=False):
     '''Collect heuristics on link text'''
     # init
@@ -144,10 +435,16 @@ def collect_link_info(links_xpath, favor_precision=False):
     return lengths, len(mylist), shortelems, mylist
 
 
-def link_density_test(element, text, favor_precision=False):
-    '''Remove sections which are rich in links (probably boilerplate)'''
-    links_xpath, mylist = element.findall('.//ref'), []
-    if links_xpath:
+def link_density_test(element, text, favor_precision=False, stats=None):
+    '''Remove sections which are rich in links (probably boilerplate),
+       return the decision and the texts of the links of short elements.
+       The text of the element is not needed if statistics are provided.'''
+    mylist = []
+    if stats is not None:
+        has_links = stats.has_links(element)
+    else:
+        has_links = element.find('.//ref') is not None
+    if has_links:
         if element.tag == 'p': #  and not element.getparent().tag == 'item'
             if favor_precision is False:
                 if element.getnext() is None:
@@ -167,9 +464,10 @@ def link_density_test(element, text, favor_precision=False):
             #    limitlen, threshold = 150, 0.66
             else:
                 limitlen, threshold = 100, 0.8
-        elemlen = len(text)
+        elemlen = stats.text_length(element) if stats is not None else len(text)
+        # the link texts are only gathered for short elements
         if elemlen < limitlen:
-            linklen, elemnum, shortelems, mylist = collect_link_info(links_xpath, favor_precision)
+            linklen, elemnum, shortelems, mylist = collect_link_info(element.findall('.//ref'), favor_precision)
             if elemnum == 0:
                 return True, mylist
             LOGGER.debug('list link text/total: %s/%s – short elems/total: %s/%s', linklen, elemlen, shortelems, elemnum)
@@ -179,15 +477,22 @@ def link_density_test(element, text, favor_precision=False):
     return False, mylist
 
 
-def link_density_test_tables(element):
+def link_density_test_tables(element, stats=None):
     '''Remove tables which are rich in links (probably boilerplate)'''
     # if element.getnext() is not None:
     #     return False
-    links_xpath = element.findall('.//ref')
-    if links_xpath:
-        elemlen = len(trim(element.text_content()))
+    if stats is not None:
+        has_links = stats.has_links(element)
+    else:
+        links_xpath = element.findall('.//ref')
+        has_links = len(links_xpath) > 0
+    if has_links:
+        elemlen = stats.text_length(element) if stats is not None else len(trim(element.text_content()))
         if elemlen > 250:
-            linklen, elemnum, _, _ = collect_link_info(links_xpath)
+            if stats is not None:
+                linklen, elemnum, _ = stats.link_info(element)
+            else:
+                linklen, elemnum, _, _ = collect_link_info(links_xpath)
             if elemnum == 0:
                 return True
             LOGGER.debug('table link text: %s / total: %s', linklen, elemlen)
@@ -199,16 +504,19 @@ def link_density_test_tables(element):
     return False
 
 
-def delete_by_link_density(subtree, tagname, backtracking=False, favor_precision=False):
+def delete_by_link_density(subtree, tagname, backtracking=False, favor_precision=False, stats=None):
     '''Determine the link density of elements with respect to their length,
        and remove the elements identified as boilerplate.'''
     myelems, deletions = defaultdict(list), []
     for elem in subtree.iter(tagname):
-        elemtext = trim(elem.text_content())
-        result, templist = link_density_test(elem, elemtext, favor_precision)
+        # the text itself is only needed for backtracking if statistics are provided
+        elemtext = trim(elem.text_content()) if stats is None else None
+        result, templist = link_density_test(elem, elemtext, favor_precision, stats)
         if result is True:
             deletions.append(elem)
         elif backtracking is True and len(templist) > 0:  # if?
+            if elemtext is None:
+                elemtext = trim(elem.text_content())
             myelems[elemtext].append(elem)
     # summing up
     if backtracking is True:
@@ -224,6 +532,8 @@ def delete_by_link_density(subtree, tagname, backtracking=False, favor_precision
             # print(elem.tag, templist)
     for elem in uniquify_list(deletions):
         try:
+            if stats is not None:
+                stats.changed(elem.getparent())
             elem.getparent().remove(elem)
         except AttributeError:
             pass
@@ -232,79 +542,7 @@ def delete_by_link_density(subtree, tagname, backtracking=False, favor_precision
 
 def convert_tags(tree, options, url=None):
     '''Simplify markup and convert relevant HTML tags to an XML standard'''
-    # delete links for faster processing
-    if options.links is False:
-        xpath_expr = './/div//a|.//ul//a'  # .//p//a ?
-        if options.tables is True:
-            xpath_expr += '|.//table//a'
-        # necessary for further detection
-        for elem in tree.xpath(xpath_expr):
-            elem.tag = 'ref'
-        # strip the rest
-        strip_tags(tree, 'a')
-    else:
-        # get base URL for converting relative URLs
-        base_url = url and get_base_url(url)
-        for elem in tree.iter('a', 'ref'):
-            elem.tag = 'ref'
-            # replace href attribute and delete the rest
-            target = elem.get('href') # defaults to None
-            elem.attrib.clear()
-            if target is not None:
-                # convert relative URLs
-                if base_url is not None:
-                    target = fix_relative_urls(base_url, target)
-                elem.set('target', target)
-    # include_formatting
-    if options.formatting is False:
-        strip_tags(tree, *REND_TAG_MAPPING)
-    else:
-        for elem in tree.iter(list(REND_TAG_MAPPING)):
-            attribute = REND_TAG_MAPPING[elem.tag]
-            elem.tag = 'hi'
-            elem.set('rend', attribute)
-    # iterate over all concerned elements
-    for elem in tree.iter('blockquote', 'br', 'del', 'details', 'dl', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'hr', 'ol', 'pre', 'q', 's', 'strike', 'ul'):
-        # ul/ol → list / li → item
-        if elem.tag in ('dl', 'ol', 'ul'):
-            elem.set('rend', elem.tag)
-            elem.tag = 'list'
-            i = 1
-            for subelem in elem.iter('dd', 'dt', 'li'):
-                # keep track of dd/dt items
-                if subelem.tag in ('dd', 'dt'):
-                    subelem.set('rend', f"{subelem.tag}-{i}")
-                    # increment counter after <dd> in description list
-                    if subelem.tag == 'dd':
-                        i += 1
-                # convert elem tag
-                subelem.tag = 'item'
-        # head tags + delete attributes
-        elif elem.tag in ('h1', 'h2', 'h3', 'h4', 'h5', 'h6'):
-            elem.attrib.clear()
-            elem.set('rend', elem.tag)
-            elem.tag = 'head'
-        # br → lb
-        elif elem.tag in ('br', 'hr'):
-            elem.tag = 'lb'
-        # wbr
-        # blockquote, pre, q → quote
-        elif elem.tag in ('blockquote', 'pre', 'q'):
-            elem.tag = 'quote'
-        # del | s | strike → <del rend="overstrike">
-        elif elem.tag in ('del', 's', 'strike'):
-            elem.tag = 'del'
-            elem.set('rend', 'overstrike')
-        # details + summary
-        elif elem.tag == 'details':
-            elem.tag = 'div'
-            for subelem in elem.iter('summary'):
-                subelem.tag = 'head'
-    # images
-    if options.images is True:
-        for elem in tree.iter('img'):
-            elem.tag = 'graphic'
-    return tree
+    return normalize_tree(tree, options, url, cleaning=False, conversion=True)
 
 
 def handle_textnode(element, options, comments_fix=True, preserve_spaces=False):
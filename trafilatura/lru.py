@@ -87,6 +87,13 @@ class LRUCache:
                 # which could potentially be wrapped in an lru_cache itself.
                 self.full = len(self.cache) >= self.maxsize
 
+    def increment(self, key):
+        '''Counts a new occurrence of the key and returns the number of previous ones'''
+        with self.lock:
+            previous = max(self.get(key), 0)
+            self.put(key, previous + 1)
+        return previous
+
     def clear(self):
         '''Delete all cache content'''
         with self.lock:
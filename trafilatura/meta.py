@@ -6,11 +6,12 @@ import gc
 
 from courlan.meta import clear_caches as reset_caches_courlan
 from htmldate.meta import reset_caches as reset_caches_htmldate
-from justext.core import define_stoplist
 
-from .filters import LRU_TEST
-from .hashing import Simhash
-from .utils import (is_similar_domain, line_processing,
+from . import filters
+from .dedup import IN_MEMORY_BACKENDS
+from .external import jt_language_stoplist
+from .hashing import _vector_to_add, token_hash
+from .utils import (ENCODING_MEMORY, is_similar_domain, line_processing,
                     return_printables_and_spaces, trim)
 
 
@@ -18,7 +19,7 @@ def reset_caches() -> None:
     """Reset all known LRU caches used to speed up processing.
        This may release some memory."""
     # justext
-    define_stoplist.cache_clear()
+    jt_language_stoplist.cache_clear()
     # handles htmldate and charset_normalizer
     reset_caches_htmldate()
     # courlan
@@ -28,7 +29,11 @@ def reset_caches() -> None:
     line_processing.cache_clear()
     return_printables_and_spaces.cache_clear()
     trim.cache_clear()
-    LRU_TEST.clear()
-    Simhash._vector_to_add.cache_clear()
+    # persistent stores are only emptied explicitly
+    if isinstance(filters.LRU_TEST, IN_MEMORY_BACKENDS):
+        filters.LRU_TEST.clear()
+    ENCODING_MEMORY.clear()
+    token_hash.cache_clear()
+    _vector_to_add.cache_clear()
     # garbage collection
     gc.collect()
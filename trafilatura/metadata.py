@@ -16,6 +16,7 @@ from .json_metadata import (extract_json, extract_json_parse_error,
                             normalize_json)
 from .metaxpaths import (author_discard_xpaths, author_xpaths,
                          categories_xpaths, tags_xpaths, title_xpaths)
+from .profiling import StageTimer
 from .utils import (line_processing, load_html, normalize_authors,
                     normalize_tags, trim, unescape, uniquify_list)
 
@@ -287,7 +288,7 @@ def extract_metainfo(tree, expressions, len_limit=200):
     for expression in expressions:
         # examine all results
         i = 0
-        for elem in tree.xpath(expression):
+        for elem in expression(tree):
             content = trim(' '.join(elem.itertext()))
             if content and 2 < len(content) < len_limit:
                 return content
@@ -405,7 +406,7 @@ def extract_catstags(metatype, tree):
     for catexpr in xpath_expression:
         results.extend(
             elem.text_content()
-            for elem in tree.xpath(catexpr)
+            for elem in catexpr(tree)
             if re.search(regexpr, elem.attrib['href'])
         )
         if results:
@@ -532,7 +533,8 @@ def extract_metadata(filecontent, default_url=None, date_config=None, fastmode=F
         else:
             date_config = HTMLDATE_CONFIG_FAST
     date_config['url'] = metadata.url
-    metadata.date = find_date(tree, **date_config)
+    with StageTimer('find_date'):
+        metadata.date = find_date(tree, **date_config)
     # sitename
     if metadata.sitename is None:
         metadata.sitename = extract_sitename(tree)
@@ -0,0 +1,295 @@
+"""
+Context-sensitive classification of text blocks after the jusText algorithm,
+working directly on the trees cleaned by trafilatura, with stoplists kept in a
+frozen format which is memory-mapped instead of being loaded.
+"""
+
+## This file is available from https://github.com/adbar/trafilatura
+## under GNU GPL v3 license
+
+import mmap
+import re
+import sys
+
+from array import array
+from struct import Struct
+from zlib import crc32
+
+
+# frozen stoplist: header, hash table of offsets (0 = empty slot), words prefixed by their length
+STOPLIST_MAGIC = b'TSL1'
+STOPLIST_HEADER = Struct('<4sI')
+
+# elements delimiting paragraphs, HTML tags and their converted counterparts
+PARAGRAPH_TAGS = frozenset({
+    'body', 'blockquote', 'caption', 'center', 'col', 'colgroup', 'dd',
+    'div', 'dl', 'dt', 'fieldset', 'form', 'legend', 'optgroup', 'option',
+    'p', 'pre', 'table', 'td', 'textarea', 'tfoot', 'th', 'thead', 'tr',
+    'ul', 'li', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6',
+    'cell', 'head', 'item', 'list', 'quote', 'row',
+})
+LINK_TAGS = {'a', 'ref'}
+BREAK_TAGS = {'br', 'lb'}
+# discarded with their content or only their tags, as jusText's preprocessor does
+KILLED_TAGS = {'applet', 'button', 'input', 'script', 'select', 'style', 'textarea'}
+DROPPED_TAGS = {'embed', 'form', 'iframe', 'layer', 'object', 'param'}
+
+HEADINGS_PATTERN = re.compile(r'\b(?:h\d|head)\b')
+MULTIPLE_WHITESPACE = re.compile(r'\s+')
+GOOD_OR_BAD = {'good', 'bad'}
+
+
+class FrozenStoplist:
+    '''Read-only set of words stored in a memory-mapped hash table,
+       available at once without parsing and shared between processes'''
+    __slots__ = ['_map', '_slots', '_mask']
+
+    def __init__(self, filename):
+        with open(filename, 'rb') as inputfile:
+            self._map = mmap.mmap(inputfile.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, size = STOPLIST_HEADER.unpack_from(self._map)
+        if magic != STOPLIST_MAGIC:
+            raise ValueError(f'not a frozen stoplist: {filename}')
+        table = memoryview(self._map)[STOPLIST_HEADER.size:STOPLIST_HEADER.size + 4*size]
+        if size == 0 or size & (size - 1) or len(table) != 4*size:
+            raise ValueError(f'truncated frozen stoplist: {filename}')
+        if sys.byteorder == 'little':
+            self._slots = table.cast('I')
+        else:
+            self._slots = array('I', table)
+            self._slots.byteswap()
+        self._mask = size - 1
+
+    def __contains__(self, word):
+        data = word.encode('utf-8')
+        position = crc32(data) & self._mask
+        while True:
+            offset = self._slots[position]
+            if offset == 0:
+                return False
+            if self._map[offset] == len(data) and self._map[offset+1:offset+1+len(data)] == data:
+                return True
+            position = (position + 1) & self._mask
+
+    def __len__(self):
+        return sum(1 for offset in self._slots if offset)
+
+
+def freeze_stoplist(words, filename):
+    '''Write a set of lower-cased words to a file in the frozen format, e.g.
+       the union of all jusText stoplists, see external.jt_stoplist_init()'''
+    encoded = sorted({word.lower().encode('utf-8') for word in words})
+    # load factor below 0.6
+    size = 1
+    while size * 0.6 < len(encoded):
+        size *= 2
+    slots = array('I', [0]) * size
+    blob = bytearray()
+    start = STOPLIST_HEADER.size + 4*size
+    for data in encoded:
+        if not 0 < len(data) < 256:
+            raise ValueError(f'cannot store word: {data!r}')
+        position = crc32(data) & (size - 1)
+        while slots[position]:
+            position = (position + 1) & (size - 1)
+        slots[position] = start + len(blob)
+        blob.append(len(data))
+        blob.extend(data)
+    if sys.byteorder != 'little':
+        slots.byteswap()
+    with open(filename, 'wb') as outputfile:
+        outputfile.write(STOPLIST_HEADER.pack(STOPLIST_MAGIC, size))
+        outputfile.write(slots.tobytes())
+        outputfile.write(blob)
+
+
+def normalize_whitespace(text):
+    '''Replace spacing by a line break if it contains one, by a space otherwise'''
+    return MULTIPLE_WHITESPACE.sub(lambda m: '\n' if '\n' in m.group() or '\r' in m.group() else ' ', text)
+
+
+class Paragraph:
+    "Block of text delimited by paragraph elements or line breaks."
+    __slots__ = ['dom_path', 'text_nodes', 'chars_in_links', 'text', 'heading', 'cf_class', 'class_type']
+
+    def __init__(self, path):
+        self.dom_path = '.'.join(path)
+        self.text_nodes = []
+        self.chars_in_links = 0
+        self.text = ''
+        self.heading = False
+        # context-free and final classes: short, neargood, good or bad
+        self.cf_class = self.class_type = ''
+
+    @property
+    def is_boilerplate(self):
+        "Tell if the paragraph has not been classified as good text."
+        return self.class_type != 'good'
+
+
+class ParagraphMaker:
+    "Split a tree into paragraphs in a single traversal."
+    __slots__ = ['path', 'paragraphs', 'paragraph', 'link', 'br']
+
+    def __init__(self):
+        self.path, self.paragraphs = [], []
+        self.paragraph = Paragraph(self.path)
+        self.link, self.br = False, False
+
+    def new_paragraph(self):
+        "Store the current paragraph if it contains text and start another one."
+        if self.paragraph.text_nodes:
+            self.paragraph.text = normalize_whitespace(''.join(self.paragraph.text_nodes).strip())
+            if self.paragraph.text:
+                self.paragraphs.append(self.paragraph)
+        self.paragraph = Paragraph(self.path)
+
+    def start(self, tag):
+        "Process an opening tag."
+        self.path.append(tag)
+        if tag in PARAGRAPH_TAGS or (tag in BREAK_TAGS and self.br):
+            self.new_paragraph()
+        else:
+            self.br = tag in BREAK_TAGS
+            if self.br:
+                self.paragraph.text_nodes.append(' ')
+            elif tag in LINK_TAGS:
+                self.link = True
+
+    def end(self, tag):
+        "Process a closing tag."
+        self.path.pop()
+        if tag in PARAGRAPH_TAGS:
+            self.new_paragraph()
+        if tag in LINK_TAGS:
+            self.link = False
+
+    def characters(self, text):
+        "Add text to the current paragraph."
+        if text.isspace():
+            return
+        text = normalize_whitespace(text)
+        self.paragraph.text_nodes.append(text)
+        if self.link:
+            self.paragraph.chars_in_links += len(text)
+        self.br = False
+
+    def process(self, tree):
+        "Walk the tree and return the paragraphs."
+        if not isinstance(tree.tag, str):
+            raise ValueError(f'not an element: {tree!r}')
+        stack = [(tree, iter(tree))]
+        self.start(tree.tag)
+        if tree.text:
+            self.characters(tree.text)
+        while stack:
+            elem, children = stack[-1]
+            child = next(children, None)
+            if child is None:
+                stack.pop()
+                if elem.tag not in DROPPED_TAGS:
+                    self.end(elem.tag)
+                if elem.tail:
+                    self.characters(elem.tail)
+                continue
+            # comments, processing instructions and killed elements: only the tail is left,
+            # head elements are headings in converted trees
+            if isinstance(child.tag, str) and child.tag not in KILLED_TAGS \
+               and not (child.tag == 'head' and elem.tag == 'html'):
+                stack.append((child, iter(child)))
+                if child.tag not in DROPPED_TAGS:
+                    self.start(child.tag)
+                if child.text:
+                    self.characters(child.text)
+            elif child.tail:
+                self.characters(child.tail)
+        self.new_paragraph()
+        return self.paragraphs
+
+
+def classify_paragraphs(paragraphs, stoplist, length_low=70, length_high=200, stopwords_low=0.3,
+                        stopwords_high=0.32, max_link_density=0.2, no_headings=False):
+    "Context-free paragraph classification."
+    for paragraph in paragraphs:
+        length = len(paragraph.text)
+        words = paragraph.text.split()
+        stopword_density = sum(word.lower() in stoplist for word in words) / len(words) if words else 0
+        link_density = paragraph.chars_in_links / length if length else 0
+        paragraph.heading = not no_headings and bool(HEADINGS_PATTERN.search(paragraph.dom_path))
+        if link_density > max_link_density:
+            paragraph.cf_class = 'bad'
+        elif '\xa9' in paragraph.text or '&copy' in paragraph.text:
+            paragraph.cf_class = 'bad'
+        elif 'select' in paragraph.dom_path:
+            paragraph.cf_class = 'bad'
+        elif length < length_low:
+            paragraph.cf_class = 'bad' if paragraph.chars_in_links > 0 else 'short'
+        elif stopword_density >= stopwords_high:
+            paragraph.cf_class = 'good' if length > length_high else 'neargood'
+        elif stopword_density >= stopwords_low:
+            paragraph.cf_class = 'neargood'
+        else:
+            paragraph.cf_class = 'bad'
+
+
+def get_neighbour(i, paragraphs, ignore_neargood, inc, boundary):
+    "Return the class of the closest paragraph in a direction which is not short."
+    while i + inc != boundary:
+        i += inc
+        class_type = paragraphs[i].class_type
+        if class_type in GOOD_OR_BAD or (class_type == 'neargood' and not ignore_neargood):
+            return class_type
+    return 'bad'
+
+
+def revise_headings(paragraphs, max_heading_distance, condition, new_class):
+    "Reclassify headings followed by good text."
+    for i, paragraph in enumerate(paragraphs):
+        if not (paragraph.heading and condition(paragraph)):
+            continue
+        j, distance = i + 1, 0
+        while j < len(paragraphs) and distance <= max_heading_distance:
+            if paragraphs[j].class_type == 'good':
+                paragraph.class_type = new_class
+                break
+            distance += len(paragraphs[j].text)
+            j += 1
+
+
+def revise_paragraph_classification(paragraphs, max_heading_distance=200):
+    "Context-sensitive paragraph classification, after classify_paragraphs()."
+    for paragraph in paragraphs:
+        paragraph.class_type = paragraph.cf_class
+    # good headings
+    revise_headings(paragraphs, max_heading_distance, lambda p: p.class_type == 'short', 'neargood')
+    # classify short
+    last = len(paragraphs)
+    new_classes = {}
+    for i, paragraph in enumerate(paragraphs):
+        if paragraph.class_type != 'short':
+            continue
+        prev_neighbour = get_neighbour(i, paragraphs, True, -1, -1)
+        next_neighbour = get_neighbour(i, paragraphs, True, 1, last)
+        if prev_neighbour == 'good' and next_neighbour == 'good':
+            new_classes[i] = 'good'
+        elif prev_neighbour == 'bad' and next_neighbour == 'bad':
+            new_classes[i] = 'bad'
+        # it must be set(['good', 'bad'])
+        elif (prev_neighbour == 'bad' and get_neighbour(i, paragraphs, False, -1, -1) == 'neargood') or \
+             (next_neighbour == 'bad' and get_neighbour(i, paragraphs, False, 1, last) == 'neargood'):
+            new_classes[i] = 'good'
+        else:
+            new_classes[i] = 'bad'
+    for i, class_type in new_classes.items():
+        paragraphs[i].class_type = class_type
+    # revise neargood
+    for i, paragraph in enumerate(paragraphs):
+        if paragraph.class_type != 'neargood':
+            continue
+        if get_neighbour(i, paragraphs, True, -1, -1) == 'bad' and get_neighbour(i, paragraphs, True, 1, last) == 'bad':
+            paragraph.class_type = 'bad'
+        else:
+            paragraph.class_type = 'good'
+    # more good headings
+    revise_headings(paragraphs, max_heading_distance,
+                    lambda p: p.class_type == 'bad' and p.cf_class != 'bad', 'good')
@@ -0,0 +1,134 @@
+"""
+Optional instrumentation of the extraction pipeline:
+time spent in each processing stage and winning extraction algorithm.
+"""
+
+## This file is available from https://github.com/adbar/trafilatura
+## under GNU GPL v3 license
+
+from collections import Counter, defaultdict
+from math import log2
+from time import perf_counter
+
+
+# registered hooks, nothing is measured if the list is empty
+STAGE_HOOKS = []
+
+# histogram buckets in milliseconds: <1, <2, <4, ... >=2**(MAX_BUCKET-1)
+MAX_BUCKET = 16
+
+
+def register_hook(hook):
+    '''Add an object with the methods stage(name, seconds) and
+       branch(name) which will be called during extraction'''
+    if hook not in STAGE_HOOKS:
+        STAGE_HOOKS.append(hook)
+
+
+def unregister_hook(hook):
+    '''Stop sending measurements to the given object'''
+    if hook in STAGE_HOOKS:
+        STAGE_HOOKS.remove(hook)
+
+
+def record_branch(name):
+    '''Report which algorithm produced the result
+       (custom, readability, justext or baseline)'''
+    for hook in STAGE_HOOKS:
+        hook.branch(name)
+
+
+class StageTimer:
+    "Context manager measuring the time spent in a processing stage."
+    __slots__ = ['name', 'start']
+
+    def __init__(self, name):
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        if STAGE_HOOKS:
+            self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        # hooks can be registered while the stage is running
+        if self.start is not None:
+            elapsed = perf_counter() - self.start
+            for hook in STAGE_HOOKS:
+                hook.stage(self.name, elapsed)
+        return False
+
+
+def bucket(seconds):
+    "Return the histogram bucket corresponding to a duration."
+    milliseconds = seconds * 1000
+    if milliseconds < 1:
+        return 0
+    return min(int(log2(milliseconds)) + 1, MAX_BUCKET - 1)
+
+
+class ProfileReport:
+    "Aggregate timings and call counts by stage as well as winning branches."
+    __slots__ = ['calls', 'totals', 'maxima', 'histograms', 'branches']
+
+    def __init__(self):
+        self.calls = Counter()
+        self.totals = defaultdict(float)
+        self.maxima = defaultdict(float)
+        self.histograms = defaultdict(lambda: [0] * MAX_BUCKET)
+        self.branches = Counter()
+
+    def __getstate__(self):
+        # the histogram factory cannot be pickled
+        return (self.calls, dict(self.totals), dict(self.maxima),
+                dict(self.histograms), self.branches)
+
+    def __setstate__(self, state):
+        self.__init__()
+        calls, totals, maxima, histograms, branches = state
+        self.calls.update(calls)
+        self.totals.update(totals)
+        self.maxima.update(maxima)
+        self.histograms.update(histograms)
+        self.branches.update(branches)
+
+    def stage(self, name, seconds):
+        "Store the duration of a stage."
+        self.calls[name] += 1
+        self.totals[name] += seconds
+        self.maxima[name] = max(self.maxima[name], seconds)
+        self.histograms[name][bucket(seconds)] += 1
+
+    def branch(self, name):
+        "Count the algorithm used for a document."
+        self.branches[name] += 1
+
+    def merge(self, other):
+        "Add the measurements of another report, e.g. from another process."
+        self.calls.update(other.calls)
+        for name, total in other.totals.items():
+            self.totals[name] += total
+        for name, maximum in other.maxima.items():
+            self.maxima[name] = max(self.maxima[name], maximum)
+        for name, histogram in other.histograms.items():
+            self.histograms[name] = [a + b for a, b in zip(self.histograms[name], histogram)]
+        self.branches.update(other.branches)
+
+    def clear(self):
+        "Reset all measurements."
+        self.__init__()
+
+    def report(self):
+        "Return a summary table as string."
+        lines = [f'{"stage":<20} {"calls":>8} {"total (s)":>10} {"mean (ms)":>10} {"max (ms)":>10}']
+        for name, total in sorted(self.totals.items(), key=lambda x: x[1], reverse=True):
+            mean = total / self.calls[name] * 1000
+            lines.append(f'{name:<20} {self.calls[name]:>8} {total:>10.3f} {mean:>10.2f} {self.maxima[name]*1000:>10.2f}')
+        if self.branches:
+            documents = sum(self.branches.values())
+            lines.append('')
+            lines.append(f'{"branch":<20} {"documents":>8} {"share":>10}')
+            for name, count in self.branches.most_common():
+                lines.append(f'{name:<20} {count:>8} {count/documents:>10.1%}')
+        return '\n'.join(lines)
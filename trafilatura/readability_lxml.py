@@ -25,6 +25,7 @@ import re
 from lxml.etree import tostring
 from lxml.html import fragment_fromstring
 
+from .htmlprocessing import NodeStats
 from .utils import trim
 
 LOGGER = logging.getLogger(__name__)
@@ -104,7 +105,7 @@ class Candidate:
 
 class Document:
     """Class to build a etree document out of html."""
-    __slots__ = ['doc', 'min_text_length', 'retry_length']
+    __slots__ = ['doc', 'min_text_length', 'retry_length', 'stats']
 
     def __init__(self, doc, min_text_length=25, retry_length=250):
         """Generate the document
@@ -122,6 +123,8 @@ class Document:
         self.doc = doc
         self.min_text_length = min_text_length
         self.retry_length = retry_length
+        # text and link lengths, kept for both passes of summary()
+        self.stats = None
 
     def get_clean_html(self):
         """
@@ -138,9 +141,10 @@ class Document:
         so it is better to call other API methods before this one.
         """
         ruthless = True
+        self.stats = NodeStats(link_tag="a")
         while True:
             for i in self.tags(self.doc, "script", "style"):
-                i.drop_tree()
+                self.drop(i)
             for i in self.tags(self.doc, "body"):
                 i.set("id", "readabilityBody")
             if ruthless:
@@ -208,6 +212,7 @@ class Document:
                     append = True
             # append to the output div
             if append:
+                self.stats.changed(parent)
                 output.append(sibling)
         #if output is not None:
         #    output.append(best_candidate.elem)
@@ -224,11 +229,22 @@ class Document:
         # return best candidate
         return sorted_candidates[0]
 
+    def text_length(self, elem):
+        "Length of the trimmed text of an element, memoized for elements."
+        if isinstance(elem.tag, str):
+            return self.stats.text_length(elem)
+        return text_length(elem)
+
     def get_link_density(self, elem):
-        total_length = text_length(elem) or 1
-        link_length = sum(text_length(elem) for elem in elem.findall(".//a"))
+        total_length = self.text_length(elem) or 1
+        link_length, _, _ = self.stats.link_info(elem)
         return link_length / total_length
 
+    def drop(self, elem):
+        "Remove an element but not its tail and update the statistics."
+        self.stats.changed(elem.getparent())
+        elem.drop_tree()
+
     def score_paragraphs(self):
         candidates = {}
         ordered = []
@@ -238,8 +254,7 @@ class Document:
                 continue
             grand_parent_node = parent_node.getparent()
 
-            elem_text = trim(elem.text_content())
-            elem_text_len = len(elem_text)
+            elem_text_len = self.text_length(elem)
 
             # don't count too short paragraphs
             if elem_text_len < self.min_text_length:
@@ -253,7 +268,8 @@ class Document:
                 candidates[grand_parent_node] = self.score_node(grand_parent_node)
                 ordered.append(grand_parent_node)
 
-            score = 1 + len(elem_text.split(",")) + min((elem_text_len / 100), 3)
+            # one point for the paragraph and one per comma-separated part
+            score = 2 + elem.text_content().count(",") + min((elem_text_len / 100), 3)
             #if elem not in candidates:
             #    candidates[elem] = self.score_node(elem)
 
@@ -307,7 +323,7 @@ class Document:
                 and (not REGEXES["okMaybeItsACandidateRe"].search(attrs))
             ):
                 # LOGGER.debug("Removing unlikely candidate: %s", elem.tag)
-                elem.drop_tree()
+                self.drop(elem)
 
     def transform_misused_divs_into_paragraphs(self):
         for elem in self.tags(self.doc, "div"):
@@ -332,6 +348,7 @@ class Document:
                     p_elem.text = elem.text
                     elem.text = None
                     elem.insert(0, p_elem)
+                    self.stats.changed(elem)
 
             for pos, child in sorted(enumerate(elem), reverse=True):
                 if child.tail and child.tail.strip():
@@ -339,8 +356,9 @@ class Document:
                     p_elem.text = child.tail
                     child.tail = None
                     elem.insert(pos + 1, p_elem)
+                    self.stats.changed(elem)
                 if child.tag == "br":
-                    child.drop_tree()
+                    self.drop(child)
 
     def tags(self, node, *tag_names):
         for tag_name in tag_names:
@@ -353,16 +371,17 @@ class Document:
     def sanitize(self, node, candidates):
         for header in self.tags(node, "h1", "h2", "h3", "h4", "h5", "h6"):
             if self.class_weight(header) < 0 or self.get_link_density(header) > 0.33:
-                header.drop_tree()
+                self.drop(header)
 
         for elem in self.tags(node, "form", "textarea"):
-            elem.drop_tree()
+            self.drop(elem)
 
         for elem in self.tags(node, "iframe"):
             if "src" in elem.attrib and REGEXES["videoRe"].search(elem.attrib["src"]):
                 elem.text = "VIDEO"  # ADD content to iframe text node to force <iframe></iframe> proper output
+                self.stats.changed(elem)
             else:
-                elem.drop_tree()
+                self.drop(elem)
 
         allowed = set()
         # Conditionally clean <table>s, <ul>s, and <div>s
@@ -377,7 +396,7 @@ class Document:
                 LOGGER.debug("Removed %s with score %6.3f and weight %-3s",
                     elem.tag, score, weight
                 )
-                elem.drop_tree()
+                self.drop(elem)
             elif elem.text_content().count(",") < 10:
                 to_remove = False
                 counts = {kind: len(elem.findall(f".//{kind}")) for kind in TEXT_CLEAN_ELEMS}
@@ -385,7 +404,7 @@ class Document:
                 counts["input"] -= len(elem.findall('.//input[@type="hidden"]'))
 
                 # Count the text length excluding any surrounding whitespace
-                content_length = text_length(elem)
+                content_length = self.text_length(elem)
                 link_density = self.get_link_density(elem)
                 parent_node = elem.getparent()
                 if parent_node is not None:
@@ -423,14 +442,14 @@ class Document:
                     # find x non empty preceding and succeeding siblings
                     siblings = []
                     for sib in elem.itersiblings():
-                        sib_content_length = text_length(sib)
+                        sib_content_length = self.text_length(sib)
                         if sib_content_length:
                             siblings.append(sib_content_length)
                             # if len(siblings) >= 1:
                             break
                     limit = len(siblings) + 1
                     for sib in elem.itersiblings(preceding=True):
-                        sib_content_length = text_length(sib)
+                        sib_content_length = self.text_length(sib)
                         if sib_content_length:
                             siblings.append(sib_content_length)
                             if len(siblings) >= limit:
@@ -444,7 +463,7 @@ class Document:
                     LOGGER.debug("Removed %6.3f %s with weight %s cause it has %s.",
                         score, elem.tag, weight, reason or ""
                     )
-                    elem.drop_tree()
+                    self.drop(elem)
                 else:
                     LOGGER.debug("Not removing %s of length %s",
                         elem.tag, content_length
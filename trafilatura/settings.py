@@ -30,7 +30,7 @@ DEFAULT_CONFIG = use_config()
 
 # Safety checks
 DOWNLOAD_THREADS = min(cpu_count(), 16)  # 16 processes at most
-LRU_SIZE = 4096
+DEDUP_MEMORY = 2**22  # bytes used by the duplicate cache, about 26000 segments
 
 # Files
 MAX_FILES_PER_DIRECTORY = 1000
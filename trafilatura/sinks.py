@@ -0,0 +1,124 @@
+"""
+Aggregated output for large collections: one document per line,
+written to a series of files by a dedicated thread.
+"""
+
+## This file is available from https://github.com/adbar/trafilatura
+## under GNU GPL v3 license
+
+import logging
+import threading
+
+from os import makedirs, path
+from queue import Queue
+
+
+LOGGER = logging.getLogger(__name__)
+
+# file extension by output format, text output is not line-based
+SINK_EXTENSIONS = {'csv': '.tsv', 'json': '.jsonl', 'xml': '.xml', 'xmltei': '.xml'}
+SINK_PREFIX = 'trafilatura'
+
+# signal sent to the writer thread once all results are queued
+STOP_SIGNAL = None
+
+
+def result_to_line(result, output_format):
+    "Convert an extraction result to a single line of text."
+    if output_format in ('xml', 'xmltei'):
+        # escaped line breaks: parsing the line gives back the same document
+        return result.strip().replace('\r', '&#13;').replace('\n', '&#10;') + '\n'
+    # JSON and CSV results are already on a single line
+    return result.rstrip('\n') + '\n'
+
+
+class OutputSink:
+    """Buffered writing of extraction results, one per line, to files
+       rotated by size or by number of documents. The files are written
+       by a separate thread so that the processing does not wait for I/O."""
+
+    def __init__(self, directory, output_format, max_size=None, max_records=None,
+                 buffer_size=2**20, queue_size=10000):
+        if output_format not in SINK_EXTENSIONS:
+            raise ValueError(f'output format not supported by aggregated files: {output_format}')
+        self.directory = directory
+        self.output_format = output_format
+        self.max_size = max_size
+        self.max_records = max_records
+        self.buffer_size = buffer_size
+        # written files, total number of documents and I/O error if any
+        self.files = []
+        self.records = 0
+        self.error = None
+        self._file_number = 0
+        makedirs(directory, exist_ok=True)
+        self._queue = Queue(maxsize=queue_size)
+        self._thread = threading.Thread(target=self._write_queue, name='output-sink', daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def write(self, result):
+        "Queue a result, waiting only if the writer thread lags far behind."
+        if result is not None:
+            self._queue.put(result)
+
+    def close(self):
+        "Write the remaining results and close the current file."
+        if self._thread.is_alive():
+            self._queue.put(STOP_SIGNAL)
+            self._thread.join()
+
+    def _next_path(self):
+        "Find the next file name without overwriting the results of previous runs."
+        while True:
+            self._file_number += 1
+            filename = path.join(self.directory, f'{SINK_PREFIX}-{self._file_number:05d}'
+                                                 f'{SINK_EXTENSIONS[self.output_format]}')
+            if not path.exists(filename):
+                return filename
+
+    def _is_full(self, size, records, linesize):
+        "Determine if the current file has to be rotated before writing a line."
+        if self.max_records and records >= self.max_records:
+            return True
+        return bool(self.max_size) and records > 0 and size + linesize > self.max_size
+
+    def _write_queue(self):
+        "Write the queued results until the stop signal is received."
+        outputfile, size, records = None, 0, 0
+        while True:
+            result = self._queue.get()
+            if result is STOP_SIGNAL:
+                break
+            # results keep on being consumed after an error so that producers do not block
+            if self.error is not None:
+                continue
+            line = result_to_line(result, self.output_format).encode('utf-8')
+            try:
+                if outputfile is None or self._is_full(size, records, len(line)):
+                    if outputfile is not None:
+                        outputfile.close()
+                    filename = self._next_path()
+                    outputfile = open(filename, 'wb', buffering=self.buffer_size)
+                    self.files.append(filename)
+                    size, records = 0, 0
+                outputfile.write(line)
+            except OSError as err:
+                LOGGER.error('cannot write aggregated output: %s', err)
+                self.error = err
+                continue
+            size += len(line)
+            records += 1
+            self.records += 1
+        if outputfile is not None:
+            try:
+                outputfile.close()
+            except OSError as err:
+                LOGGER.error('cannot write aggregated output: %s', err)
+                self.error = err
@@ -10,10 +10,10 @@ from time import sleep
 from courlan import (UrlStore, extract_links, fix_relative_urls, get_hostinfo,
                      is_navigation_page, is_not_crawlable)
 
-from .core import baseline
 from .downloads import fetch_url
 # from .feeds import find_feed_urls # extract_links ad extract_feed_links
 from .settings import DEFAULT_CONFIG
+from .turbo import turbo_text
 from .utils import decode_response, load_html
 
 # language detection
@@ -86,10 +86,9 @@ def process_links(htmlstring, url="", language=None, rules=None):
        Extract and filter new internal links after an optional language check.
        Store the links in todo-list while prioritizing the navigation ones."""
     links, links_priority = [], []
-    # optional language check: run baseline extraction + language identifier
+    # optional language check: run streaming baseline extraction + language identifier
     if language is not None and LANGID_FLAG is True and htmlstring is not None:
-        _, text, _ = baseline(htmlstring)
-        result, _ = py3langid.classify(text)
+        result, _ = py3langid.classify(turbo_text(htmlstring))
         if result != language:
             return
     # iterate through the links and filter them
@@ -0,0 +1,228 @@
+"""
+Fast text extraction without building a document tree: parsing events
+are collected as text blocks, e.g. for language checks or probing.
+"""
+
+## This file is available from https://github.com/adbar/trafilatura
+## under GNU GPL v3 license
+
+import logging
+
+from itertools import chain
+
+from lxml.etree import iterwalk
+from lxml.html import HtmlElement
+from urllib3.response import HTTPResponse
+
+from .core import JSON_SEARCH
+from .utils import StreamLoader, response_hints, trim
+
+
+LOGGER = logging.getLogger(__name__)
+
+# same elements as in baseline()
+PARAGRAPH_TAGS = frozenset({'blockquote', 'code', 'p', 'pre', 'q', 'quote'})
+SKIPPED_TAGS = frozenset({'aside', 'footer', 'script', 'style'})
+
+# size of the chunks passed to the parser, default amount of text to collect
+TURBO_CHUNK_SIZE = 2**14
+TURBO_MAX_LENGTH = 10000
+
+
+class TextBlockTarget:
+    """Parser target keeping the text blocks used by the baseline extraction:
+       article body in JSON-LD, first article element, paragraphs and body text.
+       Only the blocks which have not been retrieved yet are held in memory."""
+    __slots__ = ['blocks', 'root_children', '_depth', '_skipped', '_json', '_article', '_article_depth',
+                 '_article_done', '_paragraphs', '_in_body', '_text']
+
+    def __init__(self):
+        # list of (kind, text) tuples
+        self.blocks = []
+        # number of children of the root element, see load_html()
+        self.root_children, self._depth = 0, 0
+        # depth inside skipped elements, text of the current JSON-LD script
+        self._skipped, self._json = 0, None
+        # text of the first article while it is open
+        self._article, self._article_depth, self._article_done = [], 0, False
+        # text of the open paragraph-like elements and blocks of the ones nested in them
+        self._paragraphs = []
+        # the parser can split text nodes, e.g. on entities: the parts are put together
+        self._in_body, self._text = False, []
+
+    def start(self, tag, attrib):
+        "Register an element opening."
+        self._end_text()
+        self._depth += 1
+        if self._depth == 2:
+            self.root_children += 1
+        if tag == 'script' and attrib.get('type') == 'application/ld+json':
+            self._json = []
+        if tag in SKIPPED_TAGS:
+            self._skipped += 1
+        elif not self._skipped:
+            if tag == 'article' and not self._article_done:
+                self._article_depth += 1
+            elif tag in PARAGRAPH_TAGS:
+                self._paragraphs.append(([], []))
+            elif tag == 'body':
+                self._in_body = True
+
+    def end(self, tag):
+        "Register an element closing and emit the corresponding text blocks."
+        self._end_text()
+        self._depth -= 1
+        if tag == 'script' and self._json is not None:
+            text, self._json = ''.join(self._json), None
+            if '"article' in text:
+                match = JSON_SEARCH.search(text)
+                if match:
+                    self.blocks.append(('json', trim(match[1].replace('\\"', '"'))))
+        if tag in SKIPPED_TAGS:
+            self._skipped = max(self._skipped - 1, 0)
+        elif not self._skipped:
+            if tag == 'article' and self._article_depth:
+                self._article_depth -= 1
+                if self._article_depth == 0:
+                    self.blocks.append(('article', trim(''.join(self._article))))
+                    self._article, self._article_done = [], True
+            elif tag in PARAGRAPH_TAGS and self._paragraphs:
+                parts, nested = self._paragraphs.pop()
+                # document order: the enclosing elements come first
+                blocks = [('p', ''.join(parts))] + nested
+                (self._paragraphs[-1][1] if self._paragraphs else self.blocks).extend(blocks)
+            elif tag == 'body':
+                self._in_body = False
+
+    def data(self, text):
+        "Store text content."
+        if self._json is not None:
+            self._json.append(text)
+        if self._skipped:
+            return
+        if self._article_depth:
+            self._article.append(text)
+        for parts, _ in self._paragraphs:
+            parts.append(text)
+        if self._in_body:
+            self._text.append(text)
+
+    def _end_text(self):
+        "Emit the text of the body read since the last element opening or closing."
+        if self._text:
+            self.blocks.append(('text', ''.join(self._text)))
+            self._text = []
+
+    def close(self):
+        "Finish parsing, the blocks are retrieved separately."
+        self._end_text()
+
+    def flush(self):
+        "Return the blocks collected since the last call."
+        blocks, self.blocks = self.blocks, []
+        return blocks
+
+
+def _walk_tree(tree, target):
+    "Send the events corresponding to an existing tree to a parser target."
+    for event, elem in iterwalk(tree, events=('start', 'end')):
+        # comments and processing instructions only have a tail
+        is_element = isinstance(elem.tag, str)
+        if event == 'start':
+            if is_element:
+                target.start(elem.tag, elem.attrib)
+                if elem.text:
+                    target.data(elem.text)
+        else:
+            if is_element:
+                target.end(elem.tag)
+            if elem.tail and elem is not tree:
+                target.data(elem.tail)
+        yield target.flush()
+
+
+def iter_text_blocks(content, chunk_size=TURBO_CHUNK_SIZE):
+    """Parse a document chunk by chunk without building a tree and yield text blocks.
+
+    Args:
+        content: HTML document as string, bytestring, response object or LXML tree.
+        chunk_size: Size of the parts of the document passed to the parser.
+
+    Returns:
+        A generator of tuples (kind, text), kind being one of 'json'
+        (article body in JSON-LD), 'article' (whole first article),
+        'p' (paragraph-like elements) and 'text' (all text in the body).
+        Parsing stops as soon as the iteration is interrupted.
+        Documents rejected by load_html() do not return anything.
+
+    """
+    target = TextBlockTarget()
+    # use trees directly
+    if isinstance(content, HtmlElement):
+        for blocks in _walk_tree(content, target):
+            yield from blocks
+        return
+    declared_encoding, host = None, None
+    if isinstance(content, HTTPResponse) or hasattr(content, 'data'):
+        declared_encoding, host = response_hints(content)
+        content = content.data
+    if not isinstance(content, (bytes, str)):
+        raise TypeError('incompatible input type', type(content))
+    # strings are fed as UTF-8, chunk by chunk
+    if isinstance(content, str):
+        declared_encoding = 'utf-8'
+    loader = StreamLoader(declared_encoding, host, target)
+    chunks = (content[i:i+chunk_size] for i in range(0, len(content), chunk_size))
+    held = []
+    # the end of the document is marked by None
+    for chunk in chain(chunks, [None]):
+        if chunk is None:
+            loader.close()
+        else:
+            loader.feed(chunk.encode('utf-8', 'surrogatepass') if isinstance(chunk, str) else chunk)
+        held.extend(target.flush())
+        # same validity test as load_html(): documents which do not look like HTML
+        # need a root element with at least two children, e.g. head and body
+        if held and (target.root_children >= 2 or not loader.is_dubious()):
+            yield from held
+            held = []
+
+
+def turbo_text(content, max_length=TURBO_MAX_LENGTH):
+    """Streaming approximation of the baseline extraction, which does not build a tree
+    and stops parsing once enough text is collected.
+
+    Args:
+        content: HTML document as string, bytestring, response object or LXML tree.
+        max_length: Amount of paragraph text after which parsing stops.
+
+    Returns:
+        The extracted text in the form of a string or an empty string.
+
+    """
+    paragraphs, seen, body_text = [], set(), []
+    paragraph_length, body_length = 0, 0
+    for kind, text in iter_text_blocks(content):
+        # JSON-LD article body or long enough article: no need to go further
+        if kind == 'json':
+            return text
+        if kind == 'article':
+            if len(text) > 100:
+                return text
+        elif kind == 'p':
+            if text not in seen:
+                seen.add(text)
+                paragraphs.append(text)
+                paragraph_length += len(text)
+                if paragraph_length >= max_length:
+                    break
+        # bounded memory: the body text is only kept up to the limit
+        elif body_length < max_length:
+            text = trim(text)
+            if text:
+                body_text.append(text)
+                body_length += len(text)
+    text = trim('\n'.join(paragraphs))
+    if len(text) > 100:
+        return text
+    return '\n'.join(body_text)
@@ -7,8 +7,10 @@ Module bundling functions related to HTML and text processing.
 ## under GNU GPL v3 license
 
 # import csv
+import codecs
 import logging
 import re
+import zlib
 
 # if brotli is installed
 try:
@@ -16,12 +18,15 @@ try:
 except ImportError:
     brotli = None
 
+from copy import deepcopy
 from difflib import SequenceMatcher
 from functools import lru_cache
 from gzip import decompress
 from html import unescape
 from itertools import islice
+from time import perf_counter
 from unicodedata import normalize
+from urllib.parse import quote, urlsplit
 
 # CChardet is faster and can be more accurate
 try:
@@ -33,16 +38,72 @@ from lxml.html import HtmlElement, HTMLParser, fromstring
 # response types
 from urllib3.response import HTTPResponse
 
+from .lru import LRUCache
+
 LOGGER = logging.getLogger(__name__)
 
 UNICODE_ALIASES = {'utf-8', 'utf_8'}
 
+# encoding detection: byte order marks (UTF-32 first since it starts like UTF-16),
+# declarations in the HTTP headers and in the first bytes, statistical detection budget
+BOM_ENCODINGS = (
+    (codecs.BOM_UTF8, 'utf-8-sig'), (codecs.BOM_UTF32_LE, 'utf-32'), (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF16_LE, 'utf-16'), (codecs.BOM_UTF16_BE, 'utf-16')
+)
+HEADER_CHARSET = re.compile(r'charset\s*=\s*["\']?([\w.:-]+)', re.I)
+META_SNIFF_SIZE = 8192
+META_ENCODING = re.compile(rb'<meta\b[^>]*?charset\s*=\s*["\']?\s*([\w.:-]+)', re.I)
+DETECTION_SIZE = 15000
+# encodings found for the last visited hosts
+ENCODING_MEMORY = LRUCache(maxsize=2048)
+# bytes passed to the parser: encodings which libxml2 decodes exactly like Python,
+# by codec name (others, e.g. Shift_JIS or Big5, differ on some characters)
+PARSER_ENCODINGS = {
+    'utf-8': 'utf-8', 'utf-8-sig': 'utf-8', 'gb2312': 'gb2312', 'gbk': 'gbk', 'cp949': 'cp949', 'euc_jp': 'euc-jp',
+    'euc_kr': 'euc-kr', 'koi8-r': 'koi8-r', 'koi8-u': 'koi8-u', 'cp874': 'cp874',
+    **{f'cp125{i}': f'cp125{i}' for i in range(9)},
+    **{f'iso8859-{i}': f'iso8859-{i}' for i in range(1, 17) if i != 12},
+}
+VALIDATION_CHUNK_SIZE = 2**16
+
 DOCTYPE_TAG = re.compile("^< ?! ?DOCTYPE.+?/ ?>", re.I)
+DOCTYPE_TAG_BYTES = re.compile(DOCTYPE_TAG.pattern.encode(), re.I)
 
 # note: htmldate could use HTML comments
 # huge_tree=True, remove_blank_text=True
 HTML_PARSER = HTMLParser(collect_ids=False, default_doctype=False, encoding='utf-8', remove_comments=True, remove_pis=True)
 
+# inline payloads removed before parsing, comments are skipped
+PAYLOAD_START = re.compile(r'<!--|<(script|style|svg)(?=[\s/>])([^>]*)>', re.I)
+# the parser stops at the first closing tag of script or style elements
+PAYLOAD_END = {'script': re.compile(r'</script', re.I), 'style': re.compile(r'</style', re.I)}
+SVG_TAG = re.compile(r'<(/?)svg(?=[\s/>])([^>]*)>', re.I)
+# metadata read from scripts, see extract_meta_json()
+KEPT_SCRIPT_TYPE = re.compile(r'type\s*=\s*["\']?\s*application/(?:ld|settings)\+json', re.I)
+# same expressions for documents passed to the parser as bytes
+PAYLOAD_START_BYTES = re.compile(PAYLOAD_START.pattern.encode(), re.I)
+PAYLOAD_END_BYTES = {tag: re.compile(regex.pattern.encode(), re.I) for tag, regex in PAYLOAD_END.items()}
+SVG_TAG_BYTES = re.compile(SVG_TAG.pattern.encode(), re.I)
+KEPT_SCRIPT_TYPE_BYTES = re.compile(KEPT_SCRIPT_TYPE.pattern.encode(), re.I)
+
+# URI attributes as escaped by the HTML serializer of libxml2: leading blanks are
+# removed, whitespace, control and non-ASCII characters percent-encoded
+URI_ATTRIBUTES = ('href', 'src', 'action')
+URI_ELEMENTS_XPATH = '|'.join(f'//*[@{attribute}]' for attribute in URI_ATTRIBUTES)
+URI_UNSAFE = re.compile(r'^[ \t\n\r]|[\s\x7f-\U0010ffff]')
+URI_SAFE_CHARS = ''.join(chr(i) for i in range(33, 127))
+
+# incremental parsing: bytes used to determine the encoding, start of a full document
+SNIFF_SIZE = 16384
+FULL_HTML = re.compile(r'^\s*<(?:html|!doctype)', re.I)
+# the parser switches encodings on declarations, the stream is transcoded to UTF-8
+META_CHARSET = re.compile(r'(<meta\b[^>]*?charset\s*=\s*["\']?)[\w.:-]+', re.I)
+BLOCK_TAGS = frozenset({
+    'address', 'blockquote', 'center', 'dd', 'dir', 'div', 'dl', 'dt', 'fieldset', 'form',
+    'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'hr', 'isindex', 'li', 'menu', 'noframes', 'noscript',
+    'ol', 'p', 'pre', 'table', 'ul'
+})
+
 LINES_TRIMMING = re.compile(r'(?<![p{P}>])\n', flags=re.UNICODE|re.MULTILINE)
 
 URL_BLACKLIST_REGEX = re.compile(r'^https?://|/+$')
@@ -105,38 +166,103 @@ def isutf8(data):
     return True
 
 
+def normalize_encoding(name):
+    "Return the canonical name of an encoding label or None if it is unknown."
+    try:
+        return codecs.lookup(name).name
+    except (LookupError, TypeError, ValueError):
+        return None
+
+
+def sniff_bom(bytesobject):
+    "Return the encoding indicated by a byte order mark, if any."
+    for bom, encoding in BOM_ENCODINGS:
+        if bytesobject.startswith(bom):
+            return encoding
+    return None
+
+
+def sniff_meta_encoding(bytesobject):
+    "Find the charset declared in a meta tag among the first bytes of a document."
+    match = META_ENCODING.search(bytesobject, 0, META_SNIFF_SIZE)
+    if match is None:
+        return None
+    encoding = normalize_encoding(match[1].decode('ascii', 'ignore'))
+    # an ASCII-compatible declaration cannot be right about UTF-16/32
+    if encoding is not None and encoding.startswith(('utf-16', 'utf-32')):
+        return 'utf-8'
+    return encoding
+
+
 def detect_encoding(bytesobject):
-    """"Read all input or first chunk and return a list of encodings"""
+    """"Read the first chunk of the input and return a list of encodings
+       guessed by statistical detection, except UTF-8"""
     # alternatives: https://github.com/scrapy/w3lib/blob/master/w3lib/encoding.py
-    # unicode-test
-    if isutf8(bytesobject):
-        return ['utf-8']
+    sample = bytesobject[:DETECTION_SIZE]
     guesses = []
     # additional module
     if cchardet_detect is not None:
-        cchardet_guess = cchardet_detect(bytesobject)['encoding']
+        cchardet_guess = cchardet_detect(sample)['encoding']
         if cchardet_guess is not None:
             guesses.append(cchardet_guess.lower())
-    # try charset_normalizer on first part, fallback on full document
-    detection_results = from_bytes(bytesobject[:15000]) or from_bytes(bytesobject)
+    # try charset_normalizer on first part, fallback on a larger one
+    detection_results = from_bytes(sample) or from_bytes(bytesobject[:DETECTION_SIZE*4])
     # return alternatives
     if len(detection_results) > 0:
         guesses.extend([r.encoding for r in detection_results])
-    # it cannot be utf-8 (tested above)
+    # UTF-8 is tested before detection
     return [g for g in guesses if g not in UNICODE_ALIASES]
 
 
+def encoding_candidates(bytesobject, declared=None, host=None, utf8_first=True):
+    """Yield the encodings to try, from the most to the least reliable one:
+       byte order mark, UTF-8, charset of the HTTP headers or of a meta tag,
+       encoding previously used on the same host, and statistical detection
+       which only runs if the cheaper ones fail.
+       UTF-8 comes first since wrong declarations are frequent and single-byte
+       codecs never fail, it can only come after them if the input is incomplete."""
+    bom = sniff_bom(bytesobject)
+    if bom is not None:
+        yield bom
+    seen = set()
+    remembered = ENCODING_MEMORY.get(host) if host else -1
+    declarations = (declared, sniff_meta_encoding(bytesobject))
+    ordered = ('utf-8',) + declarations if utf8_first else declarations + ('utf-8',)
+    for candidate in ordered + (remembered if remembered != -1 else None,):
+        candidate = normalize_encoding(candidate) if candidate else None
+        if candidate is not None and candidate not in seen:
+            seen.add(candidate)
+            yield candidate
+    for candidate in detect_encoding(bytesobject):
+        if candidate not in seen:
+            seen.add(candidate)
+            yield candidate
+
+
+def response_hints(response):
+    "Return the charset declared in the headers of a response and its host, if available."
+    if isinstance(response, HTTPResponse):
+        charset = HEADER_CHARSET.search(response.headers.get('Content-Type', ''))
+        url = response.geturl()
+        return (charset[1] if charset else None), (urlsplit(url).hostname if url else None)
+    # see downloads.RawResponse
+    charset, url = getattr(response, 'charset', None), getattr(response, 'url', None)
+    return (charset if isinstance(charset, str) else None), (urlsplit(url).hostname if isinstance(url, str) and url else None)
+
+
 def decode_response(response):
     """Read the urllib3 object corresponding to the server response,
        check if it could be GZip and eventually decompress it, then
        try to guess its encoding and decode it to return a unicode string"""
     # urllib3 response object / bytes switch
-    resp_content = response if isinstance(response, bytes) else response.data
-    return decode_file(resp_content)
+    if isinstance(response, bytes):
+        return decode_file(response)
+    return decode_file(response.data, *response_hints(response))
 
 
-def decode_file(filecontent):
-    """Guess bytestring encoding and try to decode to Unicode string.
+def decode_file(filecontent, declared_encoding=None, host=None):
+    """Guess bytestring encoding and try to decode to Unicode string,
+       using the declared encoding and the one of the host if known.
        Resort to destructive conversion otherwise."""
     # init
     if isinstance(filecontent, str):
@@ -145,13 +271,15 @@ def decode_file(filecontent):
     # GZip and Brotli test
     filecontent = handle_compressed_file(filecontent)
     # encoding
-    for guessed_encoding in detect_encoding(filecontent):
+    for guessed_encoding in encoding_candidates(filecontent, declared_encoding, host):
         try:
             htmltext = filecontent.decode(guessed_encoding)
         except (LookupError, UnicodeDecodeError): # VISCII: lookup
-            LOGGER.warning('wrong encoding detected: %s', guessed_encoding)
+            LOGGER.debug('wrong encoding detected: %s', guessed_encoding)
             htmltext = None
         else:
+            if host:
+                ENCODING_MEMORY.put(host, guessed_encoding)
             break
     # return original content if nothing else succeeded
     return htmltext or str(filecontent, encoding='utf-8', errors='replace')
@@ -162,12 +290,18 @@ def is_dubious_html(beginning: str) -> bool:
     return "html" not in beginning
 
 
-def strip_faulty_doctypes(htmlstring: str, beginning: str) -> str:
-    "Repair faulty doctype strings to make then palatable for libxml2."
+def strip_faulty_doctypes(htmlstring, beginning: str):
+    "Repair faulty doctype strings (text or bytes) to make then palatable for libxml2."
     # libxml2/LXML issue: https://bugs.launchpad.net/lxml/+bug/1955915
     if "doctype" in beginning:
-        firstline, _, rest = htmlstring.partition("\n")
-        return DOCTYPE_TAG.sub("", firstline, count=1) + "\n" + rest
+        is_text = isinstance(htmlstring, str)
+        # only the first line is concerned, the rest of the document is not copied if it does not match
+        newline = htmlstring.find("\n" if is_text else b"\n")
+        match = (DOCTYPE_TAG if is_text else DOCTYPE_TAG_BYTES).match(
+            htmlstring, 0, newline if newline != -1 else len(htmlstring)
+        )
+        if match is not None:
+            return htmlstring[match.end():]
     return htmlstring
 
 
@@ -175,38 +309,167 @@ def fromstring_bytes(htmlobject):
     "Try to pass bytes to LXML parser."
     tree = None
     try:
-        tree = fromstring(htmlobject.encode('utf8', 'surrogatepass'), parser=HTML_PARSER)
+        if isinstance(htmlobject, str):
+            htmlobject = htmlobject.encode('utf8', 'surrogatepass')
+        tree = fromstring(htmlobject, parser=HTML_PARSER)
     except Exception as err:
         LOGGER.error('lxml parser bytestring %s', err)
     return tree
 
 
-def load_html(htmlobject):
+def is_valid_encoding(bytesobject, encoding):
+    "Test if a bytestring can be decoded, by chunks so that no decoded copy of the whole document is made."
+    try:
+        decoder = codecs.getincrementaldecoder(encoding)()
+        view = memoryview(bytesobject)
+        for i in range(0, len(view), VALIDATION_CHUNK_SIZE):
+            decoder.decode(view[i:i+VALIDATION_CHUNK_SIZE])
+        decoder.decode(b'', final=True)
+    except (LookupError, UnicodeDecodeError):
+        return False
+    return True
+
+
+def select_encoding(bytesobject, declared_encoding=None, host=None):
+    "Return the first candidate encoding which decodes the bytestring, or None."
+    for guessed_encoding in encoding_candidates(bytesobject, declared_encoding, host):
+        if is_valid_encoding(bytesobject, guessed_encoding):
+            if host:
+                ENCODING_MEMORY.put(host, guessed_encoding)
+            return guessed_encoding
+    return None
+
+
+@lru_cache(maxsize=64)
+def encoding_parser(encoding):
+    "Return a parser for bytes in the given encoding, or None if it cannot be delegated to libxml2."
+    if encoding not in PARSER_ENCODINGS:
+        return None
+    try:
+        return HTMLParser(collect_ids=False, default_doctype=False, encoding=PARSER_ENCODINGS[encoding],
+                          remove_comments=True, remove_pis=True)
+    except LookupError:
+        return None
+
+
+def payload_end(htmlstring, tag, attributes, position):
+    "Find the end of an element starting at the given position, -1 if it is not closed."
+    is_text = isinstance(htmlstring, str)
+    # empty element, e.g. <script src="..."/>
+    if attributes.endswith('/' if is_text else b'/'):
+        return position
+    if tag in PAYLOAD_END:
+        match = (PAYLOAD_END if is_text else PAYLOAD_END_BYTES)[tag].search(htmlstring, position)
+        if match is None:
+            return -1
+        end = htmlstring.find('>' if is_text else b'>', match.end())
+        return end + 1 if end != -1 else -1
+    # svg elements can be nested
+    depth = 1
+    for match in (SVG_TAG if is_text else SVG_TAG_BYTES).finditer(htmlstring, position):
+        if match[1]:
+            depth -= 1
+            if depth == 0:
+                return match.end()
+        elif not match[2].endswith('/' if is_text else b'/'):
+            depth += 1
+    return -1
+
+
+def remove_payloads(htmlstring):
+    """Empty script, style and svg elements in an HTML string or bytestring
+       before parsing, except the scripts containing metadata (JSON-LD)."""
+    is_text = isinstance(htmlstring, str)
+    start_regex, kept_regex = (PAYLOAD_START, KEPT_SCRIPT_TYPE) if is_text else (PAYLOAD_START_BYTES, KEPT_SCRIPT_TYPE_BYTES)
+    parts, position, last = [], 0, 0
+    while True:
+        match = start_regex.search(htmlstring, position)
+        if match is None:
+            break
+        # skip comments
+        if match[1] is None:
+            position = htmlstring.find('-->' if is_text else b'-->', match.end())
+            if position == -1:
+                break
+            continue
+        tag, attributes = match[1].lower(), match[2]
+        if not is_text:
+            tag = tag.decode('ascii')
+        end = payload_end(htmlstring, tag, attributes.rstrip(), match.end())
+        if end == -1:
+            # unclosed element: left to the parser
+            position = match.end()
+            continue
+        if not (tag == 'script' and kept_regex.search(attributes)):
+            # empty element left in place: same tree structure as without stripping
+            parts.append(htmlstring[last:match.start()])
+            parts.append(f'<{tag}></{tag}>' if is_text else f'<{tag}></{tag}>'.encode('ascii'))
+            last = end
+        position = end
+    if not parts:
+        return htmlstring
+    parts.append(htmlstring[last:])
+    return ('' if is_text else b'').join(parts)
+
+
+def escape_uris(tree):
+    '''Percent-encode the links and sources of a tree in place,
+       like the serialization and parsing of the tree would do'''
+    for elem in tree.xpath(URI_ELEMENTS_XPATH):
+        for attribute in URI_ATTRIBUTES:
+            value = elem.get(attribute)
+            if value is not None and URI_UNSAFE.search(value):
+                elem.set(attribute, quote(value.lstrip(' \t\n\r'), safe=URI_SAFE_CHARS))
+    return tree
+
+
+def load_html(htmlobject, strip_payloads=False):
     """Load object given as input and validate its type
-    (accepted: lxml.html tree, trafilatura/urllib3 response, bytestring and string)
+    (accepted: lxml.html tree, trafilatura/urllib3 response, bytestring and string),
+    optionally remove script, style and svg elements before parsing
     """
     # use tree directly
     if isinstance(htmlobject, HtmlElement):
         return htmlobject
     # use trafilatura or urllib3 responses directly
+    declared_encoding, host = None, None
     if isinstance(htmlobject, HTTPResponse) or hasattr(htmlobject, 'data'):
+        declared_encoding, host = response_hints(htmlobject)
         htmlobject = htmlobject.data
     # do not accept any other type after this point
     if not isinstance(htmlobject, (bytes, str)):
         raise TypeError('incompatible input type', type(htmlobject))
     # start processing
     tree = None
-    # try to guess encoding and decode file: if None then keep original
-    htmlobject = decode_file(htmlobject)
+    parser = HTML_PARSER
+    if isinstance(htmlobject, bytes):
+        htmlobject = handle_compressed_file(htmlobject)
+        encoding = select_encoding(htmlobject, declared_encoding, host)
+        # pass bytes to the parser if it decodes them like Python, decode them otherwise
+        if encoding_parser(encoding) is not None:
+            parser = encoding_parser(encoding)
+            # lxml only recognizes full documents at the start of the input
+            if encoding == 'utf-8-sig':
+                htmlobject = htmlobject[len(codecs.BOM_UTF8):]
+        elif encoding is not None:
+            htmlobject = htmlobject.decode(encoding)
+        else:
+            # see decode_file()
+            htmlobject = str(htmlobject, encoding='utf-8', errors='replace')
     # sanity checks
     beginning = htmlobject[:50].lower()
+    if isinstance(beginning, bytes):
+        beginning = beginning.decode('ascii', 'replace')
     check_flag = is_dubious_html(beginning)
     # repair first
     htmlobject = strip_faulty_doctypes(htmlobject, beginning)
-    # first pass: use Unicode string
-    fallback_parse = False
+    # parsing large inline payloads would be useless
+    if strip_payloads is True:
+        htmlobject = remove_payloads(htmlobject)
+    # first pass: use Unicode string or bytes with known encoding
+    fallback_parse = isinstance(htmlobject, bytes)
     try:
-        tree = fromstring(htmlobject, parser=HTML_PARSER)
+        tree = fromstring(htmlobject, parser=parser)
     except ValueError:
         # "Unicode strings with encoding declaration are not supported."
         tree = fromstring_bytes(htmlobject)
@@ -224,6 +487,187 @@ def load_html(htmlobject):
     return tree
 
 
+def stream_encoding(prefix, declared=None, host=None):
+    """Choose an encoding from the beginning of a document, the charset
+       declared in the HTTP headers and the encoding of the host, if any"""
+    # an ASCII prefix does not tell if the rest is UTF-8: declarations come first
+    try:
+        prefix.decode('ascii')
+        utf8_first = False
+    except UnicodeDecodeError:
+        utf8_first = True
+    for candidate in encoding_candidates(prefix, declared, host, utf8_first):
+        try:
+            # multi-byte characters can be cut at the end of the prefix
+            codecs.getincrementaldecoder(candidate)().decode(prefix)
+        except (LookupError, UnicodeDecodeError):
+            continue
+        if host:
+            ENCODING_MEMORY.put(host, candidate)
+        return candidate
+    return 'utf-8'
+
+
+def contains_block(element):
+    "Tell if an element has block-level descendants."
+    return any(elem.tag in BLOCK_TAGS for elem in element.iterdescendants())
+
+
+class StreamLoader:
+    """Parse a document while it is being received: the chunks are
+       decompressed, decoded and fed to an lxml feed parser so that
+       the result corresponds to load_html() on the whole file.
+       Parsing events can be sent to a parser target instead of building a tree."""
+    __slots__ = ['declared_encoding', 'host', 'target', 'size', '_prefix', '_pending', '_decompressor',
+                 '_decoder', '_parser', '_beginning', '_full']
+
+    def __init__(self, declared_encoding=None, host=None, target=None):
+        # charset of the Content-Type header, can be set until parsing starts
+        self.declared_encoding = declared_encoding
+        # known encodings are reused for the pages of the same host
+        self.host = host
+        # lxml parser target, see https://lxml.de/parsing.html#the-target-parser-interface
+        self.target = target
+        # number of bytes received
+        self.size = 0
+        self._prefix, self._pending = [], ''
+        self._decompressor = self._decoder = self._parser = None
+        self._beginning, self._full = '', False
+
+    def _start(self):
+        "Sniff compression and encoding on the first bytes and start parsing."
+        data = b''.join(self._prefix)
+        self._prefix = None
+        if data[:2] == b'\x1f\x8b':
+            self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            data = self._decompress(data)
+        self._decoder = codecs.getincrementaldecoder(
+            stream_encoding(data[:SNIFF_SIZE], self.declared_encoding, self.host))(errors='replace')
+        text = self._decoder.decode(data)
+        self._beginning = text[:50].lower()
+        # see strip_faulty_doctypes(), the first line can be incomplete
+        if 'doctype' in self._beginning:
+            text = DOCTYPE_TAG.sub('', text, count=1)
+        self._full = FULL_HTML.match(text) is not None
+        text = META_CHARSET.sub(r'\1utf-8', text)
+        self._parser = HTMLParser(collect_ids=False, default_doctype=False, encoding='utf-8',
+                                  remove_comments=True, remove_pis=True, target=self.target)
+        self._push(text)
+
+    def _push(self, text):
+        "Feed the parser up to the last complete tag."
+        # libxml2 can miss the end of script elements if a closing tag is split
+        text = self._pending + text
+        end = text.rfind('>') + 1
+        if end > 0:
+            self._parser.feed(text[:end])
+        self._pending = text[end:]
+
+    def _decompress(self, data):
+        "Decompress GZipped data as it arrives."
+        try:
+            return self._decompressor.decompress(data)
+        except zlib.error:
+            LOGGER.warning('invalid GZ data')
+            self._decompressor = None
+            return data
+
+    def feed(self, chunk):
+        "Add a chunk of bytes to the document."
+        self.size += len(chunk)
+        if self._parser is None:
+            self._prefix.append(chunk)
+            if self.size >= SNIFF_SIZE:
+                self._start()
+            return
+        if self._decompressor is not None:
+            chunk = self._decompress(chunk)
+        self._push(self._decoder.decode(chunk))
+
+    def is_dubious(self):
+        "Tell if the beginning of the document does not look like HTML."
+        return is_dubious_html(self._beginning)
+
+    def close(self):
+        """Finish parsing and return the tree, or None if it is not valid HTML.
+           With a parser target, the result of its close() method is returned."""
+        if self._parser is None:
+            if self.size == 0:
+                return None
+            self._start()
+        self._parser.feed(self._pending + self._decoder.decode(b'', final=True))
+        try:
+            doc = self._parser.close()
+        except Exception as err:
+            LOGGER.error('lxml parsing failed: %s', err)
+            return None
+        if self.target is not None:
+            return doc
+        tree = self._root(doc)
+        # same validity checks as load_html()
+        if tree is None or len(tree) < 1 or (is_dubious_html(self._beginning) and len(tree) < 2):
+            LOGGER.error('parsed tree length: %s, wrong data type or not valid HTML', len(tree) if tree is not None else 0)
+            return None
+        return tree
+
+    def _root(self, doc):
+        "Determine the root of the tree the way lxml.html.fromstring() does it."
+        if doc is None or self._full or doc.find('head') is not None:
+            return doc
+        body = doc.find('body')
+        if body is None:
+            return doc
+        # single element without surrounding text
+        if len(body) == 1 and not (body.text or '').strip() and not (body[-1].tail or '').strip():
+            return body[0]
+        body.tag = 'div' if contains_block(body) else 'span'
+        return body
+
+
+class TreeSnapshot:
+    """Keep the original state of a document and only materialize copies on demand:
+       raw input is parsed again and trees are copied, the original is left untouched.
+       Links are made absolute if a base URL is given."""
+    __slots__ = ['_source', '_strip_payloads', '_base_url']
+
+    def __init__(self, source, strip_payloads=False, base_url=None):
+        # no copy needed for now, the source is never modified
+        self._source, self._strip_payloads, self._base_url = source, strip_payloads, base_url
+
+    def get(self):
+        "Return a new working copy of the original tree."
+        if isinstance(self._source, HtmlElement):
+            tree = deepcopy(self._source)
+        else:
+            tree = load_html(self._source, self._strip_payloads)
+        if tree is not None and self._base_url is not None:
+            tree.make_links_absolute(self._base_url)
+            escape_uris(tree)
+        return tree
+
+
+class ExtractionTimeout(RuntimeError):
+    "The time allotted to the processing of a document has been exhausted."
+
+
+class TimeBudget:
+    "Cooperative time limit for a document, checked between and within processing stages."
+    __slots__ = ['deadline']
+
+    def __init__(self, seconds=None):
+        # no limit if the value is None or 0
+        self.deadline = perf_counter() + seconds if seconds else None
+
+    def exhausted(self):
+        "Tell if the processing time is over."
+        return self.deadline is not None and perf_counter() > self.deadline
+
+    def check(self):
+        "Abort the processing if the time is over."
+        if self.exhausted():
+            raise ExtractionTimeout('unusual file processing time, aborting')
+
+
 def txttocsv(text, comments, docmeta):
     '''Output the result in CSV format (tab-separated values)'''
     # outputwriter = csv.writer(sys.stdout, delimiter='\t', quoting=csv.QUOTE_NONE)